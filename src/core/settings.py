@@ -14,6 +14,7 @@ from pythonjsonlogger import jsonlogger
 import json, yaml
 from et3.render import render_item
 from et3.extract import path as p
+from django.utils.functional import SimpleLazyObject
 
 PROJECT_NAME = "lax"
 
@@ -126,9 +127,12 @@ TEMPLATES = [
 WSGI_APPLICATION = "core.wsgi.application"
 
 # a process-wide manager is only available if lax is called with LAX_MULTIPROCESSING=1
-# this manager is not available from uwsgi-started process or a fork
+# this manager is not available from uwsgi-started process or a fork.
+# the manager process is started the first time it is used.
 MP_MANAGER = (
-    multiprocessing.Manager() if os.environ.get("LAX_MULTIPROCESSING") else None
+    SimpleLazyObject(multiprocessing.Manager)
+    if os.environ.get("LAX_MULTIPROCESSING")
+    else None
 )
 
 # Testing
@@ -183,6 +187,8 @@ STATICFILES_DIRS = (os.path.join(SRC_DIR, "static"),)
 #
 
 EXPLORER_S3_BUCKET = cfg("general.reporting-bucket", None)
+# a local S3 stand-in for development and testing, like localstack
+EXPLORER_S3_ENDPOINT_URL = cfg("general.reporting-endpoint-url", None)
 EXPLORER_CONNECTIONS = {"default": "default"}
 EXPLORER_DEFAULT_CONNECTION = "default"
 
@@ -225,11 +231,40 @@ SCHEMA_VERSIONS = {
     tpe: [row[0] for row in rows] for tpe, rows in ALL_SCHEMA_IDX.items()
 }
 
+
+class LazyMap(dict):
+    """a dictionary of known keys whose values are loaded with `loader` the first time they are requested.
+    settings are read by every `manage.py` invocation and every uwsgi worker, most of which need few or none of them.
+    see `core.wsgi.preload`"""
+
+    def __init__(self, key_list, loader):
+        super().__init__()
+        self.key_list = list(key_list)
+        self.loader = loader
+
+    def __missing__(self, key):
+        if key not in self.key_list:
+            raise KeyError(key)
+        val = self[key] = self.loader(key)
+        return val
+
+    def load_all(self):
+        "loads any values not yet loaded"
+        for key in self.key_list:
+            self[key]
+        return self
+
+
+def _load_json(path):
+    with open(path, "rb") as fh:
+        return json.load(fh)
+
+
 # {"/path/to/api-raml/dist/model/article-vor.v7.json": {...}, ...}
-SCHEMA_MAP = {}
-for path_list in ALL_SCHEMA_IDX.values():
-    for _, path in path_list:
-        SCHEMA_MAP[path] = json.load(open(path, "rb"))
+SCHEMA_MAP = LazyMap(
+    [path for path_list in ALL_SCHEMA_IDX.values() for _, path in path_list],
+    _load_json,
+)
 
 API_PATH = join(SCHEMA_PATH, "api.raml")
 
@@ -245,15 +280,17 @@ def _load_api_raml(path):
     return api["traits"]["paged"]["queryParameters"]
 
 
-API_OPTS = render_item(
-    {
-        "per_page": [p("per-page.default"), int],
-        "min_per_page": [p("per-page.minimum"), int],
-        "max_per_page": [p("per-page.maximum"), int],
-        "page_num": [p("page.default"), int],
-        "order_direction": [p("order.default")],
-    },
-    _load_api_raml(API_PATH),
+API_OPTS = SimpleLazyObject(
+    lambda: render_item(
+        {
+            "per_page": [p("per-page.default"), int],
+            "min_per_page": [p("per-page.minimum"), int],
+            "max_per_page": [p("per-page.maximum"), int],
+            "page_num": [p("page.default"), int],
+            "order_direction": [p("order.default")],
+        },
+        _load_api_raml(API_PATH),
+    )
 )
 
 # load raw SQL
@@ -265,10 +302,18 @@ SQL_LIST = [
     "external-relationships-for-msid.sql",
     "reviewed-preprints-for-av-id.sql",
 ]
-SQL_MAP = {
-    os.path.basename(path): open(os.path.join(SQL_PATH, path), "r").read()
-    for path in SQL_LIST
-}
+
+
+def _load_sql(filename):
+    with open(join(SQL_PATH, filename), "r") as fh:
+        return fh.read()
+
+
+SQL_MAP = LazyMap(SQL_LIST, _load_sql)
+
+# load the above in the uwsgi master process so forked workers share them.
+# see `core.wsgi.preload`
+PRELOAD_SETTINGS = cfg("general.preload-settings", True)
 
 # KONG gateway options
 
@@ -284,8 +329,17 @@ EVENT_BUS = {
     "subscriber": cfg("bus.subscriber"),
     "name": cfg("bus.name"),
     "env": cfg("bus.env"),
+    # a local SNS stand-in for development and testing, like localstack
+    "endpoint-url": cfg("bus.endpoint-url", None),
 }
 
+# when True, notifications are written to an outbox table in the same transaction as the change to the article
+# and sent by the `dispatch_events` command. when False they are sent by the process making the change, after commit.
+EVENT_OUTBOX = cfg("bus.outbox", False)
+# seconds a notification waits in the outbox before it is sent.
+# repeated notifications for the same article within this window are sent as a single message.
+EVENT_OUTBOX_WINDOW = int(cfg("bus.outbox-window", 0))
+
 # Lax settings
 
 # toggle to bypass the creation of relationships between articles internally.
@@ -297,6 +351,12 @@ RELATED_ARTICLE_STUBS = cfg("general.related-article-stubs", True)
 # allow fragments pushed in from other sources?
 MERGE_FOREIGN_FRAGMENTS = cfg("general.merge-foreign-fragments", True)
 
+# journal of files processed by long running commands, used to resume them if interrupted.
+# see `publisher/checkpoint.py`
+CHECKPOINT_FILE = cfg(
+    "general.checkpoint-file", join(PROJECT_DIR, "checkpoint.sqlite3")
+)
+
 #
 # logging
 #
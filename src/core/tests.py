@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.test import TestCase, Client, override_settings
-from core import middleware as mware
+from core import middleware as mware, settings as csettings
 
 
 class KongAuthMiddleware(TestCase):
@@ -78,3 +78,27 @@ class DownstreamCaching(TestCase):
         return [
             directive.strip() for directive in resp.get("Cache-Control", "").split(",")
         ]
+
+
+class LazySettings(TestCase):
+    def test_lazy_map(self):
+        "values are loaded once, on first use, and only for known keys"
+        loaded = []
+
+        def loader(key):
+            loaded.append(key)
+            return key.upper()
+
+        lazy_map = csettings.LazyMap(["foo", "bar"], loader)
+        self.assertEqual(loaded, [])
+        self.assertEqual(lazy_map["foo"], "FOO")
+        self.assertEqual(lazy_map["foo"], "FOO")
+        self.assertEqual(loaded, ["foo"])
+        self.assertRaises(KeyError, lambda: lazy_map["baz"])
+        lazy_map.load_all()
+        self.assertEqual(loaded, ["foo", "bar"])
+
+    def test_sql_map(self):
+        "sql is loaded on first use"
+        for filename in settings.SQL_LIST:
+            self.assertTrue(settings.SQL_MAP[filename].strip())
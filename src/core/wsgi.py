@@ -12,5 +12,20 @@ import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 from django.core.wsgi import get_wsgi_application
+from django.conf import settings
 
 application = get_wsgi_application()
+
+
+def preload():
+    """loads the schemas, api-raml and sql that are otherwise loaded on first use.
+    uwsgi imports this module in its master process before forking workers (unless `lazy-apps` is set),
+    so workers share what is loaded here copy-on-write rather than each loading it on their first request.
+    """
+    settings.SCHEMA_MAP.load_all()
+    settings.SQL_MAP.load_all()
+    dict(settings.API_OPTS)
+
+
+if settings.PRELOAD_SETTINGS:
+    preload()
@@ -67,14 +67,16 @@ class ArticleAdmin(admin.ModelAdmin):
         super(ArticleAdmin, self).delete_model(request, art)
         # simpler to disable hash check when updating many articles
         fragment_logic.set_all_article_json(art, quiet=True, hash_check=False)
-        aws_events.notify(art.manuscript_id)
+        aws_events.enqueue(art.manuscript_id)
 
     def save_related(self, request, form, formsets, change):
         super(ArticleAdmin, self).save_related(request, form, formsets, change)
         art = form.instance
+        # article versions may have been modified inline
+        art.summarise()
         # simpler to disable hash check when updating many articles
         fragment_logic.set_all_article_json(art, quiet=True, hash_check=False)
-        aws_events.notify(art.manuscript_id)
+        aws_events.enqueue(art.manuscript_id)
 
 
 admin_list = [(models.Publisher,), (models.Journal,), (models.Article, ArticleAdmin)]
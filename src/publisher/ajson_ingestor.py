@@ -3,6 +3,7 @@ see `events.py` for converting article-json into ArticleEvent data."""
 
 import json
 import copy
+from functools import wraps
 from publisher import (
     models,
     utils,
@@ -15,10 +16,8 @@ from publisher import relation_logic as relationships, codes
 from publisher.models import XML2JSON
 from publisher.utils import create_or_update, StateError, atomic
 import logging
-from django.db import transaction
 from et3 import render
 from et3.extract import path as p
-from functools import partial
 from jsonschema import ValidationError
 
 LOG = logging.getLogger(__name__)
@@ -60,8 +59,9 @@ REVIEWED_PREPRINT = {
 #
 
 
-def _ingest_objects(data, create, update, force, log_context):
-    "INGEST event helper. returns the journal, article, an article version and a list of article events"
+def _ingest_objects(data, create, update, force, log_context, dry_run=False):
+    """INGEST event helper. returns the journal, article, an article version and a list of article events.
+    `dry_run=True` will find or create the objects in memory only."""
 
     # WARN: log_context is a mutable dict
 
@@ -71,7 +71,7 @@ def _ingest_objects(data, create, update, force, log_context):
     # this *could* be scraped from the provided data, but we have no time to
     # normalize journal names so we sometimes get duplicate journals in the db.
     # safer to disable until needed.
-    journal = logic.journal()
+    journal = logic.journal(create=not dry_run)
 
     try:
         article_struct = render.render_item(ARTICLE, data["article"])
@@ -82,8 +82,12 @@ def _ingest_objects(data, create, update, force, log_context):
             unique_key_list,
             create,
             update,
+            commit=not dry_run,
             journal=journal,
         )
+        if dry_run and (created or updated):
+            # `create_or_update` will only validate the object when it is saved
+            article.full_clean(exclude=["journal"])
         log_context["article"] = article
 
         previous_article_versions = []
@@ -110,7 +114,8 @@ def _ingest_objects(data, create, update, force, log_context):
         )
         log_context["article-version"] = av
 
-        events.ajson_ingest_events(article, data["article"], force)
+        if not dry_run:
+            events.ajson_ingest_events(article, data["article"], force)
 
         return av, created, updated, previous_article_versions
 
@@ -123,23 +128,86 @@ def _ingest_objects(data, create, update, force, log_context):
 
 def _update_relationships(av, data, create, update, force):
     """render the various '-related-articles-*' metadata attached to the payload into article relationships.
-    any existing relationships are removed before new ones are created.
+    existing relationships not present in the payload are removed and only new relationships are created.
     This prevents changes to relations in the XML from from accumulating during ingest.
     """
-    relationships.remove_relationships(av)
-    relationships.relate_using_msid_list(
+    relationships.sync_msid_list(
         av, data["article"].get("-related-articles-internal", []), quiet=force
     )
-    relationships.relate_using_citation_list(
+    relationships.sync_citation_list(
         av, data["article"].get("-related-articles-external", [])
     )
+    rpp_list = []
     for rpp in data["article"].get("-related-articles-reviewed-preprints", []):
         rpp_struct = render.render_item(REVIEWED_PREPRINT, rpp)
         key = ["manuscript_id"]
         rpp_obj, _, _ = create_or_update(
             models.ReviewedPreprint, rpp_struct, key, create, update
         )
-        relationships.relate_using_reviewed_preprint(av, rpp_obj)
+        rpp_list.append(rpp_obj)
+    relationships.sync_reviewed_preprint_list(av, rpp_list)
+
+
+def _check_relationships(av, data, force):
+    """dry-run counterpart to `_update_relationships`.
+    raises the same errors for bad relationship data without writing anything."""
+    relationships.check_msid_list(
+        av, data["article"].get("-related-articles-internal", []), quiet=force
+    )
+    relationships.check_citation_list(
+        data["article"].get("-related-articles-external", [])
+    )
+    for rpp in data["article"].get("-related-articles-reviewed-preprints", []):
+        rpp_struct = render.render_item(REVIEWED_PREPRINT, rpp)
+        key = ["manuscript_id"]
+        rpp_obj, created, updated = create_or_update(
+            models.ReviewedPreprint, rpp_struct, key, commit=False
+        )
+        if created or updated:
+            rpp_obj.full_clean()
+
+
+def _identical_ingest(data, force=False, publish=False):
+    """raises an `Identical` error if the given article-json is the same as the article-json last ingested
+    for that article version and the request would otherwise change nothing.
+    Only reads from the database. Anything that can't be decided here is left to the full INGEST.
+    """
+    try:
+        msid, version = int(data["article"]["id"]), data["article"]["version"]
+    except (KeyError, ValueError, TypeError):
+        return
+
+    av = (
+        models.ArticleVersion.objects.select_related("article")
+        .defer("article_json_v1_snippet")
+        .filter(article__manuscript_id=msid, version=version)
+        .first()
+    )
+    if not av or not av.article_json_hash or not av.article_json_ingest_hash:
+        # nothing ingested yet or ingested before ingest hashes were being stored
+        return
+
+    if av.published():
+        if not force:
+            # business rules are checked before identity, see `_ingest`
+            return
+        if av.version == 1:
+            # a forced INGEST will update the v1 publication date from the article-json
+            try:
+                if (
+                    utils.todt(data["article"].get("published"))
+                    != av.datetime_published
+                ):
+                    return
+            except (ValueError, TypeError):
+                return
+    elif publish:
+        # publishing an unpublished article version will always change the article-json
+        return
+
+    if fragments.hash_ingest(data["article"], av) == av.article_json_ingest_hash:
+        msg = "article data is identical to the article data already stored"
+        raise fragments.Identical(msg, av, av.article_json_hash)
 
 
 #
@@ -147,17 +215,24 @@ def _update_relationships(av, data, create, update, force):
 #
 
 
-def _ingest(data, force=False) -> models.ArticleVersion:
+def _ingest(data, force=False, publish=False, dry_run=False) -> models.ArticleVersion:
     """ingests article-json. returns a triple of (journal obj, article obj, article version obj)
     unpublished article-version data can be ingested multiple times UNLESS that article version has been published.
-    published article-version data can be ingested only if `force=True`."""
+    published article-version data can be ingested only if `force=True`.
+    `publish=True` will also publish the article version, rendering the article-json just once.
+    `dry_run=True` will check and render the article-json against objects in memory, writing nothing.
+    """
 
     create = update = True
     log_context = {}
 
     try:
+        # re-deliveries of identical article data are common during backfills.
+        # skip them before any objects are created or updated.
+        _identical_ingest(data, force, publish)
+
         av, created, updated, previous_article_versions = _ingest_objects(
-            data, create, update, force, log_context
+            data, create, update, force, log_context, dry_run
         )
 
         # enforce business rules
@@ -219,26 +294,42 @@ def _ingest(data, force=False) -> models.ArticleVersion:
         # this is so business rules (attempting to ingest out of order) are checked before
         # identity (this data already exists) and validity (this data is malformed)
 
-        # validation and hash check of article-json occurs here
-        quiet = force
         # only update the fragment if this article version has *not* been published *or* if force=True
         update_fragment = not av.published() or force
+
+        if publish:
+            # INGEST+PUBLISH: determine the publication date *before* the article-json is rendered
+            # so it is merged, validated and saved once rather than once per request type.
+            av.datetime_published = _publication_date(av, data["article"], force)
+
+        # validation and hash check of article-json occurs here
+        quiet = force
         fragments.set_article_json(
-            av, data, quiet=quiet, hash_check=True, update_fragment=update_fragment
+            av,
+            data,
+            quiet=quiet,
+            hash_check=True,
+            update_fragment=update_fragment,
+            dry_run=dry_run,
         )
 
+        if dry_run:
+            _check_relationships(av, data, force)
+            return _touch(av)
+
         # `av` at this point has been `.save`d inside `fragments.set_article_json` and has
         # an `id` value that we can use to relate it to other objects.
 
         # update the relationships
         _update_relationships(av, data, create, update, force)
 
-        # passed all checks, save
-        # lsh@2023-09-19: save again? this could be unnecessary
-        av.save()
+        av.article.summarise()
+
+        if publish:
+            events.ajson_publish_events(av, force)
 
         # notify event bus that article change has occurred
-        transaction.on_commit(partial(aws_events.notify_all, av))
+        aws_events.enqueue_all(av)
 
         return av
 
@@ -265,19 +356,94 @@ def _ingest(data, force=False) -> models.ArticleVersion:
         raise
 
 
+def record_ingest_hash(fn):
+    """wraps `fn`, an ingest request, so that identical article data that had to be rendered to be found identical
+    records its ingest hash once the request's transaction has been rolled back.
+    the next delivery of the same data is then detected before anything is written, see `_identical_ingest`.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except fragments.Identical as err:
+            if err.ingest_hash and err.av.pk and not kwargs.get("dry_run"):
+                models.ArticleVersion.objects.filter(pk=err.av.pk).update(
+                    article_json_ingest_hash=err.ingest_hash
+                )
+            raise
+
+    return wrapper
+
+
+@record_ingest_hash
 @atomic
 def ingest(*args, **kwargs) -> models.ArticleVersion:
     return _ingest(*args, **kwargs)
 
 
+def _touch(av):
+    "dry-run counterpart to saving an ArticleVersion. sets the timestamps `.save()` would have set."
+    now = utils.utcnow()
+    av.datetime_record_updated = now
+    av.datetime_record_created = av.datetime_record_created or now
+    return av
+
+
 #
 # PUBLISH requests
 #
 
 
-def _publish(msid, version, force=False) -> models.ArticleVersion:
+def _publication_date(av, raw_data, force=False):
+    """returns the publication date for the given ArticleVersion `av` using the unmerged xml->json `raw_data`.
+    v1 publication dates come from the article-json, >v1 publication dates are generated by lax.
+    """
+    # the json *will always* have a published date if v1 ...
+    if av.version == 1:
+        # pull that published date from the stored (but unpublished) article-json
+        # and set the pub-date on the ArticleVersion object
+        datetime_published = utils.todt(raw_data.get("published"))
+        # todo: can this check be removed in favour of ajson validation?
+        if not datetime_published:
+            raise StateError(
+                codes.PARSE_ERROR,
+                "found 'published' value in article-json, but it's either null or unparsable as a date+time",
+            )
+        return datetime_published
+
+    # but *not* if it's > v1. in this case, we generate one.
+    if av.published() and force:
+        # this article version is already published and a force publish request has been sent
+        if False and "versionDate" in raw_data:  # fail this case for now.
+            # FUTURE CASE: when a 'versionDate' value is present in the article-json, use that.
+            # as of 2016-10-21 version history IS NOT captured in the xml,
+            # it won't be parsed by the bot-lax-adaptor and it
+            # won't find it's way here. this is a future-case only.
+            datetime_published = utils.todt(raw_data["versionDate"])
+            if not datetime_published:
+                raise StateError(
+                    codes.PARSE_ERROR,
+                    "found 'versionDate' value in article-json, but it's either null or unparseable as a datetime",
+                )
+            return datetime_published
+
+        # CURRENT CASE
+        # this is a non-v1 forced PUBLISH event
+        # ignore anything given in the ajson and preserve the existing pubdate set by lax.
+        # if the pubdate for an article is to change, it must come from the xml (see above case)
+        return av.datetime_published
+
+    # CURRENT CASE
+    # this article version hasn't been published yet. use a value of RIGHT NOW as the published date.
+    return utils.utcnow()
+
+
+def _publish(msid, version, force=False, dry_run=False) -> models.ArticleVersion:
     """attach a `datetime_published` value to an article version. if none provided, use RIGHT NOW.
-    you cannot publish an already published article version unless force==True"""
+    you cannot publish an already published article version unless force==True.
+    `dry_run=True` will check and render the article-json against objects in memory, writing nothing.
+    """
     try:
         av = models.ArticleVersion.objects.get(
             article__manuscript_id=msid, version=version
@@ -292,58 +458,29 @@ def _publish(msid, version, force=False) -> models.ArticleVersion:
         # RULE: we won't use any other article fragments for determining the publication date
         # except the xml->json fragment.
         raw_data = fragments.get(av, XML2JSON).fragment
-
-        # the json *will always* have a published date if v1 ...
-        if version == 1:
-            # pull that published date from the stored (but unpublished) article-json
-            # and set the pub-date on the ArticleVersion object
-            datetime_published = utils.todt(raw_data.get("published"))
-            # todo: can this check be removed in favour of ajson validation?
-            if not datetime_published:
-                raise StateError(
-                    codes.PARSE_ERROR,
-                    "found 'published' value in article-json, but it's either null or unparsable as a date+time",
-                )
-
-        else:
-            # but *not* if it's > v1. in this case, we generate one.
-            if av.published() and force:
-                # this article version is already published and a force publish request has been sent
-                if False and "versionDate" in raw_data:  # fail this case for now.
-                    # FUTURE CASE: when a 'versionDate' value is present in the article-json, use that.
-                    # as of 2016-10-21 version history IS NOT captured in the xml,
-                    # it won't be parsed by the bot-lax-adaptor and it
-                    # won't find it's way here. this is a future-case only.
-                    datetime_published = utils.todt(raw_data["versionDate"])
-                    if not datetime_published:
-                        raise StateError(
-                            codes.PARSE_ERROR,
-                            "found 'versionDate' value in article-json, but it's either null or unparseable as a datetime",
-                        )
-                else:
-                    # CURRENT CASE
-                    # this is a non-v1 forced PUBLISH event
-                    # ignore anything given in the ajson and preserve the existing pubdate set by lax.
-                    # if the pubdate for an article is to change, it must come from the xml (see above case)
-                    datetime_published = av.datetime_published
-            else:
-                # CURRENT CASE
-                # this article version hasn't been published yet. use a value of RIGHT NOW as the published date.
-                datetime_published = utils.utcnow()
+        datetime_published = _publication_date(av, raw_data, force)
 
         av.datetime_published = datetime_published
-        av.save()
 
-        events.ajson_publish_events(av, force)
+        if dry_run:
+            quiet = force
+            fragments.set_article_json(
+                av, data=None, quiet=quiet, hash_check=False, dry_run=True
+            )
+            return _touch(av)
 
         # merge the fragments we have available and make them available for serving.
         # allow errors when the publish operation is being forced.
         # NOTE: hash checks will always fail on publish events as we modify the `versionDate`.
+        # the publication date is saved with the article-json.
         quiet = force
         fragments.set_article_json(av, data=None, quiet=quiet, hash_check=False)
+        av.article.summarise()
+
+        events.ajson_publish_events(av, force)
 
         # notify event bus that article change has occurred
-        transaction.on_commit(partial(aws_events.notify_all, av))
+        aws_events.enqueue_all(av)
 
         return av
 
@@ -381,8 +518,15 @@ def publish(*args, **kwargs) -> models.ArticleVersion:
 #
 
 
+def _ingest_publish(data, force=False, dry_run=False) -> models.ArticleVersion:
+    """ingests and publishes an article in a single pass.
+    the publication date is determined up front so the article-json is merged, validated, hashed and saved once.
+    """
+    return _ingest(data, force=force, publish=True, dry_run=dry_run)
+
+
+@record_ingest_hash
 @atomic
 def ingest_publish(data, force=False, dry_run=False) -> models.ArticleVersion:
     "convenience. publish an article if it were successfully ingested"
-    av = _ingest(data, force=force)
-    return _publish(av.article.manuscript_id, av.version, force=force)
+    return _ingest_publish(data, force=force, dry_run=dry_run)
@@ -2,7 +2,7 @@ import cProfile, pstats
 import json
 import jsonschema
 from django.core import exceptions as django_errors
-from . import models, logic, fragment_logic, utils
+from . import models, logic, fragment_logic, utils, codec
 from .utils import ensure, isint, toint, lmap
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
@@ -106,8 +106,7 @@ def json_response(data, code=200, content_type=None, headers=None):
     "dumps given `data` to json and sets a sensible default content-type header."
     content_type = content_type or "application/json"
     headers = headers or {}
-    json_string = utils.json_dumps(data)
-    return response(json_string, code, content_type, headers)
+    return response(codec.dumpb(data), code, content_type, headers)
 
 
 def error_response(code, title, detail=None):
@@ -265,7 +264,7 @@ def article(request, msid):
     authenticated = is_authenticated(request)
     try:
         av = logic.most_recent_article_version(msid, only_published=not authenticated)
-        return json_response(logic.article_json(av), content_type=ctype(av.status))
+        return response(logic.article_json_bytes(av), content_type=ctype(av.status))
     except models.Article.DoesNotExist:
         return http_404()
 
@@ -309,7 +308,7 @@ def article_version(request, msid, version):
     try:
         # TODO: test at the HTTP level also the other requests
         av = logic.article_version(msid, version, only_published=not authenticated)
-        return json_response(logic.article_json(av), content_type=ctype(av.status))
+        return response(logic.article_json_bytes(av), content_type=ctype(av.status))
     except models.ArticleVersion.DoesNotExist:
         return http_404()
 
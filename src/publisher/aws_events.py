@@ -1,10 +1,15 @@
-import os
+import os, time, threading
+from datetime import timedelta
 from ordered_set import OrderedSet
 import json
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 import boto3
-from publisher import relation_logic as relationships
-from functools import wraps
+from botocore.exceptions import BotoCoreError, ClientError
+from publisher import models, relation_logic as relationships
+from functools import partial, wraps
 import queue
 import logging
 
@@ -21,9 +26,23 @@ def sns_topic_arn():
     return arn
 
 
+# boto3 resources are expensive to create and not safe to share between processes or threads.
+# each thread keeps its own connection along with the id of the process it was created in.
+_CONN = threading.local()
+
+
 def event_bus_conn():
-    sns = boto3.resource("sns")
-    return sns.Topic(sns_topic_arn())
+    "returns a long-lived connection to the event bus, one per process and thread"
+    if getattr(_CONN, "pid", None) != os.getpid():
+        # first use in this thread, or the thread was copied into a forked process
+        kwargs = {"region_name": settings.EVENT_BUS["region"]}
+        if settings.EVENT_BUS.get("endpoint-url"):
+            # a local SNS stand-in, like localstack
+            kwargs["endpoint_url"] = settings.EVENT_BUS["endpoint-url"]
+        sns = boto3.resource("sns", **kwargs)
+        _CONN.topic = sns.Topic(sns_topic_arn())
+        _CONN.pid = os.getpid()
+    return _CONN.topic
 
 
 #
@@ -42,36 +61,46 @@ def get_queue():
 SAFEWORD = START = STOP = "cacao"
 
 
-def defer(fn):
+def defer(fn=None, flush=None):
     """calls function normally until safeword is received then buffers all requests until the safeword is called again.
     when the safeword is received a second time, the wrapped function is called with the UNIQUE set of arguments - i.e. it won't be called with the same arguments twice.
+    if a `flush` function is given it is called once with the list of UNIQUE arguments instead.
 
     using `defer` limits function arguments to hashable types only.
 
     """
+    if fn is None:
+        # used as `@defer(flush=...)`
+        return lambda fn: defer(fn, flush)
 
-    call_queue = get_queue()
+    # created the first time calls are deferred rather than at import.
+    # a multiprocessing queue starts the manager process, see `settings.MP_MANAGER`.
+    call_queue = None
     deferring = False
 
     @wraps(fn)
     def wrapper(*args):
         arg = args[0]
-        nonlocal deferring  # stateful!
+        nonlocal deferring, call_queue  # stateful!
 
         if arg == SAFEWORD:
             deferring = not deferring
             if deferring:
+                if call_queue is None:
+                    call_queue = get_queue()
                 # nothing else to do this turn
                 return
 
             # we're not deferring and we have stored calls to process
-            if not call_queue.empty():
+            if call_queue is not None and not call_queue.empty():
                 # input order cannot be guaranteed as we're using multiprocessing
                 # single-process input order can be guaranteed
                 calls = OrderedSet()
                 while not call_queue.empty():
                     calls.add(call_queue.get())
                 LOG.info("%s notifications to be sent call", len(calls))
+                if flush:
+                    return flush(list(calls))
                 return [fn(*fnargs) for fnargs in calls]
 
             else:
@@ -95,17 +124,111 @@ def defer(fn):
 #
 
 
-@defer
+# the maximum number of messages SNS accepts in a single `publish_batch` request
+BATCH_SIZE = 10
+# a batch is attempted this many times, waiting `RETRY_BACKOFF` seconds, doubling each time, between attempts
+RETRY_ATTEMPTS = 4
+RETRY_BACKOFF = 0.5
+
+
+def _message(msid):
+    return json.dumps({"type": "article", "id": msid})
+
+
+def _publish_batch(topic, msg_list):
+    """publishes up to `BATCH_SIZE` messages in a single request, retrying failed messages with backoff.
+    returns the list of messages that could not be published."""
+    pending = {str(i): msg for i, msg in enumerate(msg_list)}
+    rejected = []
+    for attempt in range(RETRY_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            resp = topic.meta.client.publish_batch(
+                TopicArn=topic.arn,
+                PublishBatchRequestEntries=[
+                    {"Id": msg_id, "Message": msg} for msg_id, msg in pending.items()
+                ],
+            )
+        except (BotoCoreError, ClientError) as err:
+            LOG.warning(
+                "failed to publish batch of %s messages to event bus (attempt %s of %s): %s",
+                len(pending),
+                attempt + 1,
+                RETRY_ATTEMPTS,
+                err,
+            )
+            continue
+        failed = {f["Id"]: f for f in resp.get("Failed") or []}
+        for msg_id, f in failed.items():
+            if f.get("SenderFault"):
+                # the message was rejected as malformed and will never succeed
+                LOG.error(
+                    "event bus rejected message %r: %s",
+                    pending[msg_id],
+                    f.get("Message"),
+                )
+                rejected.append(pending[msg_id])
+        pending = {
+            msg_id: msg
+            for msg_id, msg in pending.items()
+            if msg_id in failed and not failed[msg_id].get("SenderFault")
+        }
+        if not pending:
+            return rejected
+    LOG.error(
+        "failed to publish %s messages to event bus after %s attempts",
+        len(pending),
+        RETRY_ATTEMPTS,
+        extra={"bus-message": list(pending.values())},
+    )
+    return rejected + list(pending.values())
+
+
+def notify_many(call_list):
+    """notify event bus of many changed articles at once, `BATCH_SIZE` articles per request.
+    `call_list` is a list of the arguments `notify` was called with while deferred.
+    a single message is sent as a batch of one so it is retried like any other.
+    returns the list of messages sent, including those sent before any unhandled error.
+    """
+    if settings.DEBUG:
+        LOG.debug("application is in DEBUG mode, no notifications will be sent")
+        return
+    msg_list = [_message(msid) for (msid,) in call_list]
+    sent = []
+    try:
+        topic = event_bus_conn()
+        for i in range(0, len(msg_list), BATCH_SIZE):
+            batch = msg_list[i : i + BATCH_SIZE]
+            unsent = _publish_batch(topic, batch)
+            sent.extend(msg for msg in batch if msg not in unsent)
+        return sent
+
+    except KeyboardInterrupt:
+        LOG.warn("ctrl-c caught caught during `notify_many`")
+        raise
+
+    except BaseException as err:
+        LOG.exception(
+            "unhandled error attempting to notify event bus of article changes: %s",
+            err,
+        )
+        return sent
+
+
+@defer(flush=notify_many)
 def notify(msid):
     "notify event bus when this article or one of it's versions has been changed in some way"
     if settings.DEBUG:
         LOG.debug("application is in DEBUG mode, no notifications will be sent")
         return
     try:
-        msg = {"type": "article", "id": msid}
-        msg_json = json.dumps(msg)
+        msg_json = _message(msid)
         LOG.debug("writing message to event bus", extra={"bus-message": msg_json})
-        event_bus_conn().publish(Message=msg_json)
+        # sent as a batch of one so it is retried like deferred notifications
+        if _publish_batch(event_bus_conn(), [msg_json]):
+            # not sent, the failure has been logged
+            return
         return msg_json  # used only for testing
 
     except ValueError as err:
@@ -128,12 +251,109 @@ def notify(msid):
 
 def notify_relations(av):
     "notify event bus of changes to an article version's related articles"
-    [
-        notify(art.manuscript_id)
-        for art in relationships.internal_relationships_for_article_version(av)
-    ]
+    [notify(msid) for msid in relationships.internal_relationship_msids(av)]
 
 
 def notify_all(av):
     notify(av.article.manuscript_id)
     notify_relations(av)
+
+
+#
+# transactional outbox
+#
+
+# a notification that fails to send this many times is left in the outbox and no longer attempted
+MAX_ATTEMPTS = 10
+# a notification claimed by a dispatcher is left alone by other dispatchers for this many seconds.
+# a claim that hasn't been released by then belongs to a dispatcher that died and is claimed again.
+CLAIM_TIMEOUT = 600
+
+
+def enqueue(msid):
+    """notify event bus of a change to article `msid` once the current transaction is committed.
+    when `settings.EVENT_OUTBOX` is enabled the notification is written to the outbox within the current transaction
+    and sent by the `dispatch_events` command."""
+    if settings.EVENT_OUTBOX:
+        models.Notification.objects.create(manuscript_id=msid)
+        return
+    transaction.on_commit(partial(notify, msid))
+
+
+def enqueue_all(av):
+    "notify event bus of a change to an article version and its related articles once the current transaction is committed"
+    if settings.EVENT_OUTBOX:
+        msid_list = [
+            av.article.manuscript_id
+        ] + relationships.internal_relationship_msids(av)
+        models.Notification.objects.bulk_create(
+            [models.Notification(manuscript_id=msid) for msid in msid_list]
+        )
+        return
+    transaction.on_commit(partial(notify_all, av))
+
+
+def outbox_depth():
+    "returns the number of notifications in the outbox waiting to be sent"
+    return models.Notification.objects.filter(attempts__lt=MAX_ATTEMPTS).count()
+
+
+def dispatch(batch_size=100, window=0):
+    """sends the oldest `batch_size` notifications in the outbox, each article once.
+    an article is only sent once its oldest notification has been in the outbox for `window` seconds,
+    all of the article's notifications queued by then are coalesced into a single message.
+    sent notifications are removed from the outbox, notifications that fail are retried on the next dispatch.
+    notifications are claimed in one short transaction, sent outside of it and then removed or released in another.
+    returns a triple of (msids sent, msids not sent, number of messages saved by coalescing).
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=window)
+    with transaction.atomic():
+        # rows locked by a concurrent dispatcher are skipped. ignored by databases that don't support it.
+        # rows claimed by a concurrent dispatcher are skipped until the claim expires.
+        pending = (
+            models.Notification.objects.select_for_update(skip_locked=True)
+            .filter(attempts__lt=MAX_ATTEMPTS)
+            .filter(
+                Q(datetime_claimed=None)
+                | Q(datetime_claimed__lte=now - timedelta(seconds=CLAIM_TIMEOUT))
+            )
+        )
+        msid_list = list(
+            OrderedSet(
+                pending.filter(datetime_queued__lte=cutoff)
+                .order_by("id")
+                .values_list("manuscript_id", flat=True)[:batch_size]
+            )
+        )
+        if not msid_list:
+            return [], [], 0
+
+        # every notification for these articles visible now is covered by the message sent next.
+        # notifications queued after this are left for the next dispatch.
+        covered = {}
+        for pk, msid in pending.filter(manuscript_id__in=msid_list).values_list(
+            "id", "manuscript_id"
+        ):
+            covered.setdefault(msid, []).append(pk)
+        models.Notification.objects.filter(
+            id__in=[pk for pk_list in covered.values() for pk in pk_list]
+        ).update(datetime_claimed=now)
+
+    if settings.DEBUG:
+        LOG.debug("application is in DEBUG mode, no notifications will be sent")
+        sent = msid_list
+    else:
+        sent_msgs = set(notify_many([(msid,) for msid in msid_list]) or [])
+        sent = [msid for msid in msid_list if _message(msid) in sent_msgs]
+    unsent = [msid for msid in msid_list if msid not in sent]
+
+    sent_pks = [pk for msid in sent for pk in covered[msid]]
+    with transaction.atomic():
+        models.Notification.objects.filter(id__in=sent_pks).delete()
+        if unsent:
+            unsent_pks = [pk for msid in unsent for pk in covered[msid]]
+            models.Notification.objects.filter(id__in=unsent_pks).update(
+                attempts=F("attempts") + 1, datetime_claimed=None
+            )
+    return sent, unsent, len(sent_pks) - len(sent)
@@ -0,0 +1,358 @@
+# adhoc benchmarks of lax internals, modelled on `reports.py`.
+# each benchmark returns a map of measurements that is printed to stdout as json.
+# any database writes happen inside a transaction that is always rolled back.
+# use `./src/manage.py benchmark --name <funcname>`
+
+import os, sys, glob, json, time, subprocess
+from unittest.mock import patch
+from dateutil import parser
+from rfc3339 import rfc3339
+from django.conf import settings
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from . import ajson_ingestor, utils, codec, fragment_logic, logic, models, fields
+from .utils import version_from_path
+
+import logging
+
+LOG = logging.getLogger(__name__)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "tests", "fixtures")
+MANAGE_PY = os.path.join(settings.SRC_DIR, "manage.py")
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _rolled_back(fn):
+    "calls `fn` inside a transaction that is always rolled back. returns the result of `fn`"
+    result = None
+    try:
+        with transaction.atomic():
+            result = fn()
+            raise _Rollback()
+    except _Rollback:
+        pass
+    return result
+
+
+def _summary(timings):
+    "returns a map of statistics for a list of timings in milliseconds"
+    return {
+        "iterations": len(timings),
+        "total-ms": round(sum(timings), 3),
+        "mean-ms": round(sum(timings) / len(timings), 3),
+        "min-ms": round(min(timings), 3),
+        "max-ms": round(max(timings), 3),
+    }
+
+
+def _timed(fn, iterations=1):
+    "calls `fn` `iterations` times, returning a map of timings in milliseconds"
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return _summary(timings)
+
+
+def _python(*args):
+    "runs python in a new process from the `src` directory, returning its stdout"
+    return subprocess.run(
+        [sys.executable] + list(args),
+        cwd=settings.SRC_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=False,
+    ).stdout
+
+
+def _ajson_fixtures(v1_only=True):
+    "returns a list of (path, article-json) pairs from the test fixtures"
+    path_list = sorted(
+        glob.glob(os.path.join(FIXTURE_DIR, "ajson", "elife-*.xml.json"))
+    )
+    path_list = [p for p in path_list if "-bad" not in p and ".snippet." not in p]
+    if v1_only:
+        path_list = [p for p in path_list if version_from_path(p)[1] == 1]
+    return [(path, json.load(open(path, "r"))) for path in path_list]
+
+
+#
+#
+#
+
+
+def ingest_publish(iterations=5):
+    """the bot-lax INGEST+PUBLISH flow.
+    compares the previous two-pass (INGEST then PUBLISH) flow with the single render pass.
+    """
+    fixtures = _ajson_fixtures()
+
+    def two_pass():
+        for _, data in fixtures:
+            av = ajson_ingestor._ingest(data)
+            ajson_ingestor._publish(av.article.manuscript_id, av.version)
+
+    def single_pass():
+        for _, data in fixtures:
+            ajson_ingestor._ingest_publish(data)
+
+    return {
+        "articles": len(fixtures),
+        "two-pass": _timed(lambda: _rolled_back(two_pass), iterations),
+        "single-pass": _timed(lambda: _rolled_back(single_pass), iterations),
+    }
+
+
+# run in a fresh python process by `startup`.
+# prints the time taken to boot Django and then serve the first and second request.
+FIRST_REQUEST_SCRIPT = """
+import os, sys, time, json
+start = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+import django
+django.setup()
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+if sys.argv[1] == "preload":
+    from core.wsgi import preload
+    preload()
+timings = {"boot": time.perf_counter() - start}
+client = Client(raise_request_exception=False)
+for key in ["first-request", "second-request"]:
+    start = time.perf_counter()
+    client.get("/api/v2/articles")
+    timings[key] = time.perf_counter() - start
+print(json.dumps({key: val * 1000 for key, val in timings.items()}))
+"""
+
+
+def startup(iterations=5):
+    """cold start time of the `ingest` command and the latency of the first api request in a new process.
+    settings are loaded on first use unless preloaded, see `core.wsgi.preload`."""
+    path, _ = _ajson_fixtures()[0]
+    msid, version = version_from_path(path)
+    ingest = [MANAGE_PY, "ingest", "--ingest", "--dry-run", "--serial"]
+    ingest += ["--id", str(msid), "--version", str(version), path]
+
+    def first_request(mode):
+        timings = {}
+        for _ in range(iterations):
+            result = json.loads(_python("-c", FIRST_REQUEST_SCRIPT, mode))
+            for key, val in result.items():
+                timings.setdefault(key, []).append(val)
+        return {key: _summary(val) for key, val in timings.items()}
+
+    return {
+        "manage.py-check": _timed(lambda: _python(MANAGE_PY, "check"), iterations),
+        "manage.py-ingest": _timed(lambda: _python(*ingest), iterations),
+        "first-request": {
+            "lazy": first_request("lazy"),
+            "preload": first_request("preload"),
+        },
+    }
+
+
+def _strings(data):
+    "yields every string value in the nested `data`"
+    if isinstance(data, str):
+        yield data
+    elif isinstance(data, dict):
+        for val in data.values():
+            yield from _strings(val)
+    elif isinstance(data, list):
+        for val in data:
+            yield from _strings(val)
+
+
+def _dateutil_ymdhms(dt):
+    "`utils.ymdhms` as it was, before the fast path"
+    if dt:
+        return rfc3339(utils.todt(dt), utc=True)
+
+
+def dates(iterations=5):
+    """parsing and formatting of datetimes with `utils.todt` and `utils.ymdhms`.
+    compares dateutil against the fast ISO-8601 path with an empty and a warm memo,
+    then the effect of each on serialising datetimes with `utils.json_dumps` and on ingest.
+    """
+    fixtures = _ajson_fixtures()
+    with open(os.path.join(FIXTURE_DIR, "partial-ejp-to-lax-report.json"), "r") as fh:
+        ejp = json.load(fh)
+    string_list = [
+        val
+        for article in ejp
+        for key, val in article.items()
+        if key.startswith("date_") and val
+    ]
+    string_list += [
+        val
+        for _, data in fixtures
+        for val in _strings(data)
+        if utils.ISO_8601_REGEX.match(val)
+    ]
+    datetime_list = [utils.todt(val) for val in string_list]
+    dateutil = patch("publisher.utils.parse_datetime", parser.parse)
+
+    def todt():
+        for val in string_list:
+            utils.todt(val)
+
+    def todt_cold():
+        utils.parse_datetime.cache_clear()
+        todt()
+
+    def dumps():
+        utils.json_dumps(datetime_list)
+
+    def ingest():
+        for _, data in fixtures:
+            ajson_ingestor._ingest(data)
+
+    with dateutil:
+        before = {
+            "todt": _timed(todt, iterations),
+            "ingest": _timed(lambda: _rolled_back(ingest), iterations),
+        }
+        with patch("publisher.utils.ymdhms", _dateutil_ymdhms):
+            before["json_dumps"] = _timed(dumps, iterations)
+
+    return {
+        "datetime-strings": len(string_list),
+        "articles": len(fixtures),
+        "dateutil": before,
+        "fast": {
+            "todt-cold-memo": _timed(todt_cold, iterations),
+            "todt-warm-memo": _timed(todt, iterations),
+            "json_dumps": _timed(dumps, iterations),
+            "ingest": _timed(lambda: _rolled_back(ingest), iterations),
+        },
+    }
+
+
+def json_codec(iterations=5):
+    """encoding, decoding and copying article-json with each `codec` backend.
+    see `codec.py`. the stdlib is always available, `orjson` only if installed."""
+    fixtures = _ajson_fixtures(v1_only=False)
+    data_list = [data for _, data in fixtures]
+    string_list = [codec.dumps_stdlib(data) for data in data_list]
+
+    def measure():
+        return {
+            "dumps": _timed(lambda: [codec.dumpb(d) for d in data_list], iterations),
+            "loads": _timed(lambda: [codec.loads(s) for s in string_list], iterations),
+            "copy": _timed(lambda: [codec.copy(d) for d in data_list], iterations),
+        }
+
+    result = {
+        "articles": len(data_list),
+        "bytes": sum(len(s) for s in string_list),
+        "hash_ajson": _timed(
+            lambda: [fragment_logic.hash_ajson(d) for d in data_list], iterations
+        ),
+        "backend": codec.BACKEND,
+    }
+    with patch("publisher.codec.orjson", None):
+        result["json"] = measure()
+    if codec.orjson:
+        result["orjson"] = measure()
+    return result
+
+
+def metadata(iterations=5):
+    """queries that read article version metadata and snippets but not the article-json.
+    the article-json of every version is loaded with the row unless it is deferred or stored elsewhere.
+    """
+    fixtures = _ajson_fixtures(v1_only=False)
+
+    def measure():
+        for _, data in fixtures:
+            ajson_ingestor._ingest_publish(data, force=True)
+        # related articles that haven't been ingested yet are stubs without versions
+        art_list = models.Article.objects.filter(
+            articleversion__isnull=False
+        ).distinct()
+        msid_list = list(art_list.values_list("manuscript_id", flat=True))
+        return {
+            "articles": len(msid_list),
+            "article-versions": models.ArticleVersion.objects.count(),
+            "latest_version": _timed(
+                lambda: [art.latest_version for art in art_list],
+                iterations,
+            ),
+            "article_version_list": _timed(
+                lambda: [list(logic.article_version_list(msid)) for msid in msid_list],
+                iterations,
+            ),
+            "article_version_history__v2": _timed(
+                lambda: [
+                    logic.article_version_history__v2(msid, only_published=False)
+                    for msid in msid_list
+                ],
+                iterations,
+            ),
+            "latest_article_version_list": _timed(
+                lambda: [
+                    logic.article_snippet_json(av)
+                    for av in logic.latest_article_version_list(only_published=False)[1]
+                ],
+                iterations,
+            ),
+        }
+
+    return _rolled_back(measure)
+
+
+def compression(iterations=5):
+    """the size of article-json stored as text and compressed, the time taken to read it back and
+    the time taken to serve it from the api. see `fields.py`.
+    served article-json is read from the database as it is stored, compressed or not, and never decoded.
+    """
+    fixtures = _ajson_fixtures(v1_only=False)
+    data_list = [data for _, data in fixtures]
+    string_list = [codec.dumpb(data) for data in data_list]
+    compressed_list = [fields.compress(data) for data in data_list]
+
+    def serve():
+        for _, data in fixtures:
+            ajson_ingestor._ingest_publish(data, force=True)
+        client = Client()
+        url_list = [
+            reverse(
+                "v2:article-version",
+                kwargs={"msid": av.article.manuscript_id, "version": av.version},
+            )
+            for av in models.ArticleVersion.objects.select_related("article")
+        ]
+
+        def request_all():
+            for url in url_list:
+                assert client.get(url).status_code == 200
+
+        result = {"serve-compressed": _timed(request_all, iterations)}
+        # move the article-json back to the text column, as it was stored before compression
+        for content in models.ArticleVersionContent.objects.all():
+            models.ArticleVersionContent.objects.filter(pk=content.pk).update(
+                article_json_v1=content.article_json_v1_compressed,
+                article_json_v1_compressed=None,
+            )
+        result["serve-text"] = _timed(request_all, iterations)
+        return result
+
+    return {
+        "articles": len(data_list),
+        "bytes": sum(len(s) for s in string_list),
+        "compressed-bytes": sum(len(c) for c in compressed_list),
+        "compress": _timed(lambda: [fields.compress(d) for d in data_list], iterations),
+        "read-text": _timed(lambda: [codec.loads(s) for s in string_list], iterations),
+        "read-compressed": _timed(
+            lambda: [codec.loads(fields.decompress(c)) for c in compressed_list],
+            iterations,
+        ),
+        **_rolled_back(serve),
+    }
@@ -0,0 +1,139 @@
+# a local journal of the files a long running command (backfills, bulk imports) has successfully processed.
+# an interrupted command can be restarted with `--resume` and skip any file whose content hasn't changed since.
+# the journal is a sqlite database, independent of the lax database, so it survives rolled back transactions.
+
+import os, sqlite3, hashlib, time
+from datetime import timedelta
+from django.conf import settings
+from . import utils
+import logging
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    command TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    digest TEXT NOT NULL,
+    status TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    PRIMARY KEY (command, path)
+)
+"""
+
+
+def digest(content):
+    "returns an md5 digest of the given string `content`"
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+def file_digest(path):
+    "returns an md5 digest of the contents of the file at `path`"
+    md5 = hashlib.md5()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class Journal:
+    """records files processed by `command`, keyed by path, modification time and content.
+    `command` distinguishes different kinds of run sharing the same journal file, for example an ingest from a publish.
+    members of archives (see `sources.py`) have no modification time and are keyed by path and the `content_digest` given.
+    """
+
+    def __init__(self, command, path=None):
+        self.command = command
+        self.path = path or settings.CHECKPOINT_FILE
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def done(self, path, content_digest=None):
+        "returns `True` if the file at `path` was processed and hasn't changed since"
+        path = os.path.abspath(path)
+        row = self.conn.execute(
+            "SELECT mtime, digest FROM checkpoint WHERE command = ? AND path = ?",
+            (self.command, path),
+        ).fetchone()
+        if not row:
+            return False
+        mtime, previous_digest = row
+        if content_digest:
+            return previous_digest == content_digest
+        if mtime == os.path.getmtime(path):
+            return True
+        # file has been touched, but has it changed?
+        return previous_digest == file_digest(path)
+
+    def record(self, path, status, content_digest=None):
+        "records the file at `path` as processed with the given `status`"
+        path = os.path.abspath(path)
+        if content_digest:
+            mtime = 0
+        else:
+            mtime, content_digest = os.path.getmtime(path), file_digest(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self.command,
+                path,
+                mtime,
+                content_digest,
+                status,
+                utils.ymdhms(utils.utcnow()),
+            ),
+        )
+        self.conn.commit()
+
+
+class Progress:
+    """logs the progress of `total` units of work with an estimated time to completion at most every `interval` seconds.
+    a `total` of `None` is unknown, for example the number of members in a compressed archive.
+    """
+
+    def __init__(self, total, interval=10, label="processed"):
+        self.total = total
+        self.interval = interval
+        self.label = label
+        self.count = 0
+        self.start = self.last = time.perf_counter()
+
+    def report(self):
+        "returns a map of the current progress"
+        elapsed = time.perf_counter() - self.start
+        rate = self.count / elapsed if elapsed else 0
+        eta = None
+        if rate and self.total is not None:
+            eta = round((self.total - self.count) / rate)
+        percent = None
+        if self.total is not None:
+            percent = round(self.count * 100 / self.total, 1) if self.total else 100
+        return {
+            "count": self.count,
+            "total": self.total,
+            "percent": percent,
+            "per-second": round(rate, 3),
+            "eta": str(timedelta(seconds=eta)) if eta is not None else None,
+        }
+
+    def tick(self, num=1):
+        self.count += num
+        now = time.perf_counter()
+        if now - self.last >= self.interval or self.count == self.total:
+            self.last = now
+            report = self.report()
+            LOG.info(
+                "%s %s/%s (%s%%), %s/s, eta %s",
+                self.label,
+                report["count"],
+                report["total"],
+                report["percent"],
+                report["per-second"],
+                report["eta"],
+                extra=report,
+            )
@@ -0,0 +1,79 @@
+# the one place lax encodes and decodes json.
+# `orjson` is used when it is installed and the stdlib `json` module otherwise. the backend is chosen once, at import.
+# both backends decode to plain dicts and lists and encode datetime and date objects the same way,
+# see `utils.ymdhms` and `utils.ymd`.
+# both backends encode non-ASCII characters as raw UTF-8 rather than `\uXXXX` escapes, as `orjson` always does.
+# hashes are the exception and keep the stdlib's ASCII-escaped encoding, see `dumps_stdlib`.
+
+import json
+from datetime import date, datetime
+from . import utils
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+if orjson:
+    # datetimes are passed through to `_default` so both backends encode them identically.
+    ORJSON_OPTS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    # datetime objects: 2015-03-17T00:00:00Z
+    # date objects: 2015-03-17
+    obj_t = type(obj)
+    if obj_t == date:
+        return utils.ymd(obj)
+    if obj_t == datetime:
+        return utils.ymdhms(obj)
+    raise TypeError(
+        "Object of type %s with value of %s is not JSON serializable"
+        % (type(obj), repr(obj))
+    )
+
+
+def loads(data):
+    "decodes the json `string` or `bytes` in `data`. maps are decoded as plain dicts."
+    if orjson:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def dumpb(obj, indent=None):
+    """encodes `obj` as utf-8 encoded json bytes.
+    `indent` is either `None` (compact) or `2` with the `orjson` backend, anything else uses the stdlib.
+    """
+    if orjson and indent in (None, 2):
+        opts = ORJSON_OPTS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=_default, option=opts)
+    return _dumps(obj, indent).encode("utf-8")
+
+
+def dumps(obj, indent=None):
+    "encodes `obj` as a json string. see `dumpb`."
+    if orjson and indent in (None, 2):
+        return dumpb(obj, indent).decode("utf-8")
+    return _dumps(obj, indent)
+
+
+def _dumps(obj, indent):
+    "stdlib fallback for `dumps` and `dumpb`, encoding non-ASCII characters as raw UTF-8 like `orjson`"
+    return json.dumps(obj, default=_default, indent=indent, ensure_ascii=False)
+
+
+def dumps_stdlib(obj, indent=None):
+    """encodes `obj` as a json string with the stdlib `json` module, whatever the backend.
+    the output is stable across backends and used for hashing, see `fragment_logic.hash_ajson`.
+    changing it changes the hash of every article."""
+    return json.dumps(obj, default=_default, indent=indent)
+
+
+def copy(data):
+    """a deep copy of `data` as json types. faster than `copy.deepcopy` for standard data.
+    datetime and date objects are converted to strings."""
+    return loads(dumpb(data))
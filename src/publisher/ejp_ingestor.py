@@ -1,6 +1,7 @@
 import json
-from dateutil import parser
-from . import models, utils, events
+from collections import Counter
+from joblib import Parallel, delayed
+from . import models, utils, events, sources
 from django.db import transaction
 
 import logging
@@ -47,14 +48,23 @@ def load_with_datetime(pairs):  # , format='%Y-%m-%d'):
     for k, v in pairs:
         if isinstance(v, str):
             if k.startswith("date_"):
-                v = parser.parse(v)
+                v = utils.parse_datetime(v)
         d[k] = v
     return d
 
 
-def import_article_list_from_json_path(journal, json_path, *args, **kwargs):
-    with open(json_path, "r") as fh:
-        article_list = json.load(fh, object_pairs_hook=load_with_datetime)
+def import_article_list_from_json_path(
+    journal, json_path, *args, content=None, **kwargs
+):
+    """imports the list of articles in the file at `json_path`.
+    `content` is the json at `json_path` if it has already been read, for example a member of an archive.
+    a single article (a line of an NDJSON file) is imported as a list of one."""
+    if content is None:
+        with open(json_path, "r") as fh:
+            content = fh.read()
+    article_list = json.loads(content, object_pairs_hook=load_with_datetime)
+    if isinstance(article_list, dict):
+        article_list = [article_list]
     with transaction.atomic():
 
         def fn(ad):
@@ -68,3 +78,163 @@ def import_article_list_from_json_path(journal, json_path, *args, **kwargs):
                 raise
 
         utils.lmap(fn, article_list)
+
+
+#
+# streaming import
+#
+
+
+def import_article_chunk(journal, article_data_list, create=True, update=False):
+    """set-based counterpart to `import_article` for many articles at once.
+    existing articles are looked up with a single query, new articles are inserted and existing articles
+    updated in bulk and the whole chunk is committed in a single transaction.
+    returns the number of articles in the chunk."""
+    # later data for the same article replaces earlier data, as successive calls to `import_article` would
+    article_data_map = {}
+    for article_data in article_data_list:
+        msid = int(article_data["manuscript_id"])
+        article_data.update(
+            {"manuscript_id": msid, "journal": journal, "doi": utils.msid2doi(msid)}
+        )
+        article_data_map[msid] = article_data
+
+    def articles():
+        return {
+            art.manuscript_id: art
+            for art in models.Article.objects.filter(
+                journal=journal, manuscript_id__in=list(article_data_map)
+            )
+        }
+
+    try:
+        with transaction.atomic():
+            art_map = articles()
+            create_list, update_list = [], []
+            for msid, article_data in article_data_map.items():
+                art = art_map.get(msid)
+                if art is None:
+                    if not create:
+                        continue
+                    art = models.Article(**article_data)
+                    create_list.append(art)
+                elif update:
+                    for key, val in article_data.items():
+                        setattr(art, key, val)
+                    # `auto_now` fields aren't set during a bulk update
+                    art.datetime_record_updated = utils.utcnow()
+                    update_list.append(art)
+                else:
+                    continue
+                # the journal exists and the msids were just looked for, skip the extra queries
+                art.full_clean(exclude=["journal"], validate_unique=False)
+
+            models.Article.objects.bulk_create(create_list)
+            if update_list:
+                # articles may not all have the same fields, the rest keep the values they were read with
+                field_list = set().union(
+                    *(article_data_map[art.manuscript_id] for art in update_list)
+                )
+                field_list -= {"manuscript_id", "journal"}
+                field_list.add("datetime_record_updated")
+                models.Article.objects.bulk_update(update_list, sorted(field_list))
+            if create_list:
+                # not every database returns the primary keys of bulk created rows
+                art_map = articles()
+            LOG.info(
+                "created %s and updated %s Articles", len(create_list), len(update_list)
+            )
+
+            # no point creating events if nothing to be preserved
+            if create or update:
+                events.ejp_ingest_events_many(
+                    [(art, article_data_map[msid]) for msid, art in art_map.items()]
+                )
+
+        return len(article_data_map)
+
+    except Exception as err:
+        LOG.exception(
+            "unhandled error (%s) attempting to import chunk of articles from EJP: %s",
+            err,
+            list(article_data_map),
+        )
+        raise
+
+
+def _import_article_chunk(journal_id, article_data_list, create, update):
+    "`import_article_chunk` in a worker process, where model instances can't be passed as arguments"
+    journal = models.Journal.objects.get(pk=journal_id)
+    return import_article_chunk(journal, article_data_list, create, update)
+
+
+def msid_chunks(article_list, msid_counts, chunk_size):
+    """yields lists of about `chunk_size` articles from `article_list`, in the order they are read.
+    `msid_counts` maps each msid in `article_list` to the number of times it appears.
+    every article with the same msid is in the same list, so lists can be imported concurrently.
+    an article whose msid appears again later in `article_list` is held back until the last appearance,
+    only those articles and the current list are kept in memory.
+    """
+    chunk = []
+    held = {}
+    for article_data in article_list:
+        msid = int(article_data["manuscript_id"])
+        if msid_counts[msid] > 1:
+            held.setdefault(msid, []).append(article_data)
+            if len(held[msid]) < msid_counts[msid]:
+                continue
+            chunk.extend(held.pop(msid))
+        else:
+            chunk.append(article_data)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_article_list_from_json_path(
+    journal,
+    json_path,
+    create=True,
+    update=False,
+    content=None,
+    chunk_size=500,
+    n_jobs=1,
+):
+    """streaming counterpart to `import_article_list_from_json_path` for very large EJP exports.
+    articles are parsed one at a time and imported `chunk_size` articles at a time, each chunk committed as it completes.
+    an interrupted import leaves the completed chunks in place.
+    chunks are imported by `n_jobs` processes in parallel when `n_jobs` is greater than 1. every article with the
+    same msid is in the same parallel chunk, so an msid that appears twice is never imported by two processes at once.
+    the export is read twice to find the msids that appear more than once.
+    returns the number of articles imported."""
+
+    if content is not None:
+        # a member of an archive that has already been read
+        data = json.loads(content, object_pairs_hook=load_with_datetime)
+        data = [data] if isinstance(data, dict) else data
+
+    def article_list():
+        if content is not None:
+            yield from data
+            return
+        with open(json_path, "r") as fh:
+            yield from sources.json_array(fh, object_pairs_hook=load_with_datetime)
+
+    if n_jobs == 1:
+        return sum(
+            import_article_chunk(journal, chunk, create, update)
+            for chunk in utils.chunks(article_list(), chunk_size)
+        )
+
+    msid_counts = Counter(int(ad["manuscript_id"]) for ad in article_list())
+    chunk_list = msid_chunks(article_list(), msid_counts, chunk_size)
+    return sum(
+        Parallel(n_jobs=n_jobs)(
+            delayed(utils.call_in_worker)(
+                __name__, "_import_article_chunk", journal.pk, chunk, create, update
+            )
+            for chunk in chunk_list
+        )
+    )
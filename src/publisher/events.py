@@ -37,7 +37,24 @@ def add(art, event, value=None, datetime_event=None, uri=None):
     return ae
 
 
-def add_many(article, ae_list, force=False, skip_missing_datestamped=False):
+def _event(art, event, value=None, datetime_event=None, uri=None):
+    "returns a new, validated but unsaved, ArticleEvent. see `add`."
+    if value:
+        value = str(value)[:255]
+    ae = models.ArticleEvent(
+        article=art,
+        event=event,
+        value=value,
+        datetime_event=todt(datetime_event) or utils.utcnow(),
+        uri=uri,
+    )
+    # the article exists and uniqueness is guaranteed by `add_many`
+    ae.full_clean(exclude=["article"], validate_unique=False)
+    return ae
+
+
+def _wanted(article, ae_list, skip_missing_datestamped=False):
+    "returns a list of new, unsaved, ArticleEvents for the given `article` from the event structs in `ae_list`"
     if skip_missing_datestamped:
         # ignores any events missing a 'datetime' key.
         # why?? not all articles generate all events, but a dict with keys will still be generated.
@@ -47,18 +64,69 @@ def add_many(article, ae_list, force=False, skip_missing_datestamped=False):
         # WARN: if 'datetime' field is present but is empty, it *will be given a datetime of now()*.
         # use `elide` to remove field entirely.
         ae_list = [ae for ae in ae_list if "datetime_event" in ae]
+    return [_event(article, **struct) for struct in ae_list]
 
+
+def _save_many(wanted_list):
+    """creates/updates the unsaved ArticleEvents in `wanted_list`, for any number of articles.
+    the events are compared to those already present with a single query and only new events are inserted
+    and changed events updated. returns the list of saved ArticleEvents."""
     # lsh@2021-09-21: certain events should be unique, like preprint events.
-    # if any events to be created are in the singleton list, remove them before creating new ones.
+    # if any events to be created are in the singleton list, remove any others of that type.
     # this behaviour will prevent re-ingesting POAs (with no events) from deleting events created during a VOR ingest.
     singletons = [models.DATE_PREPRINT_PUBLISHED]
-    for ae in ae_list:
-        if ae["event"] in singletons:
-            models.ArticleEvent.objects.filter(
-                article=article, event=ae["event"]
-            ).delete()
 
-    return [add(article, **struct) for struct in ae_list]
+    # later events replace earlier events with the same key, as successive calls to `add` would
+    wanted = {}
+    for ae in wanted_list:
+        wanted[(ae.article_id, ae.event, ae.datetime_event)] = ae
+    if not wanted:
+        return []
+
+    existing = {
+        (ae.article_id, ae.event, ae.datetime_event): ae
+        for ae in models.ArticleEvent.objects.filter(
+            article__in={article_id for article_id, _, _ in wanted},
+            event__in={event for _, event, _ in wanted},
+        )
+    }
+
+    wanted_events = {(article_id, event) for article_id, event, _ in wanted}
+    delete_list = [
+        ae.id
+        for key, ae in existing.items()
+        if ae.event in singletons
+        and key not in wanted
+        and (ae.article_id, ae.event) in wanted_events
+    ]
+    if delete_list:
+        models.ArticleEvent.objects.filter(id__in=delete_list).delete()
+
+    create_list, update_list, ae_list = [], [], []
+    for key, ae in wanted.items():
+        existing_ae = existing.get(key)
+        if not existing_ae:
+            create_list.append(ae)
+        elif (existing_ae.value, existing_ae.uri) != (ae.value, ae.uri):
+            existing_ae.value, existing_ae.uri = ae.value, ae.uri
+            update_list.append(existing_ae)
+            ae = existing_ae
+        else:
+            ae = existing_ae
+        ae_list.append(ae)
+
+    models.ArticleEvent.objects.bulk_create(create_list)
+    models.ArticleEvent.objects.bulk_update(update_list, ["value", "uri"])
+    return ae_list
+
+
+def add_many(article, ae_list, force=False, skip_missing_datestamped=False):
+    """creates/updates many ArticleEvents for the given `article` at once.
+    the events in `ae_list` are compared to those already present with a single query and only
+    new events are inserted and changed events updated. unchanged events cost nothing.
+    """
+    utils.ensure(article, "need art")
+    return _save_many(_wanted(article, ae_list, skip_missing_datestamped))
 
 
 #
@@ -200,3 +268,16 @@ def ejp_ingest_events(article, data, force=False):
     data["forced?"] = force
     ae_structs = [render.render_item(desc, data) for desc in EJP_EVENTS]
     return add_many(article, ae_structs, force, skip_missing_datestamped=True)
+
+
+def ejp_ingest_events_many(article_data_list, force=False):
+    """scrapes and inserts events from ejp data for many articles at once.
+    `article_data_list` is a list of (article, ejp data) pairs. see `ejp_ingest_events`.
+    """
+    wanted_list = []
+    for article, data in article_data_list:
+        utils.ensure(article, "need art")
+        data["forced?"] = force
+        ae_structs = [render.render_item(desc, data) for desc in EJP_EVENTS]
+        wanted_list.extend(_wanted(article, ae_structs, skip_missing_datestamped=True))
+    return _save_many(wanted_list)
@@ -0,0 +1,62 @@
+# model fields for storing json compressed.
+# json is encoded with `codec` and compressed with zlib when written, decompressed and decoded when read.
+# the encoded json can also be read without decoding it, for serving as-is. see `Encoded`.
+
+import zlib
+from django.db import models
+from django.db.models import ExpressionWrapper, F
+from . import codec
+
+
+def compress(data):
+    "encodes `data` as json and compresses it"
+    return zlib.compress(codec.dumpb(data))
+
+
+def decompress(value):
+    "decompresses the compressed json bytes in `value`, returning encoded json bytes"
+    return zlib.decompress(value)
+
+
+class CompressedJSONField(models.BinaryField):
+    """json stored as compressed bytes. read and written as plain dicts and lists.
+    bytes are never json and are written as-is, assumed to be compressed already. see `compress`.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return codec.loads(decompress(value))
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return codec.loads(decompress(value))
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        if not isinstance(value, bytes):
+            value = compress(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return codec.dumps(self.value_from_object(obj))
+
+
+class EncodedJSONField(models.BinaryField):
+    "the output field of `Encoded`. decompresses but doesn't decode."
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return decompress(value)
+
+
+class Encoded(ExpressionWrapper):
+    """reads the `CompressedJSONField` `name` as encoded json bytes, without decoding it.
+
+    `Model.objects.values_list(Encoded("field"), flat=True)`"""
+
+    def __init__(self, name):
+        super().__init__(F(name), output_field=EncodedJSONField())
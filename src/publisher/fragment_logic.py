@@ -1,10 +1,22 @@
+import os
 import copy
 import hashlib
-from functools import partial
+from functools import partial, lru_cache
 from jsonschema import ValidationError
-from django.db.models import Q
+from django.db.models import (
+    Q,
+    Case,
+    CharField,
+    Exists,
+    Func,
+    OuterRef,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
 from django.conf import settings
-from . import utils, models, aws_events, codes
+from . import utils, models, aws_events, codes, codec
 from .utils import create_or_update, ensure, subdict, StateError, lmap
 import logging
 from django.db import transaction
@@ -54,15 +66,50 @@ def get(x, ftype):
     return models.ArticleFragment.objects.get(**kwargs)
 
 
-def merge(av):
-    """returns the merged result for a particlar article version"""
+def _pending_xml2json(av, fragments, xml2json, update):
+    """returns the list of `fragments` as it would be after `add(av, XML2JSON, xml2json, pos=0, update=update)`.
+    nothing is written to the database."""
+
+    def existing(frag):
+        return frag.type == models.XML2JSON and frag.version == av.version
+
+    current = [frag for frag in fragments if existing(frag)]
+    if current and not update:
+        return fragments
+    pending = models.ArticleFragment(
+        article=av.article,
+        version=av.version,
+        type=models.XML2JSON,
+        fragment=xml2json,
+        position=0,
+        datetime_record_created=(
+            current[0].datetime_record_created if current else utils.utcnow()
+        ),
+    )
+    fragments = [frag for frag in fragments if not existing(frag)] + [pending]
+    return sorted(
+        fragments, key=lambda frag: (frag.position, frag.datetime_record_created)
+    )
+
+
+def merge(av, xml2json=None, update=True):
+    """returns the merged result for a particlar article version.
+    `xml2json` is merged as if it had been `add`ed as the article version's xml->json fragment.
+    """
     # all fragments belonging to this specific article version or
     # to this article in general
     query = Q(version=av.version) | Q(version=None)
     if not settings.MERGE_FOREIGN_FRAGMENTS:
         # ((version=av.version OR version=none) AND type=xml->json)
         query &= Q(type=models.XML2JSON)
-    fragments = models.ArticleFragment.objects.filter(article=av.article).filter(query)
+    fragments = []
+    if av.article.pk:
+        # an unsaved article has no fragments
+        fragments = list(
+            models.ArticleFragment.objects.filter(article=av.article).filter(query)
+        )
+    if xml2json is not None:
+        fragments = _pending_xml2json(av, fragments, xml2json, update)
     if not fragments:
         raise StateError(codes.NO_RECORD, "%r has no fragments that can be merged" % av)
     return utils.merge_all([f.fragment for f in fragments])
@@ -177,40 +224,51 @@ def extract_snippet(merged_result):
     return subdict(merged_result, snippet_keys)
 
 
-def pre_process(av, result):
-    "supplements the merged fragments with more article data required for validating"
-    # don't modify what we were given
-    # result = utils.deepcopy_data(result) # passes tests
-    result = copy.deepcopy(result)  # safer
-
-    # we need to inspect this value later in `hashcheck` before it gets nullified
-    result["-published"] = result["published"]
-
+def publication_dates(av):
+    """returns the 'published', 'versionDate' and 'statusDate' values of the article-json for the given article version.
+    these come from the article version and the article's version history rather than the article-json.
+    """
     # 'published' is when the v1 article was published
     # if unpublished, this value will be None
     if av.version == 1:
-        result["published"] = av.datetime_published
+        published = av.datetime_published
     else:
-        result["published"] = av.article.datetime_published
-
-    result["versionDate"] = av.datetime_published
+        published = av.article.datetime_published
 
     # 'statusDate' is when the 'status' (poa/vor) value changed to the status being
     # served up in *this* result.
     if av.version == 1 or av.status == models.POA:
         # we're a POA or a version 1, statusDate is easy :)
-        result["statusDate"] = result["published"]
+        status_date = published
     else:
         # we're a non-v1 VOR, statusDate is a little harder
-        # we can't tell which previous version was a vor so consult our version history
-        earliest_vor = av.article.earliest_vor()
-        if earliest_vor:
+        # we can't tell which previous version was a vor so consult the article's version history
+        earliest_vor_version = av.article.earliest_vor_version
+        if earliest_vor_version and earliest_vor_version < av.version:
             # article has a vor in it's version history! use it's version date
-            result["statusDate"] = earliest_vor.datetime_published  # may be None
+            status_date = av.article.datetime_earliest_vor  # may be None
         else:
-            # no VORs found AT ALL
-            # this means our av == earliest_vor and it *hasn't been saved yet*
-            result["statusDate"] = av.datetime_published  # may be/probably None
+            # we are the earliest vor or no VORs have been saved yet.
+            # prefer our own, possibly unsaved, version date
+            status_date = av.datetime_published  # may be/probably None
+
+    return {
+        "published": published,
+        "versionDate": av.datetime_published,
+        "statusDate": status_date,
+    }
+
+
+def pre_process(av, result):
+    "supplements the merged fragments with more article data required for validating"
+    # don't modify what we were given
+    # result = utils.deepcopy_data(result) # passes tests
+    result = copy.deepcopy(result)  # safer
+
+    # we need to inspect this value later in `hashcheck` before it gets nullified
+    result["-published"] = result["published"]
+
+    result.update(publication_dates(av))
 
     if av.datetime_published:
         result["stage"] = "published"
@@ -236,12 +294,85 @@ def pre_process(av, result):
 
 
 def hash_ajson(merge_result):
-    string = utils.json_dumps(merge_result, indent=None)
+    # the stdlib encoding is used whatever the codec backend so hashes are stable
+    string = codec.dumps_stdlib(merge_result)
     return hashlib.md5(string.encode("utf-8")).hexdigest()
 
 
+def hash_article_json(result):
+    """the hash stored with an article version's article-json, see `ArticleVersion.article_json_hash`.
+    `result` is hashed as it will be stored, without the '-published' value added by `pre_process`,
+    so rendered and stored article-json hash the same."""
+    if result is None:
+        return hash_ajson(None)
+    return hash_ajson(utils.exsubdict(result, ["-published"]))
+
+
+def hash_ajson_text(text):
+    """same as `hash_article_json` for article-json as it is stored in the database, as encoded text or bytes.
+    the text is decoded with the codec backend rather than the JSONField."""
+    return hash_article_json(None if text is None else codec.loads(text))
+
+
+# metadata are any attributes prefixed with a hyphen, for example "-related-articles-internal".
+# no metadata is present in the final rendered article-json and is used solely for other logic,
+# like related articles creating new relations in the database.
+IDENTITY_META_KEYS = [
+    "-related-articles-internal",
+    "-related-articles-external",
+    # "-history", # unused for now
+]
+
+IDENTITY_HISTORY_KEYS = [
+    #'received',
+    #'accepted',
+    "preprint"
+]
+
+
+# the version of the code in this module that renders article-json, see `render_stamp`.
+# bump it with any change that changes the article-json rendered from the same article data,
+# so identical article data is rendered again rather than skipped.
+RENDER_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def render_stamp():
+    """identifies the code and schemas that render article-json, see `hash_ingest`.
+    a new `RENDER_VERSION`, api-raml revision or set of schema versions in use changes the stamp.
+    """
+    api_raml_sha1 = os.path.join(settings.PROJECT_DIR, "api-raml.sha1")
+    api_raml = None
+    if os.path.exists(api_raml_sha1):
+        with open(api_raml_sha1, "r") as fh:
+            api_raml = fh.read().strip()
+    return hash_ajson(
+        {
+            "render-version": RENDER_VERSION,
+            "api-raml": api_raml,
+            "schema-versions": settings.SCHEMA_VERSIONS,
+        }
+    )
+
+
+def hash_ingest(article_data, av):
+    """returns a hash of the given unmerged xml->json `article_data` as it would be rendered for article version `av`.
+    only those parts of the data considered by `_identical_articles` are hashed, along with the values `pre_process`
+    takes from outside the article-json and a stamp of the code and schemas that render it.
+    two ingests with the same hash would render identical article-json."""
+    history = article_data.get("-history") or {}
+    struct = utils.exsubdict(article_data, ["-meta", "-history"])
+    struct["-history"] = {key: history.get(key) for key in IDENTITY_HISTORY_KEYS}
+    struct["-render"] = {"stamp": render_stamp(), "dates": publication_dates(av)}
+    return hash_ajson(struct)
+
+
 class Identical(RuntimeError):
-    def __init__(self, msg, av, hashval):
+    """raised when an ingest would not change the stored article-json.
+    `ingest_hash` is the ingest hash of the data when it had to be rendered to find out, see `hash_ingest`.
+    """
+
+    def __init__(self, msg, av, hashval, ingest_hash=None):
         super(Identical, self).__init__(msg)
         LOG.info(
             msg,
@@ -253,6 +384,7 @@ class Identical(RuntimeError):
         )
         self.av = av
         self.hashval = hashval
+        self.ingest_hash = ingest_hash
 
 
 # function was split out to please complexity checker
@@ -277,39 +409,30 @@ def _identical_articles(raw_original, raw_new, final_new, oldhash, newhash):
     identical_pubdate = old_pubdate == new_pubdate
 
     # compare metadata
-    # metadata are any attributes prefixed with a hyphen, for example "-related-articles-internal".
-    # no metadata is present in the final rendered article-json and is used solely for other logic,
-    # like related articles creating new relations in the database.
-    meta_key_list = [
-        "-related-articles-internal",
-        "-related-articles-external",
-        # "-history", # unused for now
-    ]
     identical_meta = all(
         raw_original.get(meta_key) == raw_new.get(meta_key)
-        for meta_key in meta_key_list
+        for meta_key in IDENTITY_META_KEYS
     )
 
     # compare bits of history
-    history_key_list = [
-        #'received',
-        #'accepted',
-        "preprint"
-    ]
     identical_history = all(
         raw_original.get("-history", {}).get(history_key)
         == raw_new.get("-history", {}).get(history_key)
-        for history_key in history_key_list
+        for history_key in IDENTITY_HISTORY_KEYS
     )
 
     return identical_hash and identical_pubdate and identical_meta and identical_history
 
 
 # TODO: 'quiet' (validation-check) and 'update_fragment' are symptoms of spaghetti logic and need to be removed.
-def set_article_json(av, data=None, quiet=True, hash_check=True, update_fragment=True):
+def set_article_json(
+    av, data=None, quiet=True, hash_check=True, update_fragment=True, dry_run=False
+):
     """updates the article with the result of the merge operation.
     if the result of the merge was valid, the merged result will be saved.
-    if invalid, a ValidationError will be raised"""
+    if invalid, a ValidationError will be raised.
+    `dry_run=True` merges, validates and hashes as usual but neither the fragment nor the article version is saved.
+    """
     log_context = {"article-version": av, "hash_check": hash_check}
 
     try:
@@ -320,10 +443,14 @@ def set_article_json(av, data=None, quiet=True, hash_check=True, update_fragment
         # NO RECORD: nothing has been ingested yet, no previous article data to compare to
         raw_original = {}
 
-    if data:
-        add(av, models.XML2JSON, data["article"], pos=0, update=update_fragment)
-
-    raw_new = merge(av)
+    if dry_run:
+        raw_new = merge(
+            av, xml2json=data["article"] if data else None, update=update_fragment
+        )
+    else:
+        if data:
+            add(av, models.XML2JSON, data["article"], pos=0, update=update_fragment)
+        raw_new = merge(av)
 
     # scrub the merged result, update dates, remove any meta, etc
     result = pre_process(av, raw_new)
@@ -337,7 +464,7 @@ def set_article_json(av, data=None, quiet=True, hash_check=True, update_fragment
     snippet = valid_snippet(snippet, quiet=quiet)
 
     oldhash = av.article_json_hash
-    newhash = hash_ajson(result)
+    newhash = hash_article_json(result)
 
     if not result or not snippet:
         msg = "this article failed to merge it's fragments into a valid result and will not be saved to the database."
@@ -356,6 +483,7 @@ def set_article_json(av, data=None, quiet=True, hash_check=True, update_fragment
             msg,
             av,
             newhash,
+            hash_ingest(data["article"], av) if data and update_fragment else None,
         )
 
     # postprocess
@@ -365,7 +493,12 @@ def set_article_json(av, data=None, quiet=True, hash_check=True, update_fragment
     av.article_json_v1 = result
     av.article_json_v1_snippet = snippet
     av.article_json_hash = newhash
-    av.save()
+    if data and update_fragment:
+        # allows a future delivery of the same data to be detected before anything is written.
+        # see `ajson_ingestor._identical_ingest`
+        av.article_json_ingest_hash = hash_ingest(data["article"], av)
+    if not dry_run:
+        av.save()
 
     return result
 
@@ -388,7 +521,7 @@ def add_fragment_update_article(art, key, fragment):
         ensure(created or updated, "fragment was not created/updated")
 
         # notify event bus that article change has occurred
-        transaction.on_commit(partial(aws_events.notify, art.manuscript_id))
+        aws_events.enqueue(art.manuscript_id)
 
         # hash check disabled. if fragment added that doesn't alter final article, then fragment should be preserved
         return set_all_article_json(art, quiet=False, hash_check=False)
@@ -401,7 +534,7 @@ def delete_fragment_update_article(art, key):
         models.ArticleFragment.objects.get(article=art, type=key, version=None).delete()
 
         # notify event bus that article change has occurred
-        transaction.on_commit(partial(aws_events.notify, art.manuscript_id))
+        aws_events.enqueue(art.manuscript_id)
 
         # `hash_check=False`: if removing fragment doesn't alter final article, then fragment should still be removed
         return set_all_article_json(art, quiet=False, hash_check=False)
@@ -413,12 +546,29 @@ def reset_merged_fragments(art):
     """
     with transaction.atomic():
         # notify event bus that article change has occurred
-        transaction.on_commit(partial(aws_events.notify, art.manuscript_id))
+        aws_events.enqueue(art.manuscript_id)
 
         # `hash_check=False`: reset merged fragments regardless of whether final article-json is changed
         return set_all_article_json(art, quiet=False, hash_check=False)
 
 
+def render(av):
+    """merges, pre-processes, validates and hashes the fragments of an article version. nothing is written.
+    returns a triple of (article-json, article-json snippet, hash), the values `set_article_json` would save.
+    raises a `ValidationError` or `StateError` if the result is invalid."""
+    result = pre_process(av, merge(av))
+    result = valid(result, quiet=False)
+    snippet = valid_snippet(extract_snippet(result), quiet=False)
+    if not result or not snippet:
+        raise StateError(
+            codes.INVALID,
+            "this article failed to merge it's fragments into a valid result",
+        )
+    newhash = hash_article_json(result)
+    del result["-published"]  # set in preprocess
+    return result, snippet, newhash
+
+
 def validate_merged_fragments(art):
     """for each article version of given article object, merge the fragments and validate them.
     does not write anything to the database."""
@@ -454,3 +604,43 @@ def location(av):
         return "no-article-fragment"
     except KeyError:
         return "no-location-stored"
+
+
+class JSONLocation(Func):
+    """extracts the location of the article xml from the json text of a fragment within the database.
+    the SQL equivalent of `fragment["-meta"]["location"]`, `NULL` if not present."""
+
+    output_field = CharField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="json_extract(%(expressions)s, '$.\"-meta\".location')",
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="(%(expressions)s::jsonb #>> '{-meta,location}')",
+            **extra_context,
+        )
+
+
+def location_subquery():
+    """returns an expression that annotates a queryset of ArticleVersions with the location of their article xml.
+    the SQL equivalent of `location`, evaluated as part of the query instead of once per article version.
+    """
+    fragment = models.ArticleFragment.objects.filter(
+        type=models.XML2JSON, article=OuterRef("article"), version=OuterRef("version")
+    )
+    return Case(
+        When(~Exists(fragment), then=Value("no-article-fragment")),
+        default=Coalesce(
+            Subquery(fragment.values(loc=JSONLocation("fragment"))[:1]),
+            Value("no-location-stored"),
+        ),
+        output_field=CharField(),
+    )
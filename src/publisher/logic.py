@@ -1,12 +1,12 @@
-import json
 from django.db import connection, reset_queries
-from . import models
+from . import models, codec
 from django.conf import settings
 import logging
-from publisher import utils, relation_logic
+from publisher import utils, relation_logic, fields
 from publisher.utils import ensure, lmap, lfilter, firstnn, second, exsubdict
 from django.utils import timezone
-from django.db.models import Max, F  # , Q, When
+from django.db.models import Max, F, TextField  # , Q, When
+from django.db.models.functions import Cast
 from psycopg2.extensions import AsIs
 
 LOG = logging.getLogger(__name__)
@@ -52,7 +52,9 @@ def execute_sql(filename, params):
 #
 
 
-def journal(name=None):
+def journal(name=None, create=True):
+    """returns the named journal, or the primary journal if no name given.
+    `create=False` will return an unsaved Journal if it doesn't exist yet."""
     journal = {"name": name}
     if not name:
         journal = settings.PRIMARY_JOURNAL
@@ -61,6 +63,10 @@ def journal(name=None):
         if timezone.is_naive(journal["inception"]):
             inception = timezone.make_aware(journal["inception"])
         journal["inception"] = inception
+    if not create:
+        return models.Journal.objects.filter(**journal).first() or models.Journal(
+            **journal
+        )
     obj, new = models.Journal.objects.get_or_create(**journal)
     if new:
         LOG.info("created new Journal %s", obj)
@@ -89,6 +95,32 @@ def article_json(av):
     return av.article_json_v1 or None
 
 
+def article_json_bytes(av):
+    """returns the *valid* article json for the given article version as encoded json, `b"null"` if invalid.
+    the article-json is read from the database as it is stored, compressed or not, and never decoded.
+    """
+    if models.ArticleVersion.content.is_cached(av):
+        # already loaded
+        return codec.dumpb(article_json(av))
+    row = (
+        models.ArticleVersionContent.objects.filter(pk=av.pk)
+        .annotate(
+            # the stored text, without decoding it as the JSONField would
+            article_json_text=Cast("article_json_v1", TextField()),
+            article_json_encoded=fields.Encoded("article_json_v1_compressed"),
+        )
+        .values_list("article_json_encoded", "article_json_text")
+        .first()
+    )
+    encoded, text = row or (None, None)
+    if encoded is not None:
+        return encoded
+    if text is not None:
+        # not compressed yet
+        return text.encode("utf-8")
+    return b"null"
+
+
 def article_snippet_json(av, placeholder_if_invalid=True):
     """return the *valid* article snippet json for the given article version.
     if `placeholder_if_invalid=True` and article is invalid, return a stubby 'placeholder'
@@ -141,7 +173,7 @@ def latest_published_article_versions(page=1, per_page=-1, order="DESC"):
        pav.article_id = pav2.article_id AND pav.version = pav2.max_ver
        AND pav.article_id = pa.id
 
-    ORDER BY datetime_published %s, pa.manuscript_id %s""" % (
+    ORDER BY pav.datetime_published %s, pa.manuscript_id %s""" % (
         order,
         order,
     )
@@ -310,10 +342,10 @@ def relationships2(msid, only_published=True, include_rpp=True):
         "internal-reverse-relationships-for-msid.sql", intr_rev_params
     )
 
-    extr = [json.loads(i["citation"]) for i in extr]
-    rppr = [json.loads(i["content"]) for i in rppr]
-    intr = [json.loads(i["article_json_v1_snippet"]) or "null" for i in intr]
-    intr_rev = [json.loads(i["article_json_v1_snippet"]) or "null" for i in intr_rev]
+    extr = [codec.loads(i["citation"]) for i in extr]
+    rppr = [codec.loads(i["content"]) for i in rppr]
+    intr = [codec.loads(i["article_json_v1_snippet"]) or "null" for i in intr]
+    intr_rev = [codec.loads(i["article_json_v1_snippet"]) or "null" for i in intr_rev]
 
     av_list = intr + intr_rev
 
@@ -0,0 +1,34 @@
+import sys
+from publisher import benchmarks, utils
+from django.core.management.base import BaseCommand
+
+
+def build_benchmark_choices():
+    candidates = benchmarks.__dict__.keys()
+    candidates = [
+        c
+        for c in candidates
+        if not c.startswith("_") and callable(getattr(benchmarks, c))
+    ]
+    return [
+        c
+        for c in candidates
+        if getattr(benchmarks, c).__module__ == benchmarks.__name__
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "for measuring the performance of lax internals. see `publisher/benchmarks.py`"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", choices=build_benchmark_choices(), required=True)
+        parser.add_argument("--iterations", type=int, default=5)
+
+    def handle(self, *args, **options):
+        benchmark = getattr(benchmarks, options["name"])
+        result = benchmark(iterations=options["iterations"])
+        self.stdout.write(utils.json_dumps(result, indent=4))
+        self.stdout.flush()
+        sys.exit(0 if result else 1)
@@ -0,0 +1,96 @@
+"""
+compresses the article-json of every article version still stored as text. see `models.ArticleVersionContent`.
+
+article-json is read and written `--batch-size` rows at a time, one commit per batch.
+the command can be stopped and run again at any time, it continues with the rows that are still text.
+
+the number of bytes stored before and after is written to stdout when finished.
+
+"""
+
+import sys
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import TextField
+from django.db.models.functions import Cast
+from publisher import models, fields, codec, checkpoint
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+def text_rows(batch_size):
+    "yields lists of (id, article-json text) for article-json that hasn't been compressed, `batch_size` rows at a time"
+    q = (
+        models.ArticleVersionContent.objects.filter(article_json_v1__isnull=False)
+        # the stored text, without decoding it as the JSONField would
+        .annotate(article_json_text=Cast("article_json_v1", TextField()))
+        .order_by("pk")
+        .values_list("pk", "article_json_text")
+    )
+    last_pk = 0
+    while True:
+        row_list = list(q.filter(pk__gt=last_pk)[:batch_size])
+        if row_list:
+            yield row_list
+        if len(row_list) < batch_size:
+            return
+        last_pk = row_list[-1][0]
+
+
+def compress_batch(row_list):
+    """compresses and writes the list of (id, article-json text) in `row_list`, emptying the text.
+    returns a pair of (num bytes as text, num bytes compressed)"""
+    content_list = []
+    num_text = num_compressed = 0
+    for pk, text in row_list:
+        compressed = fields.compress(codec.loads(text))
+        num_text += len(text.encode("utf-8"))
+        num_compressed += len(compressed)
+        content_list.append(
+            models.ArticleVersionContent(
+                pk=pk, article_json_v1=None, article_json_v1_compressed=compressed
+            )
+        )
+    with transaction.atomic():
+        models.ArticleVersionContent.objects.bulk_update(
+            content_list, ["article_json_v1", "article_json_v1_compressed"]
+        )
+    return num_text, num_compressed
+
+
+def compress_all(batch_size=100):
+    "compresses all article-json stored as text. returns a report"
+    total = models.ArticleVersionContent.objects.filter(
+        article_json_v1__isnull=False
+    ).count()
+    progress = checkpoint.Progress(total, label="compressed")
+    report = {"compressed": 0, "text-bytes": 0, "compressed-bytes": 0}
+    for row_list in text_rows(batch_size):
+        num_text, num_compressed = compress_batch(row_list)
+        report["text-bytes"] += num_text
+        report["compressed-bytes"] += num_compressed
+        progress.tick(len(row_list))
+    report["compressed"] = progress.count
+    if report["text-bytes"]:
+        report["ratio"] = round(report["compressed-bytes"] / report["text-bytes"], 3)
+    return report
+
+
+class Command(BaseCommand):
+    help = "compresses article-json stored as text"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        try:
+            report = compress_all(options["batch_size"])
+            LOG.info("compressed article-json", extra=report)
+        except KeyboardInterrupt:
+            LOG.warning("ctrl-c caught, stopping")
+            sys.exit(1)
+
+        self.stdout.write(codec.dumps(report))
+        self.stdout.flush()
+        sys.exit(0)
@@ -0,0 +1,93 @@
+"""
+sends the event bus notifications written to the outbox, see `settings.EVENT_OUTBOX`.
+
+notifications are read in batches, oldest first, and each article is notified once per batch.
+with a `--window` of N seconds, an article is notified at most once every N seconds no matter how many
+times it changed, across every process writing to the outbox.
+notifications that fail to send are left in the outbox and retried, up to `aws_events.MAX_ATTEMPTS` times.
+
+the number of notifications waiting to be sent is logged after every batch as 'outbox-depth' and
+the number of messages saved by coalescing as 'outbox-coalesced'.
+
+"""
+
+import sys, time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from publisher import aws_events
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+def drain(batch_size, window=0):
+    """dispatches batches of notifications until there are none ready to send or a batch fails entirely.
+    returns a triple of (num sent, num unsent, num coalesced)"""
+    num_sent = num_unsent = num_coalesced = 0
+    while True:
+        sent, unsent, coalesced = aws_events.dispatch(batch_size, window)
+        num_sent += len(sent)
+        num_unsent += len(unsent)
+        num_coalesced += coalesced
+        depth = aws_events.outbox_depth()
+        if sent or unsent:
+            LOG.info(
+                "sent %s notifications, %s failed, %s coalesced, %s remaining",
+                len(sent),
+                len(unsent),
+                coalesced,
+                depth,
+                extra={"outbox-depth": depth, "outbox-coalesced": coalesced},
+            )
+        if not sent:
+            # nothing ready to send or the event bus is unavailable, wait for the next poll
+            return num_sent, num_unsent, num_coalesced
+
+
+class Command(BaseCommand):
+    help = "sends event bus notifications written to the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="seconds to wait between polls of an empty outbox",
+        )
+        parser.add_argument(
+            "--window",
+            type=int,
+            default=settings.EVENT_OUTBOX_WINDOW,
+            help="seconds a notification waits before it is sent, repeated notifications are coalesced",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            default=False,
+            help="drain the outbox and exit",
+        )
+        parser.add_argument(
+            "--depth",
+            action="store_true",
+            default=False,
+            help="print the number of notifications waiting to be sent and exit",
+        )
+
+    def handle(self, *args, **options):
+        if options["depth"]:
+            self.stdout.write(str(aws_events.outbox_depth()))
+            self.stdout.flush()
+            sys.exit(0)
+
+        try:
+            while True:
+                _, num_unsent, _ = drain(options["batch_size"], options["window"])
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            LOG.info("ctrl-c caught, stopping event dispatcher")
+            num_unsent = 0
+
+        sys.exit(1 if num_unsent else 0)
@@ -1,7 +1,7 @@
 import pprint
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from publisher import logic, ejp_ingestor, utils
+from publisher import logic, ejp_ingestor, utils, checkpoint, sources
 from publisher.utils import lmap
 from functools import partial
 import logging
@@ -12,25 +12,74 @@ IMPORT_TYPES = ["ejp"]
 EJP = IMPORT_TYPES[0]
 
 
-def ingest(fn, journal, create, update, path_list):
-    "wrapper around the import function with friendlier handling of problems"
+def member_names(path_list):
+    "returns a list of paths to import, listing the members of any archives in `path_list` without reading them"
+    name_list = []
+    for path in path_list:
+        if sources.is_archive(path):
+            name_list.extend(sources.member_names(path))
+        else:
+            name_list.append(path)
+    return name_list
+
 
-    def _(path):
+def members(path_list):
+    "yields (path, content) pairs, reading the members of any archives in `path_list` one at a time"
+    for path in path_list:
+        if sources.is_archive(path):
+            yield from sources.members(path)
+        else:
+            yield path, None
+
+
+def ingest(
+    fn,
+    journal,
+    create,
+    update,
+    member_list,
+    total,
+    checkpoint_journal=None,
+    resume=False,
+):
+    """wrapper around the import function with friendlier handling of problems.
+    `member_list` is consumed one member at a time, `total` is the number of members it will yield.
+    successfully imported paths are recorded in the `checkpoint_journal`, if given, once committed.
+    when resuming, members in the `checkpoint_journal` that haven't changed since are skipped.
+    """
+    progress = checkpoint.Progress(total, label="imported")
+    skipped = []
+
+    def _(member):
+        path, content = member
         try:
-            results = fn(journal, path, create=create, update=update)
+            content_digest = content and checkpoint.digest(content)
+            if resume and checkpoint_journal.done(path, content_digest):
+                skipped.append(path)
+                return True
+            results = fn(journal, path, content=content, create=create, update=update)
             LOG.debug("results of ingest", extra={"results": results})
+            if checkpoint_journal:
+                # when importing within a transaction, nothing is imported until it is committed
+                transaction.on_commit(
+                    partial(checkpoint_journal.record, path, "imported", content_digest)
+                )
             return True
         except KeyboardInterrupt:
             raise
         except BaseException:
             LOG.exception("failed to import article")
             return False
+        finally:
+            progress.tick()
 
     try:
-        lmap(_, path_list)
+        lmap(_, member_list)
     except KeyboardInterrupt:
         print("caught interrupt")
         exit(1)
+    if resume:
+        print("resumed, skipped", len(skipped), "unchanged files")
 
 
 class Command(BaseCommand):
@@ -45,12 +94,18 @@ class Command(BaseCommand):
 
     A single JSON file or a directory of JSON may be passed in as the `--path` paramater.
     Directories of files will have their contents expanded and only JSON files will be used.
+    Tar and zip archives of JSON files and NDJSON files of articles, one per line, are read without unpacking.
 
     To only create articles and never update an article, use the `--no-update` parameter.
 
     To only update articles and never create articles, use the `--no-create` parameter.
 
-    To neither create nor update (a dry run), use both `--no-create` and `--no-update` parameters."""
+    To neither create nor update (a dry run), use both `--no-create` and `--no-update` parameters.
+
+    To skip files successfully imported by a previous, interrupted, run use the `--resume` parameter.
+
+    To import very large files a chunk of articles at a time, committing each chunk, use the `--stream` parameter.
+    Chunks can be imported in parallel with `--jobs`."""
 
     def add_arguments(self, parser):
         # where am I to look?
@@ -73,6 +128,15 @@ class Command(BaseCommand):
         # do the import within a transaction - default. makes sqlite fly
         parser.add_argument("--no-atomic", action="store_false", default=True)
 
+        # skip files imported by a previous run that haven't changed since
+        parser.add_argument("--resume", action="store_true", default=False)
+        parser.add_argument("--checkpoint", default=None)
+
+        # parse files incrementally and commit every `--chunk-size` articles, in `--jobs` processes
+        parser.add_argument("--stream", action="store_true", default=False)
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--jobs", type=int, default=1)
+
     def handle(self, *args, **options):
         path = options["path"]
         create_articles = options["no_create"]
@@ -80,12 +144,31 @@ class Command(BaseCommand):
         import_type = options["import_type"]
         atomic = options["no_atomic"]
 
-        path_list = utils.resolve_path(path)
+        if sources.is_archive(path):
+            path_list = [path]
+        else:
+            path_list = utils.resolve_path(path)
+        # members of archives are only read when they are imported
+        name_list = member_names(path_list)
+
+        checkpoint_journal = None
+        resume = False
+        if (create_articles or update_articles) and (
+            options["resume"] or options["checkpoint"]
+        ):
+            # a dry run doesn't import anything and so has nothing to checkpoint.
+            # otherwise only runs that ask for it are checkpointed
+            checkpoint_journal = checkpoint.Journal(
+                "import:%s" % import_type, options["checkpoint"]
+            )
+            resume = options["resume"]
 
         if not options["just_do_it"]:
             try:
-                pprint.pprint(path_list)
-                print(import_type.upper(), "import of", len(path_list), "files")
+                pprint.pprint(name_list)
+                print(import_type.upper(), "import of", len(name_list), "files")
+                if resume:
+                    print("resuming, unchanged files will be skipped")
                 print("create?", create_articles)
                 print("update?", update_articles)
                 input("continue? (ctrl-c to exit)")
@@ -93,13 +176,26 @@ class Command(BaseCommand):
                 exit(0)
 
         choices = {EJP: ejp_ingestor.import_article_list_from_json_path}
+        if options["stream"]:
+            choices = {
+                EJP: partial(
+                    ejp_ingestor.stream_article_list_from_json_path,
+                    chunk_size=options["chunk_size"],
+                    n_jobs=options["jobs"],
+                )
+            }
+            # each chunk is committed as it is imported
+            atomic = False
         fn = partial(
             ingest,
             choices[import_type],
             logic.journal(),
             create_articles,
             update_articles,
-            path_list,
+            members(path_list),
+            len(name_list),
+            checkpoint_journal,
+            resume,
         )
         if atomic:
             with transaction.atomic():
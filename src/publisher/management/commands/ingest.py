@@ -5,11 +5,16 @@ The import script does not obey business rules and merrily update published date
 
 The ingest script DOES obey business rules and will not publish things twice,
 
+When given a single article the result is written as json.
+When given a directory, archive or NDJSON file of articles (`--dir`) each result is written as a line of json as it completes,
+followed by a summary of the run. See `Results`.
+
 """
 
 from collections import OrderedDict
 import os, io, re, sys, argparse, time
-from publisher import ajson_ingestor, utils, codes, aws_events
+from publisher import ajson_ingestor, utils, codes, codec, aws_events, checkpoint
+from publisher import sources
 from publisher.aws_events import START, STOP
 from publisher.utils import lfilter, formatted_traceback as ftb
 from publisher.ajson_ingestor import StateError
@@ -17,7 +22,6 @@ from publisher.fragment_logic import Identical
 import logging
 from joblib import Parallel, delayed
 from django.db import reset_queries
-from django.conf import settings
 from .modcommand import ModCommand
 
 LOG = logging.getLogger(__name__)
@@ -28,18 +32,16 @@ INGEST, PUBLISH, INGEST_PUBLISH = IMPORT_TYPES
 VALIDATED, INGESTED, PUBLISHED = "validated", "ingested", "published"
 
 
-def write(print_queue, out=None):
-    if not isinstance(out, str):
-        out = utils.json_dumps(out)  # encodes datetime objects
-    print_queue.put(out)
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 3)
 
 
-def clean_up(print_queue):
-    print_queue.put("STOP")
-    reset_queries()
+def failed(struct):
+    "returns `True` if the given result `struct` is an error"
+    return struct["status"] in [INVALID, ERROR]
 
 
-def error(print_queue, errtype, code, message, force, dry_run, log_context, **moar):
+def error(errtype, code, message, force, dry_run, log_context, **moar):
     struct = OrderedDict(
         [
             (
@@ -67,14 +69,11 @@ def error(print_queue, errtype, code, message, force, dry_run, log_context, **mo
     log_context["status"] = errtype
     logfn = LOG.warn if code == codes.INVALID else LOG.error
     logfn(message, extra=log_context)
-    write(print_queue, struct)
-    clean_up(print_queue)
-    sys.exit(1)
+    return struct
 
 
-def error_from_err(print_queue, errtype, errobj, force, dry_run, log_context):
+def error_from_err(errtype, errobj, force, dry_run, log_context):
     return error(
-        print_queue,
         errtype,
         errobj.code,
         errobj.message,
@@ -85,7 +84,7 @@ def error_from_err(print_queue, errtype, errobj, force, dry_run, log_context):
     )
 
 
-def success(print_queue, action, av, force, dry_run, log_context):
+def success(action, av, force, dry_run, log_context):
     lu = {INGEST: INGESTED, PUBLISH: PUBLISHED, INGEST_PUBLISH: PUBLISHED}
     status = orig_status = lu[action]
     if dry_run:
@@ -120,12 +119,47 @@ def success(print_queue, action, av, force, dry_run, log_context):
         log_context["version"],
         extra=log_context,
     )
-    write(print_queue, struct)
-    clean_up(print_queue)
-    sys.exit(0)
+    return struct
+
+
+def data_ids(data):
+    "returns a pair of (msid, version) from the given article-json, raising a `StateError` if either is missing"
+    try:
+        return int(data["article"]["id"]), data["article"]["version"]
+    except (KeyError, ValueError, TypeError):
+        raise StateError(
+            codes.BAD_REQUEST,
+            "an 'id' and 'version' are required in the article-json data",
+        )
+
+
+def check_data(data, msid, version):
+    "raises a `StateError` if the given article-json doesn't match the given `msid` and `version`"
+    # vagary of the CLI interface: article id and version are required
+    # these may not match the data given
+    data_version = data["article"].get("version")
+    if not data_version == version:
+        raise StateError(
+            codes.BAD_REQUEST,
+            "'version' in the data (%s) does not match 'version' passed to script (%s)"
+            % (data_version, version),
+        )
+    data_msid = int(data["article"]["id"])
+    if not data_msid == msid:
+        raise StateError(
+            codes.BAD_REQUEST,
+            "'id' in the data (%s) does not match 'msid' passed to script (%s)"
+            % (data_msid, msid),
+        )
 
 
-def handle_single(print_queue, action, infile, msid, version, force, dry_run):
+def handle_single(action, infile, msid, version, force, dry_run, stats=None):
+    """reads, checks and performs the `action` on the article-json in `infile`. returns a result struct.
+    `stats`, if given, is updated with the time taken by each stage and whether the data was identical.
+    when `msid` and `version` are both `None` the article is identified by its data and `stats` updated with both.
+    """
+    # WARN: stats is a mutable dict
+    stats = {} if stats is None else stats
     data = None
 
     log_context = {"msid": msid, "version": version, "identical": False}
@@ -136,14 +170,17 @@ def handle_single(print_queue, action, infile, msid, version, force, dry_run):
 
     # read and check the article-json given, if necessary
     try:
-        if action not in [PUBLISH]:
+        if action not in [PUBLISH] or (msid is None and version is None):
+            start = time.perf_counter()
             raw_data = infile.read()
+            stats["read-ms"] = elapsed_ms(start)
             log_context["data"] = (
                 str(raw_data[:25]) + "... (truncated)" if raw_data else ""
             )
 
+            start = time.perf_counter()
             try:
-                data = utils.ordered_json_loads(raw_data)
+                data = codec.loads(raw_data)
             except ValueError as err:
                 msg = "could not decode the json you gave me: %r for data: %r" % (
                     err.msg,
@@ -151,36 +188,26 @@ def handle_single(print_queue, action, infile, msid, version, force, dry_run):
                 )
                 raise StateError(codes.BAD_REQUEST, msg)
 
-            # vagary of the CLI interface: article id and version are required
-            # these may not match the data given
-            data_version = data["article"].get("version")
-            if not data_version == version:
-                raise StateError(
-                    codes.BAD_REQUEST,
-                    "'version' in the data (%s) does not match 'version' passed to script (%s)"
-                    % (data_version, version),
-                )
-            data_msid = int(data["article"]["id"])
-            if not data_msid == msid:
-                raise StateError(
-                    codes.BAD_REQUEST,
-                    "'id' in the data (%s) does not match 'msid' passed to script (%s)"
-                    % (data_msid, msid),
-                )
+            if msid is None and version is None:
+                msid, version = data_ids(data)
+                log_context.update({"msid": msid, "version": version})
+                stats.update({"msid": msid, "version": version})
+            else:
+                check_data(data, msid, version)
+            stats["decode-ms"] = elapsed_ms(start)
 
     except KeyboardInterrupt:
         LOG.warn("ctrl-c caught during data load")
         raise
 
     except StateError as err:
-        error_from_err(print_queue, INVALID, err, force, dry_run, log_context)
+        return error_from_err(INVALID, err, force, dry_run, log_context)
 
     except BaseException as err:
         LOG.exception(
             "unhandled exception attempting to ingest article-json", extra=log_context
         )
-        error(
-            print_queue,
+        return error(
             ERROR,
             codes.UNKNOWN,
             str(err),
@@ -190,6 +217,17 @@ def handle_single(print_queue, action, infile, msid, version, force, dry_run):
             trace=ftb(err),
         )
 
+    start = time.perf_counter()
+    try:
+        return handle_data(action, data, msid, version, force, dry_run, log_context)
+    finally:
+        stats["action-ms"] = elapsed_ms(start)
+        stats["identical"] = log_context["identical"]
+
+
+def handle_data(action, data, msid, version, force, dry_run, log_context):
+    """performs the `action` on the given, already decoded and checked, article-json `data`.
+    returns a result struct"""
     choices = {
         # all these return a models.ArticleVersion object
         INGEST: lambda msid, ver, force, data, dry: ajson_ingestor.ingest(
@@ -205,32 +243,26 @@ def handle_single(print_queue, action, infile, msid, version, force, dry_run):
 
     try:
         av = choices[action](msid, version, force, data, dry_run)
-        success(print_queue, action, av, force, dry_run, log_context)
+        return success(action, av, force, dry_run, log_context)
 
     except Identical as err:
         # this shouldn't be an error. return 'INGESTED' instead. is another type of success code required?
         log_context["identical"] = True
-        success(print_queue, INGEST, err.av, force, dry_run, log_context)
+        return success(INGEST, err.av, force, dry_run, log_context)
 
     except KeyboardInterrupt:
         LOG.warn("ctrl-c caught during ingest/publish")
         raise
 
-    except SystemExit:
-        # `success` and `error` use `exit` to indicate success or failure with their return code.
-        # this is handled in the `job` function, so re-raise it here and handle it there
-        raise
-
     except StateError as err:
         # handled error
-        error_from_err(print_queue, INVALID, err, force, dry_run, log_context)
+        return error_from_err(INVALID, err, force, dry_run, log_context)
 
     except BaseException as err:
         # unhandled error
         msg = "unhandled exception attempting to %r article: %r" % (action, err)
         LOG.exception(msg, extra=log_context)
-        error(
-            print_queue,
+        return error(
             ERROR,
             codes.UNKNOWN,
             msg,
@@ -239,21 +271,27 @@ def handle_single(print_queue, action, infile, msid, version, force, dry_run):
             log_context,
             trace=ftb(err),
         )
+    finally:
+        reset_queries()
 
 
-def job(print_queue, action, path, force, dry_run):
+def job(action, path, force, dry_run, content=None):
+    """ingests a single article-json file at `path`.
+    `content` is the article-json of an archive member named `path`, see `json_members`.
+    returns a result struct with the path, the time taken by each stage and whether the data was identical.
+    """
+    start = time.perf_counter()
+    msid = version = None
+    stats = {}
     try:
-        msid, version = utils.version_from_path(path)
-        handle_single(
-            print_queue,
-            action,
-            io.open(path, "r", encoding="utf8"),
-            msid,
-            version,
-            force,
-            dry_run,
-        )
-        return 0
+        if content is None or AJSON_PATH_REGEX.match(path):
+            msid, version = utils.version_from_path(path)
+        if content is None:
+            infile = io.open(path, "r", encoding="utf8")
+        else:
+            infile = io.StringIO(content)
+        with infile:
+            struct = handle_single(action, infile, msid, version, force, dry_run, stats)
 
     except KeyboardInterrupt:
         LOG.warn("ctrl-c caught. use ctrl-c again to quit to sending notifications")
@@ -261,48 +299,168 @@ def job(print_queue, action, path, force, dry_run):
             time.sleep(3)
         except KeyboardInterrupt:
             raise
+        struct = error(
+            ERROR,
+            codes.UNKNOWN,
+            "interrupted",
+            force,
+            dry_run,
+            {"msid": msid, "version": version},
+        )
 
-    except SystemExit as err:
-        LOG.debug("system exit caught", extra={"msid": msid, "version": version})
-        return err.code
+    except Exception as err:
+        # bad path, unreadable file, etc
+        struct = error(
+            ERROR,
+            codes.UNKNOWN,
+            str(err),
+            force,
+            dry_run,
+            {"msid": msid, "version": version},
+            trace=ftb(err),
+        )
+
+    stats["total-ms"] = elapsed_ms(start)
+    # members of an NDJSON file are identified by their data, see `handle_single`
+    msid, version = stats.pop("msid", msid), stats.pop("version", version)
+    result = OrderedDict([("path", path), ("id", msid), ("version", version)])
+    result.update(struct)
+    result["identical"] = stats.pop("identical", False)
+    result["timing"] = stats
+    return result
+
+
+class Results:
+    """aggregates the results of many `job`s.
+    each result is written to `out` as a line of json as it arrives, see `summary` for the totals.
+    successful results are recorded in the checkpoint `journal`, if given.
+    `resume=True` will skip any file the `journal` has recorded as successful that hasn't changed since.
+    """
+
+    def __init__(self, out, num_slowest=5, journal=None, resume=False):
+        self.out = out
+        self.num_slowest = num_slowest
+        self.journal = journal
+        self.resume = resume
+        self.start = time.perf_counter()
+        self.statuses = {}
+        self.num_identical = self.num_forced = self.num_skipped = 0
+        self.slowest = []  # [(total-ms, path), ...]
+        self.progress = checkpoint.Progress(0)
+        self.digests = {}  # {path: digest, ...} of archive members in progress
+
+    def expect(self, member_list):
+        """yields the pairs of (path, content) from `member_list` that need to be processed.
+        see `json_members`."""
+        total = len(member_list) if isinstance(member_list, list) else None
+        self.progress = checkpoint.Progress(total)
+        for path, content in member_list:
+            content_digest = None if content is None else checkpoint.digest(content)
+            if self.journal and self.resume and self.journal.done(path, content_digest):
+                self.num_skipped += 1
+                self.progress.tick()
+                continue
+            if content_digest:
+                self.digests[path] = content_digest
+            yield path, content
+
+    def add(self, result):
+        self.statuses[result["status"]] = self.statuses.get(result["status"], 0) + 1
+        self.num_identical += 1 if result["identical"] else 0
+        self.num_forced += 1 if result["force"] else 0
+        self.slowest.append((result["timing"]["total-ms"], result["path"]))
+        self.slowest = sorted(self.slowest, reverse=True)[: self.num_slowest]
+
+        content_digest = self.digests.pop(result["path"], None)
+        if self.journal and not failed(result):
+            self.journal.record(result["path"], result["status"], content_digest)
+
+        self.out.write(utils.json_dumps(result))  # encodes datetime objects
+        self.out.flush()
+        self.progress.tick()
+
+    def num_results(self):
+        return sum(self.statuses.values())
+
+    def num_failed(self):
+        return sum(self.statuses.get(status, 0) for status in [INVALID, ERROR])
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        num_results = self.num_results()
+        return OrderedDict(
+            [
+                ("total", num_results),
+                ("failed", self.num_failed()),
+                ("statuses", self.statuses),
+                ("identical", self.num_identical),
+                ("forced", self.num_forced),
+                ("skipped", self.num_skipped),
+                ("elapsed-ms", round(elapsed * 1000, 3)),
+                (
+                    "articles-per-second",
+                    round(num_results / elapsed, 3) if elapsed else None,
+                ),
+                (
+                    "slowest",
+                    [{"path": path, "total-ms": ms} for ms, path in self.slowest],
+                ),
+            ]
+        )
+
+
+AJSON_PATH_REGEX = re.compile(r"^.*/elife-\d{5,}-v\d\.xml\.json$")
 
 
-def json_files(print_queue, path):
+def json_files(path):
     json_files = utils.resolve_path(path)
-    cregex = re.compile(r"^.*/elife-\d{5,}-v\d\.xml\.json$")
-    ajson_file_list = lfilter(cregex.match, json_files)
+    ajson_file_list = lfilter(AJSON_PATH_REGEX.match, json_files)
     if not ajson_file_list:
         LOG.info("found no article json at %r" % os.path.abspath(path))
-        clean_up(print_queue)
-        sys.exit(0)  # successfully did nothing
     return ajson_file_list
 
 
-def handle_many_concurrently(print_queue, action, path, force, dry_run):
+def json_members(path, ordered=False):
+    """returns an iterable of pairs of (path, content) for the article-json at `path`.
+    `path` may be a directory of article-json files, in which case `content` is `None` and read as needed,
+    or a tar or zip archive of article-json files or an NDJSON file of article-json, which are read one member at a time.
+    NDJSON members are named by their line number, the article is identified by its data when it is ingested.
+    `ordered=True` returns a directory of article-json in ascending order."""
+    if not sources.is_archive(path):
+        file_list = json_files(path)
+        return [(p, None) for p in (sorted(file_list) if ordered else file_list)]
+
+    def ajson_members():
+        for member_path, content in sources.members(path):
+            if sources.is_ndjson(path) or AJSON_PATH_REGEX.match(member_path):
+                yield member_path, content
+
+    return ajson_members()
+
+
+def handle_many_concurrently(results, action, path, force, dry_run):
     try:
-        ajson_file_list = json_files(print_queue, path)
+        ajson_member_list = results.expect(json_members(path))
         aws_events.notify(STOP)  # defer sending notifications
         # order cannot be guaranteed
         # timeout=10 # seconds, I presume.
-        Parallel(n_jobs=-1, timeout=10)(
-            delayed(job)(print_queue, action, path, force, dry_run)
-            for path in ajson_file_list
+        # results are returned to this process as they complete, in order.
+        result_list = Parallel(n_jobs=-1, timeout=10, return_as="generator")(
+            delayed(job)(action, path, force, dry_run, content)
+            for path, content in ajson_member_list
         )  # pylint: disable=unexpected-keyword-arg
-        clean_up(print_queue)
-        sys.exit(0)  # TODO: return with num failed
+        for result in result_list:
+            results.add(result)
     finally:
         aws_events.notify(START)  # resume sending notifications, process outstanding
 
 
-def handle_many_serially(print_queue, action, path, force, dry_run):
+def handle_many_serially(results, action, path, force, dry_run):
     try:
-        ajson_file_list = sorted(json_files(print_queue, path))  # ASC
+        ajson_member_list = results.expect(json_members(path, ordered=True))  # ASC
         aws_events.notify(STOP)  # defer sending notifications
-        num_failed = sum(
-            [job(print_queue, action, path, force, dry_run) for path in ajson_file_list]
-        )
-        clean_up(print_queue)
-        sys.exit(num_failed)
+        for path, content in ajson_member_list:
+            results.add(job(action, path, force, dry_run, content))
     finally:
         aws_events.notify(START)  # resume sending notifications, process outstanding
 
@@ -313,12 +471,26 @@ class Command(ModCommand):
     def add_arguments(self, parser):
         parser.add_argument("--id", dest="msid", type=int)
         parser.add_argument("--version", dest="version", type=int)
+        # a directory of article-json, or a tar, zip or NDJSON bundle of article-json
         parser.add_argument("--dir", dest="dir")
         parser.add_argument("--force", action="store_true", default=False)
         parser.add_argument("--dry-run", action="store_true", default=False)
 
         parser.add_argument("--serial", action="store_true", default=False)
 
+        # checkpointing of `--dir` runs
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            default=False,
+            help="skip files successfully ingested by a previous run that haven't changed since",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="path to the checkpoint journal. defaults to `settings.CHECKPOINT_FILE`",
+        )
+
         # might remove this and hide the implementation details in bot-lax ...
         parser.add_argument(
             "--ingest", dest="action", action="store_const", const=INGEST
@@ -363,12 +535,7 @@ class Command(ModCommand):
                 "no action specified. I need either a 'ingest', 'publish' or 'ingest+publish' action"
             )
 
-        if serial:
-            import queue
-
-            print_queue = queue.Queue()
-
-        else:
+        if path and not serial:
             # if not serial, ensure LAX_MULTIPROCESSING env is set.
             # this tweaks settings.py during django setup and allows other modules to
             # share a multiprocessing.Manager
@@ -379,9 +546,8 @@ class Command(ModCommand):
                     args,
                     options,
                 )
-            manager = settings.MP_MANAGER
-            print_queue = manager.Queue()
 
+        retcode = 0
         try:
             if path:
                 if options["msid"] or options["version"]:
@@ -389,13 +555,33 @@ class Command(ModCommand):
                         "the 'id' and 'version' options are not required when a 'dir' option is passed"
                     )
 
-                if not os.path.isdir(path):
+                if not (os.path.isdir(path) or sources.is_archive(path)):
                     self.invalid_args(
-                        "the 'dir' option must point to a directory. got %r" % path
+                        "the 'dir' option must point to a directory or a tar, zip or NDJSON file. got %r"
+                        % path
                     )
 
+                # a dry run doesn't ingest anything and so has nothing to checkpoint.
+                # otherwise only runs that ask for it are checkpointed, each result is a commit to the journal.
+                journal = None
+                if not dry_run and (options["resume"] or options["checkpoint"]):
+                    journal = checkpoint.Journal(
+                        "ingest:%s" % action, options["checkpoint"]
+                    )
+
+                # each result is written as a line of json as it completes, followed by a summary
+                results = Results(
+                    self.stdout, journal=journal, resume=options["resume"]
+                )
                 fn = handle_many_serially if serial else handle_many_concurrently
-                fn(print_queue, action, path, force, dry_run)
+                try:
+                    fn(results, action, path, force, dry_run)
+                finally:
+                    self.stdout.write(utils.json_dumps({"summary": results.summary()}))
+                    if journal:
+                        journal.close()
+                # exit codes wrap at 256, a count of failures could exit as success
+                retcode = 1 if results.num_failed() else 0
 
             else:
                 if not (options["msid"] and options["version"]):
@@ -403,8 +589,7 @@ class Command(ModCommand):
                         "the 'id' and 'version' options are both required when a 'dir' option is not passed"
                     )
 
-                handle_single(
-                    print_queue,
+                struct = handle_single(
                     action,
                     options["infile"],
                     msid,
@@ -412,14 +597,16 @@ class Command(ModCommand):
                     force,
                     dry_run,
                 )
+                self.stdout.write(utils.json_dumps(struct))
+                retcode = 1 if failed(struct) else 0
 
         except KeyboardInterrupt:
-            LOG.info("ctrl-c caught somewhere, printing buffer")
+            LOG.info("ctrl-c caught somewhere")
+            retcode = 1
 
         except Exception as err:
             LOG.exception("unhandled exception!")
-            error(
-                print_queue,
+            struct = error(
                 ERROR,
                 codes.UNKNOWN,
                 str(err),
@@ -428,8 +615,8 @@ class Command(ModCommand):
                 self.log_context,
                 trace=ftb(err),
             )
+            self.stdout.write(utils.json_dumps(struct))
+            retcode = 1
 
-        finally:
-            for msg in iter(print_queue.get, "STOP"):
-                self.stdout.write(msg)
-            self.stdout.flush()
+        self.stdout.flush()
+        sys.exit(retcode)
@@ -0,0 +1,199 @@
+"""
+a long-running counterpart to the `ingest` script.
+
+`ingest` boots Django, loads the schemas and parses the api-raml for every single article.
+The worker pays that cost once and then reads ingest requests as newline-delimited json,
+one request per line, from stdin or a local Unix socket:
+
+    {"action": "ingest", "id": 12345, "version": 1, "force": false, "dry-run": false, "data": {"article": {...}}}
+
+`action` is one of 'ingest', 'publish' or 'ingest-publish'.
+`id` and `version` are optional when `data` is given and are read from the article-json.
+`data` is not required for 'publish' requests.
+
+Each request is answered with a single line of json, the same struct the `ingest` script writes.
+
+"""
+
+import os, sys, socketserver, argparse
+from django.db import connection, close_old_connections
+from publisher import utils, codes, codec
+from publisher.utils import formatted_traceback as ftb
+from publisher.ajson_ingestor import StateError
+from . import ingest
+from .ingest import INVALID, ERROR, IMPORT_TYPES, PUBLISH
+from .modcommand import ModCommand
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _handle(line):
+    "performs a single `line` of json, returning a result struct"
+    force = dry_run = False
+    log_context = {"msid": None, "version": None, "identical": False}
+    try:
+        try:
+            request = codec.loads(line)
+        except ValueError as err:
+            msg = "could not decode the json you gave me: %r for request: %r" % (
+                err.msg,
+                line,
+            )
+            raise StateError(codes.BAD_REQUEST, msg)
+
+        utils.ensure(isinstance(request, dict), "request must be a json object")
+        action = request.get("action")
+        force = bool(request.get("force", False))
+        dry_run = bool(request.get("dry-run", False))
+        data = request.get("data")
+
+        if action not in IMPORT_TYPES:
+            raise StateError(
+                codes.BAD_REQUEST,
+                "unknown action %r. I need one of: %s"
+                % (action, ", ".join(IMPORT_TYPES)),
+            )
+
+        if action == PUBLISH:
+            data = None
+        elif not isinstance(data, dict) or "article" not in data:
+            raise StateError(
+                codes.BAD_REQUEST,
+                "action %r requires article-json under the 'data' key" % action,
+            )
+
+        msid, version = request.get("id"), request.get("version")
+        if data:
+            data_msid, data_version = ingest.data_ids(data)
+            msid = data_msid if msid is None else msid
+            version = data_version if version is None else version
+        if not (msid and version):
+            raise StateError(
+                codes.BAD_REQUEST,
+                "the 'id' and 'version' keys are both required when no 'data' is given",
+            )
+        try:
+            msid, version = int(msid), int(version)
+        except (ValueError, TypeError):
+            raise StateError(
+                codes.BAD_REQUEST,
+                "the 'id' and 'version' keys must be integers, got: %r and %r"
+                % (msid, version),
+            )
+        log_context.update({"msid": msid, "version": version})
+
+        LOG.info(
+            "attempting to %s article %s v%s",
+            action,
+            msid,
+            version,
+            extra=log_context,
+        )
+
+        if data:
+            ingest.check_data(data, msid, version)
+
+    except StateError as err:
+        return ingest.error_from_err(INVALID, err, force, dry_run, log_context)
+
+    except Exception as err:
+        LOG.exception(
+            "unhandled exception attempting to read ingest request",
+            extra=log_context,
+        )
+        return ingest.error(
+            ERROR,
+            codes.UNKNOWN,
+            str(err),
+            force,
+            dry_run,
+            log_context,
+            trace=ftb(err),
+        )
+
+    return ingest.handle_data(action, data, msid, version, force, dry_run, log_context)
+
+
+def handle_line(line):
+    "handles a single line of newline-delimited json, returning a result struct"
+    if not connection.in_atomic_block:
+        # the worker outlives any single request. discard connections that have errored or expired.
+        close_old_connections()
+    return _handle(line)
+
+
+def serve(infile, outfile):
+    "reads requests from `infile` until exhausted, writing results to `outfile`. returns the number of failed requests."
+    num_failed = 0
+    for line in infile:
+        if not line.strip():
+            continue
+        struct = handle_line(line)
+        num_failed += 1 if ingest.failed(struct) else 0
+        outfile.write(utils.json_dumps(struct) + "\n")  # encodes datetime objects
+        outfile.flush()
+    return num_failed
+
+
+class Writer:
+    "text wrapper around a socket's binary file"
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, string):
+        self.wfile.write(string.encode("utf-8"))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        infile = (line.decode("utf-8") for line in self.rfile)
+        serve(infile, Writer(self.wfile))
+
+
+def serve_socket(path):
+    "serves requests, one connection at a time, on a Unix socket at `path` until interrupted"
+    if os.path.exists(path):
+        # a socket left behind by a previous worker that didn't exit cleanly
+        os.unlink(path)
+    try:
+        with socketserver.UnixStreamServer(path, RequestHandler) as server:
+            LOG.info("ingest worker listening on %s", path)
+            server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+class Command(ModCommand):
+    help = "a long-running `ingest` process. reads newline-delimited json ingest requests from stdin or a Unix socket"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--socket",
+            dest="socket",
+            help="path to a Unix socket to listen on. requests are read from stdin if not given",
+        )
+        parser.add_argument(
+            "infile", nargs="?", type=argparse.FileType("r"), default=sys.stdin
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["socket"]:
+                serve_socket(options["socket"])
+                num_failed = 0
+            else:
+                LOG.info("ingest worker reading from stdin")
+                num_failed = serve(options["infile"], self.stdout)
+
+        except KeyboardInterrupt:
+            LOG.info("ctrl-c caught, stopping ingest worker")
+            num_failed = 0
+
+        self.stdout.flush()
+        sys.exit(1 if num_failed else 0)
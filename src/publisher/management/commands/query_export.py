@@ -1,17 +1,57 @@
 import io
 import sys
-from publisher.utils import subdict, lmap
-from functools import partial
+import csv
+import codecs
+from concurrent.futures import ThreadPoolExecutor
 from slugify import slugify
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db import transaction, connections
 from datetime import date
-from explorer import exporters, models
+from explorer import app_settings, models
+from explorer.utils import get_valid_connection
 import logging
 import boto3
 
 LOG = logging.getLogger(__name__)
 
+# rows are fetched from the database this many at a time
+FETCH_SIZE = 2000
+
+# S3 requires every part of a multipart upload except the last to be at least 5MiB
+PART_SIZE = 8 * 1024 * 1024
+
+
+def csv_parts(query, part_size=PART_SIZE):
+    """executes the explorer `query` and yields the result as utf-8 encoded CSV, `part_size` bytes at a time or more.
+    rows are read from a server-side cursor where supported and never held in memory all at once.
+    the CSV is identical to the output of explorer's own CSV exporter."""
+    delim = app_settings.CSV_DELIMETER
+    delim = "\t" if delim == "tab" else str(delim)
+    buf = io.StringIO()
+    buf.write(codecs.BOM_UTF8.decode("utf-8"))
+    writer = csv.writer(buf, delimiter=delim)
+
+    def flush():
+        part = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+        return part
+
+    conn = get_valid_connection(query.connection)
+    with transaction.atomic(conn.alias):
+        with conn.chunked_cursor() as cursor:
+            cursor.execute(query.final_sql())
+            writer.writerow([d[0] for d in cursor.description or []] or ["--"])
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                if buf.tell() >= part_size:
+                    yield flush()
+    yield flush()
+
 
 class Command(BaseCommand):
     help = "for snapshotting queries and uploading to s3 without celery"
@@ -19,18 +59,48 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--query-id", dest="qid", type=int, required=False)
         parser.add_argument("--skip-upload", action="store_false", dest="upload")
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=4,
+            help="number of queries to snapshot concurrently",
+        )
 
-    def _upload(self, key, data):
+    def _s3(self):
         # assume boto can find our credentials
-        s3 = boto3.resource("s3")
-        # django-sql-explorer on master branch has fixed this issue but it's still present
-        # in 1.0. `get_file_output()` is casting to a str before returning
-        data = io.BytesIO(data.getvalue().encode())
-        s3.Bucket(settings.EXPLORER_S3_BUCKET).put_object(Key=key, Body=data)
+        kwargs = {}
+        if settings.EXPLORER_S3_ENDPOINT_URL:
+            # a local S3 stand-in, like localstack
+            kwargs["endpoint_url"] = settings.EXPLORER_S3_ENDPOINT_URL
+        return boto3.client("s3", **kwargs)
+
+    def _upload(self, s3, key, part_list):
+        "streams the iterable of bytes in `part_list` to `key` as a multipart upload"
+        bucket = settings.EXPLORER_S3_BUCKET
+        upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        try:
+            parts = []
+            for part_number, body in enumerate(part_list, start=1):
+                resp = s3.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                    Body=body,
+                )
+                parts.append({"ETag": resp["ETag"], "PartNumber": part_number})
+            s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
 
     def snapshot_query(self, query_id, upload=True):
         q = models.Query.objects.get(pk=query_id)
-        exporter = exporters.get_exporter_class("csv")(q)
         safe_title = slugify(q.title)
 
         # "query1--dummy-query.csv"
@@ -43,17 +113,28 @@ class Command(BaseCommand):
             date.today().strftime("%Y-%m-%d-%H-%M-%S"),
         )
 
-        res = exporter.query.execute_query_only()
-        data = exporter._get_output(res)
-
-        for fname in [daily_fname, timestamped_fname]:
-            if upload and settings.EXPLORER_S3_BUCKET:
-                LOG.info("uploading snapshot: %s", fname)
-                self._upload(fname, data)
-                # self._upload(fname, exporter.get_file_output())
-                LOG.info("completed upload of snapshot: %s", fname)
-                self.echo("%s uploaded" % fname)
-            else:
+        part_list = csv_parts(q)
+
+        if upload and settings.EXPLORER_S3_BUCKET:
+            s3 = self._s3()
+            LOG.info("uploading snapshot: %s", daily_fname)
+            self._upload(s3, daily_fname, part_list)
+            LOG.info("completed upload of snapshot: %s", daily_fname)
+            self.echo("%s uploaded" % daily_fname)
+
+            # the timestamped snapshot is a copy of the daily snapshot made by S3
+            s3.copy_object(
+                Bucket=settings.EXPLORER_S3_BUCKET,
+                Key=timestamped_fname,
+                CopySource={"Bucket": settings.EXPLORER_S3_BUCKET, "Key": daily_fname},
+            )
+            LOG.info("completed copy of snapshot: %s", timestamped_fname)
+            self.echo("%s uploaded" % timestamped_fname)
+        else:
+            # the query is still run to catch errors
+            for _ in part_list:
+                pass
+            for fname in [daily_fname, timestamped_fname]:
                 LOG.warning(
                     "the bucket to upload query result %r hasn't been defined in your app.cfg file. skipping upload"
                     % fname
@@ -61,6 +142,13 @@ class Command(BaseCommand):
 
         self.echo(daily_fname)
 
+    def _snapshot_query_in_thread(self, query_id, upload=True):
+        try:
+            return self.snapshot_query(query_id, upload)
+        finally:
+            # each thread opens its own database connections
+            connections.close_all()
+
     def echo(self, x):
         self.stdout.write(str(x))
         self.stdout.flush()
@@ -72,13 +160,23 @@ class Command(BaseCommand):
             if qid:
                 qid_list = [qid]
             else:
-                qid_list = models.Query.objects.all().values_list("id", flat=True)
+                qid_list = list(models.Query.objects.all().values_list("id", flat=True))
 
             if not qid_list:
                 LOG.info("no query objects found, nothing to upload")
+            elif len(qid_list) == 1 or options["jobs"] < 2:
+                for query_id in qid_list:
+                    self.snapshot_query(query_id, options["upload"])
             else:
-                fnargs = subdict(options, ["upload"])
-                lmap(partial(self.snapshot_query, **fnargs), qid_list)
+                with ThreadPoolExecutor(max_workers=options["jobs"]) as pool:
+                    future_list = [
+                        pool.submit(
+                            self._snapshot_query_in_thread, query_id, options["upload"]
+                        )
+                        for query_id in qid_list
+                    ]
+                    # raises the first error, if any
+                    [future.result() for future in future_list]
 
         except Exception as err:
             LOG.exception(err)
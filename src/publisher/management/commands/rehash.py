@@ -1,5 +1,18 @@
-from publisher import models, fragment_logic
+"""
+calculates the hash of the stored article-json of every article version and updates those that have changed.
+
+article versions are read `--chunk-size` at a time, their article-json is hashed as stored text in `--jobs`
+worker processes and only the hashes that changed are written, one commit per chunk.
+
+"""
+
+from joblib import Parallel, delayed
+from publisher import models, fragment_logic, checkpoint
+from publisher.fields import Encoded
+from publisher.utils import chunks, call_in_worker
 from django.core.management.base import BaseCommand
+from django.db.models import TextField
+from django.db.models.functions import Cast
 import sys
 import logging
 from django.db import transaction
@@ -7,24 +20,90 @@ from django.db import transaction
 LOG = logging.getLogger(__name__)
 
 
-class Command(BaseCommand):
-    help = (
-        "calculates the hash for the stored article-json. completes in less than 2 mins"
+def hash_chunk(row_list):
+    """hashes each row in `row_list` of (id, article-json text, hash).
+    returns a pair of (num rows, list of (id, hash) for rows whose hash has changed)"""
+    changed = []
+    for pk, text, oldhash in row_list:
+        newhash = fragment_logic.hash_ajson_text(text)
+        if newhash != oldhash:
+            changed.append((pk, newhash))
+    return len(row_list), changed
+
+
+def rows(chunk_size):
+    "yields every article version as (id, article-json text, hash), ordered by id, reading `chunk_size` rows at a time"
+    q = (
+        models.ArticleVersion.objects.annotate(
+            # the stored text, without decoding it as the JSONField would
+            article_json_text=Cast("content__article_json_v1", TextField()),
+            # compressed article-json is decompressed but not decoded
+            article_json_encoded=Encoded("content__article_json_v1_compressed"),
+        )
+        .order_by("id")
+        .values_list(
+            "id", "article_json_text", "article_json_encoded", "article_json_hash"
+        )
+    )
+    last_id = 0
+    while True:
+        row_list = list(q.filter(id__gt=last_id)[:chunk_size])
+        for pk, text, encoded, oldhash in row_list:
+            yield pk, text if encoded is None else encoded, oldhash
+        if len(row_list) < chunk_size:
+            return
+        last_id = row_list[-1][0]
+
+
+def update_hashes(changed):
+    "writes the list of (id, hash) pairs in `changed` to the hash column only"
+    with transaction.atomic():
+        models.ArticleVersion.objects.bulk_update(
+            [
+                models.ArticleVersion(id=pk, article_json_hash=newhash)
+                for pk, newhash in changed
+            ],
+            ["article_json_hash"],
+        )
+
+
+def rehash(chunk_size=500, n_jobs=1):
+    "rehashes every article version, returning a pair of (num article versions, num hashes changed)"
+    progress = checkpoint.Progress(
+        models.ArticleVersion.objects.count(), label="rehashed"
+    )
+    num_changed = 0
+    # chunks are hashed in order, the results returned to this process as each completes.
+    result_list = Parallel(n_jobs=n_jobs, return_as="generator")(
+        delayed(call_in_worker)(__name__, "hash_chunk", chunk)
+        for chunk in chunks(rows(chunk_size), chunk_size)
     )
+    for num, changed in result_list:
+        if changed:
+            update_hashes(changed)
+        num_changed += len(changed)
+        progress.tick(num)
+    return progress.count, num_changed
+
+
+class Command(BaseCommand):
+    help = "calculates the hash for the stored article-json, updating those that have changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=-1,
+            help="number of worker processes hashing article-json. defaults to one per CPU",
+        )
 
     def handle(self, *args, **options):
         try:
-            with transaction.atomic():
-                # poa then vor articles. expect slowdown at about 36%
-                q = models.ArticleVersion.objects.all().order_by("status")
-                num = q.count()
-                # `.iterator()` to use server-side cursor and avoid thrashing memory
-                # https://docs.djangoproject.com/en/3.2/ref/models/querysets/#iterator
-                for i, av in enumerate(q.iterator()):
-                    av.article_json_hash = fragment_logic.hash_ajson(av.article_json_v1)
-                    av.save()
-                    # 13 of 152
-                    print("%s of %s" % (i, num))
+            num, num_changed = rehash(options["chunk_size"], options["jobs"])
+            LOG.info("%s of %s hashes changed", num_changed, num)
+            self.stdout.write("%s of %s hashes changed" % (num_changed, num))
+            self.stdout.flush()
         except KeyboardInterrupt:
             print("ctrl-c caught")
             sys.exit(1)
@@ -0,0 +1,183 @@
+"""
+re-renders the article-json of every article version, or a subset, from its fragments.
+
+used after a schema change or a bulk change to fragments. each article version is merged, pre-processed, validated,
+snippeted and hashed as `fragment_logic.set_article_json` would. article versions whose hash hasn't changed are skipped.
+
+article versions are rendered `--chunk-size` at a time in `--jobs` worker processes, each chunk committed as it completes.
+the event bus is notified once for each article that changed, queued in the same transaction as the chunk that changed it.
+
+a json report is written to stdout when finished, with a list of the article versions that failed to render:
+
+    {"total": 10, "changed": 2, "unchanged": 7, "failed": 1, "failures": [{"msid": 123, "version": 1, "code": "invalid-article-json", "message": "..."}]}
+
+"""
+
+import sys
+from joblib import Parallel, delayed
+from jsonschema import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from publisher import models, fragment_logic, aws_events, codes, checkpoint, utils
+from publisher.utils import chunks, call_in_worker
+from publisher.utils import StateError
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _failure(av, code, message):
+    LOG.warning(
+        "failed to render article %s v%s: %s",
+        av.article.manuscript_id,
+        av.version,
+        message,
+        extra={"msid": av.article.manuscript_id, "version": av.version},
+    )
+    return {
+        "msid": av.article.manuscript_id,
+        "version": av.version,
+        "code": code,
+        "message": message,
+    }
+
+
+def render_chunk(id_list, dry_run=False):
+    """renders each article version in `id_list` and saves those that have changed in a single transaction,
+    along with a notification for each article changed.
+    returns a tuple of (num rendered, num changed, msids of articles changed, list of failures).
+    """
+    av_list = (
+        models.ArticleVersion.objects.filter(id__in=id_list)
+        .select_related("article")
+        .order_by("id")
+    )
+    changed, failures = [], []
+    for av in av_list:
+        try:
+            result, snippet, newhash = fragment_logic.render(av)
+        except StateError as err:
+            failures.append(_failure(av, err.code, err.message))
+            continue
+        except ValidationError as err:
+            failures.append(_failure(av, codes.INVALID, err.message))
+            continue
+        except Exception as err:
+            LOG.exception("unhandled error rendering %r", av)
+            failures.append(_failure(av, codes.UNKNOWN, str(err)))
+            continue
+
+        if newhash == av.article_json_hash:
+            continue
+        av.article_json_v1 = result
+        av.article_json_v1_snippet = snippet
+        av.article_json_hash = newhash
+        av.datetime_record_updated = utils.utcnow()
+        changed.append(av)
+
+    msid_list = list(dict.fromkeys(av.article.manuscript_id for av in changed))
+    if changed and not dry_run:
+        with transaction.atomic():
+            models.ArticleVersion.objects.bulk_update(
+                changed,
+                [
+                    "article_json_v1_snippet",
+                    "article_json_hash",
+                    "datetime_record_updated",
+                ],
+            )
+            # article versions that have never been rendered have no content yet
+            content_list = [av.content for av in changed]
+            existing = set(
+                models.ArticleVersionContent.objects.filter(
+                    pk__in=[content.pk for content in content_list]
+                ).values_list("pk", flat=True)
+            )
+            models.ArticleVersionContent.objects.bulk_update(
+                [content for content in content_list if content.pk in existing],
+                ["article_json_v1", "article_json_v1_compressed"],
+            )
+            models.ArticleVersionContent.objects.bulk_create(
+                [content for content in content_list if content.pk not in existing]
+            )
+            # notifications are queued in the same transaction as the article-json they announce
+            for msid in msid_list:
+                aws_events.enqueue(msid)
+
+    return len(av_list), len(changed), msid_list, failures
+
+
+def rerender(queryset, chunk_size=100, n_jobs=1, dry_run=False):
+    "re-renders the article versions in `queryset`. returns a report."
+    id_list = list(queryset.order_by("id").values_list("id", flat=True))
+    progress = checkpoint.Progress(len(id_list), label="rendered")
+    report = {"total": len(id_list), "changed": 0, "unchanged": 0, "failed": 0}
+    failures = []
+
+    # results are returned to this process as each chunk completes.
+    result_list = Parallel(n_jobs=n_jobs, return_as="generator")(
+        delayed(call_in_worker)(__name__, "render_chunk", chunk, dry_run)
+        for chunk in chunks(id_list, chunk_size)
+    )
+
+    try:
+        # defer sending notifications queued by chunks rendered in this process.
+        # worker processes send their notifications as each chunk is committed.
+        aws_events.notify(aws_events.STOP)
+        for num, num_changed, _, chunk_failures in result_list:
+            report["changed"] += num_changed
+            report["failed"] += len(chunk_failures)
+            failures.extend(chunk_failures)
+            progress.tick(num)
+    finally:
+        aws_events.notify(aws_events.START)  # process outstanding notifications
+
+    report["unchanged"] = report["total"] - report["changed"] - report["failed"]
+    report["failures"] = failures
+    return report
+
+
+class Command(BaseCommand):
+    help = "re-renders article-json from fragments for all articles or a subset of them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--msid",
+            dest="msid_list",
+            type=int,
+            nargs="+",
+            help="re-render just these articles",
+        )
+        parser.add_argument(
+            "--status", choices=[models.POA, models.VOR], help="poa or vor"
+        )
+        parser.add_argument("--chunk-size", type=int, default=100)
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="number of worker processes rendering article-json",
+        )
+        parser.add_argument("--dry-run", action="store_true", default=False)
+
+    def handle(self, *args, **options):
+        queryset = models.ArticleVersion.objects.all()
+        if options["msid_list"]:
+            queryset = queryset.filter(article__manuscript_id__in=options["msid_list"])
+        if options["status"]:
+            queryset = queryset.filter(status=options["status"])
+
+        try:
+            report = rerender(
+                queryset,
+                options["chunk_size"],
+                options["jobs"],
+                options["dry_run"],
+            )
+        except KeyboardInterrupt:
+            LOG.warning("ctrl-c caught, stopping")
+            sys.exit(1)
+
+        self.stdout.write(utils.json_dumps(report, indent=4))
+        self.stdout.flush()
+        sys.exit(1 if report["failed"] else 0)
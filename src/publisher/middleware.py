@@ -1,7 +1,7 @@
 from django.conf import settings
-import json
 import logging
 from .utils import isint
+from . import codec
 from .api_v2_views import flatten_accept, _ctype, http_406
 
 LOG = logging.getLogger(__name__)
@@ -109,11 +109,11 @@ def error_content_check(get_response_fn):
     def middleware(request):
         response = get_response_fn(request)
         if response.status_code > 399 and "json" in get_content_type(response):
-            body = json.loads(response.content.decode("utf-8"))
+            body = codec.loads(response.content)
             if not "title" in body and "detail" in body:
                 body["title"] = body["detail"]
                 del body["detail"]
-                response.content = bytes(json.dumps(body, ensure_ascii=False), "utf-8")
+                response.content = codec.dumpb(body)
         return response
 
     return middleware
@@ -220,7 +220,7 @@ def downgrade_vor_content_type(get_response_fn):
             # user requested the current latest VOR version
             return response
 
-        body = json.loads(response.content.decode("utf-8"))
+        body = codec.loads(response.content)
 
         if max_accepted_vor == previous_vor_version:
             # client specifically accepts an older VOR only (deprecated).
@@ -289,7 +289,7 @@ def downgrade_poa_content_type(get_response_fn):
         if max_accepted_poa == previous_poa_version:
             # client specifically accepts an older POA only (deprecated).
             # we might be ok if the content is valid under the previous version.
-            body = json.loads(response.content.decode("utf-8"))
+            body = codec.loads(response.content)
             if poa_valid_under_previous_version(body):
                 # downgrade content-type
                 response["Content-Type"] = (
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("publisher", "0004_articleversionreviewedpreprintrelation_reviewedpreprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="articleversion",
+            name="article_json_ingest_hash",
+            field=models.CharField(
+                blank=True,
+                help_text="md5 digest of the article-json last ingested. see `fragment_logic.hash_ingest` for algorithm",
+                max_length=32,
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:06
+
+import annoying.fields
+from django.db import migrations
+import publisher.codec
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("publisher", "0005_articleversion_article_json_ingest_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="articlefragment",
+            name="fragment",
+            field=annoying.fields.JSONField(
+                deserializer=publisher.codec.loads,
+                help_text="partial piece of article data to be merged in",
+                serializer=publisher.codec.dumps,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="articleversion",
+            name="article_json_v1",
+            field=annoying.fields.JSONField(
+                blank=True,
+                deserializer=publisher.codec.loads,
+                help_text="Valid article-json.",
+                null=True,
+                serializer=publisher.codec.dumps,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="articleversion",
+            name="article_json_v1_snippet",
+            field=annoying.fields.JSONField(
+                blank=True,
+                deserializer=publisher.codec.loads,
+                help_text="Valid article-json snippet, extracted from the valid article-json",
+                null=True,
+                serializer=publisher.codec.dumps,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="articleversionextrelation",
+            name="citation",
+            field=annoying.fields.JSONField(
+                deserializer=publisher.codec.loads,
+                help_text="snippet of json describing the external link",
+                serializer=publisher.codec.dumps,
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:29
+
+import annoying.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import publisher.codec
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("publisher", "0007_notification"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArticleVersionContent",
+            fields=[
+                (
+                    "articleversion",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="content",
+                        serialize=False,
+                        to="publisher.articleversion",
+                    ),
+                ),
+                (
+                    "article_json_v1",
+                    annoying.fields.JSONField(
+                        blank=True,
+                        deserializer=publisher.codec.loads,
+                        help_text="Valid article-json.",
+                        null=True,
+                        serializer=publisher.codec.dumps,
+                    ),
+                ),
+            ],
+        ),
+    ]
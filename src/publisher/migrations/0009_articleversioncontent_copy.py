@@ -0,0 +1,62 @@
+# the article-json is copied into the `publisher_articleversioncontent` table created by `0008_articleversioncontent`
+# and then dropped from `publisher_articleversion`.
+# the migration isn't atomic: each batch is committed as it is copied so no long running transaction holds locks
+# over the whole table. an interrupted migration can be run again and copies only those rows not yet copied.
+
+from django.db import migrations, transaction
+
+# article versions are copied this many at a time
+BATCH_SIZE = 500
+
+
+def _batches(schema_editor, sql):
+    "executes `sql` once for each range of `BATCH_SIZE` article version ids, committing each"
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(id), MAX(id) FROM publisher_articleversion")
+        min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return
+    for start in range(min_id, max_id + 1, BATCH_SIZE):
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [start, start + BATCH_SIZE])
+
+
+def copy_content(apps, schema_editor):
+    # the article-json is copied as-is, without being decoded and encoded again
+    _batches(
+        schema_editor,
+        """INSERT INTO publisher_articleversioncontent (articleversion_id, article_json_v1)
+        SELECT av.id, av.article_json_v1 FROM publisher_articleversion av
+        WHERE av.id >= %s AND av.id < %s AND av.article_json_v1 IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM publisher_articleversioncontent avc WHERE avc.articleversion_id = av.id)""",
+    )
+
+
+def copy_content_back(apps, schema_editor):
+    _batches(
+        schema_editor,
+        """UPDATE publisher_articleversion SET article_json_v1 = (
+            SELECT article_json_v1 FROM publisher_articleversioncontent
+            WHERE articleversion_id = publisher_articleversion.id)
+        WHERE id >= %s AND id < %s""",
+    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("publisher", "0008_articleversioncontent"),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_content, copy_content_back, atomic=False),
+        migrations.RemoveField(
+            model_name="articleversion",
+            name="article_json_v1",
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:35
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def summarise(apps, schema_editor):
+    "populates the summary of every article's versions in a single update"
+    Article = apps.get_model("publisher", "Article")
+    ArticleVersion = apps.get_model("publisher", "ArticleVersion")
+    versions = ArticleVersion.objects.filter(article=OuterRef("pk"))
+    earliest = versions.order_by("version")
+    latest = versions.order_by("-version")
+    earliest_vor = versions.filter(status="vor").order_by("version")
+    Article.objects.update(
+        datetime_published=Subquery(earliest.values("datetime_published")[:1]),
+        version=Subquery(latest.values("version")[:1]),
+        status=Subquery(latest.values("status")[:1]),
+        earliest_vor_version=Subquery(earliest_vor.values("version")[:1]),
+        datetime_earliest_vor=Subquery(earliest_vor.values("datetime_published")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("publisher", "0009_articleversioncontent_copy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="datetime_earliest_vor",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Date the first VOR version of this article was published",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="datetime_published",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Date the first version of this article was published",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="earliest_vor_version",
+            field=models.PositiveSmallIntegerField(
+                blank=True, help_text="The first VOR version of this article", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="status",
+            field=models.CharField(
+                blank=True,
+                choices=[("poa", "POA"), ("vor", "VOR")],
+                help_text="The status of the latest version of this article",
+                max_length=3,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="version",
+            field=models.PositiveSmallIntegerField(
+                blank=True, help_text="The latest version of this article", null=True
+            ),
+        ),
+        migrations.RunPython(summarise, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:41
+
+from django.db import migrations
+import publisher.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("publisher", "0010_article_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="articleversioncontent",
+            name="article_json_v1_compressed",
+            field=publisher.fields.CompressedJSONField(
+                blank=True, help_text="Valid article-json, compressed.", null=True
+            ),
+        ),
+    ]
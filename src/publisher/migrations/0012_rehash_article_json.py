@@ -0,0 +1,75 @@
+import hashlib
+import json
+from django.db import migrations, transaction
+
+# the stored hash of each article version's article-json used to include the "-published" value that
+# `fragment_logic.pre_process` adds and that is never stored. it is now the hash of the article-json as stored,
+# see `fragment_logic.hash_article_json`. the hashes are recalculated here, without rendering or notifying anything,
+# so an upgraded database doesn't see every article as changed on its next ingest, rehash or rerender.
+# the migration isn't atomic, each batch is committed as it is hashed.
+
+# article versions are hashed this many at a time
+BATCH_SIZE = 500
+
+
+def hash_article_json(article_json):
+    "the same as `fragment_logic.hash_article_json` for article-json as it is stored"
+    string = json.dumps(article_json)
+    return hashlib.md5(string.encode("utf-8")).hexdigest()
+
+
+def rehash(ArticleVersion, ArticleVersionContent, using="default"):
+    "recalculates the hash of every article version with stored article-json. returns the number of hashes changed"
+    num_changed = 0
+    last_id = 0
+    while True:
+        row_list = list(
+            ArticleVersionContent.objects.using(using)
+            .filter(articleversion_id__gt=last_id)
+            .order_by("articleversion_id")
+            .values_list(
+                "articleversion_id",
+                "article_json_v1",
+                "article_json_v1_compressed",
+                "articleversion__article_json_hash",
+            )[:BATCH_SIZE]
+        )
+        changed = []
+        for pk, article_json, compressed, oldhash in row_list:
+            article_json = article_json if compressed is None else compressed
+            if article_json is None:
+                continue
+            newhash = hash_article_json(article_json)
+            if newhash != oldhash:
+                changed.append(ArticleVersion(id=pk, article_json_hash=newhash))
+        if changed:
+            with transaction.atomic(using=using):
+                ArticleVersion.objects.using(using).bulk_update(
+                    changed, ["article_json_hash"]
+                )
+        num_changed += len(changed)
+        if len(row_list) < BATCH_SIZE:
+            return num_changed
+        last_id = row_list[-1][0]
+
+
+def forwards(apps, schema_editor):
+    rehash(
+        apps.get_model("publisher", "ArticleVersion"),
+        apps.get_model("publisher", "ArticleVersionContent"),
+        schema_editor.connection.alias,
+    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("publisher", "0011_articleversioncontent_compressed"),
+    ]
+
+    operations = [
+        # the previous hashes can't be recalculated without the values used to render the article-json
+        migrations.RunPython(forwards, migrations.RunPython.noop, atomic=False),
+    ]
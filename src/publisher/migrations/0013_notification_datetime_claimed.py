@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("publisher", "0012_rehash_article_json"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="datetime_claimed",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="when a dispatcher claimed this notification to send it",
+                null=True,
+            ),
+        ),
+    ]
@@ -1,14 +1,15 @@
 from slugify import slugify
 from django.db import models
+from django.db.models import OuterRef, Subquery
 
-# from .fields import JSONField
 from functools import partial
 from annoying.fields import JSONField
-from .utils import msid2doi, mk_dxdoi_link, json_dumps, ordered_json_loads
-from django.core.exceptions import ObjectDoesNotExist
+from .fields import CompressedJSONField
+from .utils import msid2doi, mk_dxdoi_link
+from . import codec
 from django.conf import settings
 
-JSONField = partial(JSONField, serializer=json_dumps, deserializer=ordered_json_loads)
+JSONField = partial(JSONField, serializer=codec.dumps, deserializer=codec.loads)
 
 POA = settings.POA
 VOR = settings.VOR
@@ -217,9 +218,7 @@ class Article(models.Model):
         try:
             if defer:
                 return (
-                    self.articleversion_set.defer(
-                        "article_json_v1", "article_json_v1_snippet"
-                    )
+                    self.articleversion_set.defer("article_json_v1_snippet")
                     .filter(status=POA)
                     .earliest("version")
                 )
@@ -231,9 +230,7 @@ class Article(models.Model):
         try:
             if defer:
                 return (
-                    self.articleversion_set.defer(
-                        "article_json_v1", "article_json_v1_snippet"
-                    )
+                    self.articleversion_set.defer("article_json_v1_snippet")
                     .filter(status=VOR)
                     .earliest("version")
                 )
@@ -249,20 +246,41 @@ class Article(models.Model):
     def earliest_version(self):
         return self.articleversion_set.earliest("version")
 
-    @property
-    def datetime_published(self):
-        try:
-            return self.earliest_version.datetime_published
-        except ObjectDoesNotExist:
-            return None
-
     @property
     def title(self):
         return self.latest_version.title
 
-    @property
-    def version(self):
-        return self.latest_version.version
+    # a summary of the article's versions, updated with `summarise` whenever an article version changes.
+    # these values are read on every render of the article-json and would otherwise be a query each.
+
+    datetime_published = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Date the first version of this article was published",
+    )
+    version = models.PositiveSmallIntegerField(
+        blank=True, null=True, help_text="The latest version of this article"
+    )
+    status = models.CharField(
+        max_length=3,
+        choices=[(POA, "POA"), (VOR, "VOR")],
+        blank=True,
+        null=True,
+        help_text="The status of the latest version of this article",
+    )
+    earliest_vor_version = models.PositiveSmallIntegerField(
+        blank=True, null=True, help_text="The first VOR version of this article"
+    )
+    datetime_earliest_vor = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Date the first VOR version of this article was published",
+    )
+
+    def summarise(self):
+        "updates the summary of this article's versions from the database. see `article_summary`."
+        Article.objects.filter(pk=self.pk).update(**article_summary())
+        self.refresh_from_db(fields=SUMMARY_FIELDS)
 
     class Meta:
         ordering = ("-date_initial_qc",)
@@ -280,6 +298,32 @@ class Article(models.Model):
         return "<Article %s>" % self.doi
 
 
+SUMMARY_FIELDS = [
+    "datetime_published",
+    "version",
+    "status",
+    "earliest_vor_version",
+    "datetime_earliest_vor",
+]
+
+
+def article_summary():
+    "returns a map of `Article` summary fields to the expressions that update them"
+    versions = ArticleVersion.objects.filter(article=OuterRef("pk"))
+    earliest = versions.order_by("version")
+    latest = versions.order_by("-version")
+    earliest_vor = versions.filter(status=VOR).order_by("version")
+    return {
+        "datetime_published": Subquery(earliest.values("datetime_published")[:1]),
+        "version": Subquery(latest.values("version")[:1]),
+        "status": Subquery(latest.values("status")[:1]),
+        "earliest_vor_version": Subquery(earliest_vor.values("version")[:1]),
+        "datetime_earliest_vor": Subquery(
+            earliest_vor.values("datetime_published")[:1]
+        ),
+    }
+
+
 class ArticleVersion(models.Model):
     # when the Article is deleted, delete this article version (never happens)
     article = models.ForeignKey(Article, on_delete=models.CASCADE)
@@ -304,7 +348,7 @@ class ArticleVersion(models.Model):
     )
 
     # TODO: rename these fields to 'article_json' and 'article_json_snippet'
-    article_json_v1 = JSONField(null=True, blank=True, help_text="Valid article-json.")
+    # the article-json is stored apart from the article version, see `ArticleVersionContent`.
     article_json_v1_snippet = JSONField(
         null=True,
         blank=True,
@@ -317,6 +361,12 @@ class ArticleVersion(models.Model):
         blank=True,
         help_text="md5 digest of merged result. see `fragment_logic.hash_ajson` for algorithm",
     )
+    article_json_ingest_hash = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+        help_text="md5 digest of the article-json last ingested. see `fragment_logic.hash_ingest` for algorithm",
+    )
 
     datetime_record_created = models.DateTimeField(
         auto_now_add=True, help_text="Date this article was created"
@@ -329,6 +379,29 @@ class ArticleVersion(models.Model):
         ordering = ("version",)  # ASC, earliest to latest
         unique_together = ("article", "version")
 
+    @property
+    def article_json_v1(self):
+        "valid article-json. loaded from `ArticleVersionContent` the first time it is accessed."
+        try:
+            return self.content.article_json
+        except ArticleVersionContent.DoesNotExist:
+            return None
+
+    @article_json_v1.setter
+    def article_json_v1(self, data):
+        if not ArticleVersion.content.is_cached(self):
+            # replaced, not updated. don't load the previous article-json just to discard it
+            self.content = ArticleVersionContent(articleversion_id=self.pk)
+        self.content.article_json = data
+        self._content_changed = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if getattr(self, "_content_changed", False):
+            self.content.articleversion = self
+            self.content.save()
+            self._content_changed = False
+
     def published(self):
         "returns True if this version of the article has a publication date"
         return self.datetime_published is not None
@@ -343,6 +416,44 @@ class ArticleVersion(models.Model):
         return "<ArticleVersion %s>" % self
 
 
+class ArticleVersionContent(models.Model):
+    """the article-json of an ArticleVersion.
+    kept in it's own table so queries for article version metadata don't read megabytes of article-json per row.
+    """
+
+    # when the ArticleVersion is deleted, delete it's content
+    articleversion = models.OneToOneField(
+        ArticleVersion,
+        primary_key=True,
+        related_name="content",
+        on_delete=models.CASCADE,
+    )
+    # deprecated. article-json is moved to `article_json_v1_compressed` by the `compress_article_json` command.
+    article_json_v1 = JSONField(null=True, blank=True, help_text="Valid article-json.")
+    article_json_v1_compressed = CompressedJSONField(
+        null=True, blank=True, help_text="Valid article-json, compressed."
+    )
+
+    @property
+    def article_json(self):
+        "the article-json, compressed or not"
+        if self.article_json_v1_compressed is not None:
+            return self.article_json_v1_compressed
+        return self.article_json_v1
+
+    @article_json.setter
+    def article_json(self, data):
+        # article-json is always written compressed
+        self.article_json_v1_compressed = data
+        self.article_json_v1 = None
+
+    def __str__(self):
+        return str(self.articleversion_id)
+
+    def __repr__(self):
+        return "<ArticleVersionContent %s>" % self.articleversion_id
+
+
 # the bulk of the article data, derived from the xml via the bot-lax adaptor
 XML2JSON = "xml->json"
 
@@ -522,3 +633,30 @@ class ArticleVersionReviewedPreprintRelation(models.Model):
     def __repr__(self):
         # "<ArticleVersionReviewedPreprintRelation av 123 => rpp 321>"
         return "<ArticleVersionReviewedPreprintRelation %s>" % self
+
+
+class Notification(models.Model):
+    """an event bus notification for an article, written in the same transaction as the change to the article.
+    the outbox of notifications is drained by the `dispatch_events` command, see `settings.EVENT_OUTBOX`.
+    """
+
+    # not a foreign key, deleted articles are notified too
+    manuscript_id = models.BigIntegerField(db_index=True)
+    datetime_queued = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(
+        default=0, help_text="number of failed attempts to send this notification"
+    )
+    datetime_claimed = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="when a dispatcher claimed this notification to send it",
+    )
+
+    class Meta:
+        ordering = ("id",)  # ASC, oldest first
+
+    def __str__(self):
+        return str(self.manuscript_id)
+
+    def __repr__(self):
+        return "<Notification %s>" % self.manuscript_id
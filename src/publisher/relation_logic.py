@@ -1,68 +1,101 @@
 from publisher import models, codes
-from publisher.utils import create_or_update, ensure, first, StateError, msid2doi
+from publisher.utils import ensure, StateError, msid2doi
 import logging
 from django.conf import settings
+from django.db.models import F
 
 LOG = logging.getLogger(__name__)
 
 
-def remove_relationships(av):
-    """destroys any relationships that may exist for given ArticleVersion `av`.
-    this is necessary to accommodate silent corrections where the relations for
-    a specific article version may change.
-    This should be executed with a transaction."""
-    models.ArticleVersionRelation.objects.filter(articleversion=av).delete()
-    models.ArticleVersionExtRelation.objects.filter(articleversion=av).delete()
-    models.ArticleVersionReviewedPreprintRelation.objects.filter(
-        articleversion=av
-    ).delete()
-
-
 #
 # internal relationships
 # an ArticleVersion can be related to an Article
 #
 
 
-def relate(av, a):
-    "creates a relationship between an ArticleVersion `av` and an Article `a`."
-    data = {"articleversion": av, "related_to": a}
-    return first(
-        create_or_update(models.ArticleVersionRelation, data, create=True, update=False)
-    )
-
-
-def relate_using_msid(av, msid, quiet=False):
+def sync_msid_list(av, msid_list, quiet=False):
+    """relates ArticleVersion `av` to the Articles in `msid_list` and to no others.
+    looks up all of the articles in `msid_list` at once, creates stubs for any missing articles at once and
+    then inserts and deletes only those relationships that have changed.
+    returns the list of related Article objects."""
+    msid_list = list(dict.fromkeys(int(msid) for msid in msid_list))  # unique, ordered
     if not settings.ENABLE_RELATIONS:
-        return
-    try:
-        art = models.Article.objects.get(manuscript_id=msid)
-    except models.Article.DoesNotExist:
-        # we're trying to relate this ArticleVersion to an Article that doesnt exist.
-        # create a stub article and relate it to that
-        stub = {
-            "manuscript_id": msid,
-            "journal": av.article.journal,  # saves us having to refer to logic.py and circular dependencies
-            "doi": msid2doi(msid),
-        }
-        art, _, _ = create_or_update(
-            models.Article, stub, create=settings.RELATED_ARTICLE_STUBS, update=False
-        )
+        msid_list = []
 
-    if art:
-        return relate(av, art)
+    def articles():
+        return {
+            art.manuscript_id: art
+            for art in models.Article.objects.filter(manuscript_id__in=msid_list)
+        }
 
-    msg = (
-        "article with msid %r not found (and not created) attempting to relate %r => %s"
-        % (msid, av, msid)
+    art_map = articles()
+    missing = [msid for msid in msid_list if msid not in art_map]
+    if missing and settings.RELATED_ARTICLE_STUBS:
+        # we're trying to relate this ArticleVersion to Articles that don't exist.
+        # create stub articles and relate them to those
+        stub_list = [
+            models.Article(
+                manuscript_id=msid, journal=av.article.journal, doi=msid2doi(msid)
+            )
+            for msid in missing
+        ]
+        for stub in stub_list:
+            # the journal exists and the msids were just looked for, skip the extra queries
+            stub.full_clean(exclude=["journal"], validate_unique=False)
+        models.Article.objects.bulk_create(stub_list)
+        # not every database returns the primary keys of bulk created rows
+        art_map = articles()
+        missing = []
+
+    for msid in missing:
+        msg = (
+            "article with msid %r not found (and not created) attempting to relate %r => %s"
+            % (msid, av, msid)
+        )
+        if not quiet:
+            raise StateError(codes.NO_RECORD, msg)
+        LOG.error(msg)
+
+    wanted = {art.id for art in art_map.values()}
+    existing = set(
+        models.ArticleVersionRelation.objects.filter(articleversion=av).values_list(
+            "related_to_id", flat=True
+        )
     )
-    if not quiet:
-        raise StateError(codes.NO_RECORD, msg)
-    LOG.error(msg)
+    if existing - wanted:
+        models.ArticleVersionRelation.objects.filter(
+            articleversion=av, related_to_id__in=existing - wanted
+        ).delete()
+    models.ArticleVersionRelation.objects.bulk_create(
+        [
+            models.ArticleVersionRelation(articleversion=av, related_to_id=art_id)
+            for art_id in wanted - existing
+        ]
+    )
+    return [art_map[msid] for msid in msid_list if msid in art_map]
 
 
-def relate_using_msid_list(av, msid_list, quiet=False):
-    return [relate_using_msid(av, msid, quiet) for msid in msid_list]
+def check_msid_list(av, msid_list, quiet=False):
+    """read-only counterpart to `sync_msid_list`.
+    raises the same error for a missing article that `sync_msid_list` would, without creating anything.
+    """
+    if not settings.ENABLE_RELATIONS or settings.RELATED_ARTICLE_STUBS:
+        # stubs would be created for any missing articles
+        return
+    msid_list = list(dict.fromkeys(int(msid) for msid in msid_list))  # unique, ordered
+    found = set(
+        models.Article.objects.filter(manuscript_id__in=msid_list).values_list(
+            "manuscript_id", flat=True
+        )
+    )
+    for msid in [msid for msid in msid_list if msid not in found]:
+        msg = (
+            "article with msid %r not found (and not created) attempting to relate %r => %s"
+            % (msid, av, msid)
+        )
+        if not quiet:
+            raise StateError(codes.NO_RECORD, msg)
+        LOG.error(msg)
 
 
 #
@@ -71,47 +104,91 @@ def relate_using_msid_list(av, msid_list, quiet=False):
 #
 
 
-def associate(av, citation):
+def check_citation(citation):
     ensure(
         isinstance(citation, dict) and "uri" in citation,
         "expecting a valid external-link type citation, got: %r" % citation,
     )
-    data = {"articleversion": av, "uri": citation["uri"], "citation": citation}
-    key = ["articleversion", "uri"]
-    avr, _, _ = create_or_update(
-        models.ArticleVersionExtRelation, data, key, create=True, update=True
-    )
-    return avr
 
 
-def relate_using_citation_list(av, citation_list):
-    return [associate(av, citation) for citation in citation_list]
+def check_citation_list(citation_list):
+    "read-only counterpart to `sync_citation_list`"
+    return [check_citation(citation) for citation in citation_list]
+
+
+def sync_citation_list(av, citation_list):
+    """relates ArticleVersion `av` to the external citations in `citation_list` and to no others.
+    only those relationships that are new, changed or gone are written.
+    returns the list of ArticleVersionExtRelation objects."""
+    check_citation_list(citation_list)
+    wanted = {citation["uri"]: citation for citation in citation_list}
+    existing = {
+        avr.uri: avr
+        for avr in models.ArticleVersionExtRelation.objects.filter(articleversion=av)
+    }
+    gone = set(existing) - set(wanted)
+    if gone:
+        models.ArticleVersionExtRelation.objects.filter(
+            articleversion=av, uri__in=gone
+        ).delete()
+
+    create_list, update_list, avr_list = [], [], []
+    for uri, citation in wanted.items():
+        avr = existing.get(uri)
+        if avr is None:
+            avr = models.ArticleVersionExtRelation(
+                articleversion=av, uri=uri, citation=citation
+            )
+            create_list.append(avr)
+        elif avr.citation != citation:
+            avr.citation = citation
+            update_list.append(avr)
+        else:
+            avr_list.append(avr)
+            continue
+        # the article version exists and uniqueness is guaranteed by the diff above
+        avr.full_clean(exclude=["articleversion"], validate_unique=False)
+        avr_list.append(avr)
+
+    models.ArticleVersionExtRelation.objects.bulk_create(create_list)
+    models.ArticleVersionExtRelation.objects.bulk_update(update_list, ["citation"])
+    return avr_list
 
 
 # reviewed preprints relationships
 
 
-def relate_using_reviewed_preprint(av, rpp):
+def sync_reviewed_preprint_list(av, rpp_list):
+    """relates ArticleVersion `av` to the ReviewedPreprints in `rpp_list` and to no others.
+    only those relationships that are new or gone are written."""
     ensure(
         isinstance(av, models.ArticleVersion),
         "expected an ArticleVersion object, got: %r" % type(av),
     )
-    ensure(
-        isinstance(rpp, models.ReviewedPreprint),
-        "expected a ReviewedPreprint object, got: %r" % type(rpp),
+    for rpp in rpp_list:
+        ensure(
+            isinstance(rpp, models.ReviewedPreprint),
+            "expected a ReviewedPreprint object, got: %r" % type(rpp),
+        )
+    wanted = {rpp.id for rpp in rpp_list}
+    ensure(av.id and all(wanted), "both objects must be saved before being related")
+    existing = set(
+        models.ArticleVersionReviewedPreprintRelation.objects.filter(
+            articleversion=av
+        ).values_list("reviewedpreprint_id", flat=True)
     )
-    ensure(av.id and rpp.id, "both objects must be saved before being related")
-    data = {
-        "articleversion": av,
-        "reviewedpreprint": rpp,
-    }
-    rppr, _, _ = create_or_update(
-        models.ArticleVersionReviewedPreprintRelation,
-        data,
-        create=True,
-        update=True,
+    if existing - wanted:
+        models.ArticleVersionReviewedPreprintRelation.objects.filter(
+            articleversion=av, reviewedpreprint_id__in=existing - wanted
+        ).delete()
+    models.ArticleVersionReviewedPreprintRelation.objects.bulk_create(
+        [
+            models.ArticleVersionReviewedPreprintRelation(
+                articleversion=av, reviewedpreprint_id=rpp_id
+            )
+            for rpp_id in wanted - existing
+        ]
     )
-    return rppr
 
 
 #
@@ -125,9 +202,13 @@ def internal_relationships_for_article_version(av):
     # could I solve this with clever SQL/Django ORM tricks? almost certainly
     # do I have time to and is it important enough? absolutely not
 
-    fwd = models.ArticleVersionRelation.objects.filter(articleversion=av)
+    fwd = models.ArticleVersionRelation.objects.filter(
+        articleversion=av
+    ).select_related("related_to")
 
-    rev = models.ArticleVersionRelation.objects.filter(related_to=av.article)
+    rev = models.ArticleVersionRelation.objects.filter(
+        related_to=av.article_id
+    ).select_related("articleversion__article")
 
     lst = [r.related_to for r in fwd]
     lst.extend([r.articleversion.article for r in rev])
@@ -135,6 +216,25 @@ def internal_relationships_for_article_version(av):
     return sorted(set(lst), key=lambda artobj: artobj.manuscript_id)
 
 
+def internal_relationship_msids(av):
+    """returns a list of manuscript ids of Articles related backwards and forwards by the given article version.
+    Ordered by manuscript_id, asc.
+    Same as `internal_relationships_for_article_version` but in a single query and without any model objects.
+    """
+    fwd = (
+        models.ArticleVersionRelation.objects.filter(articleversion=av)
+        .annotate(msid=F("related_to__manuscript_id"))
+        .values_list("msid", flat=True)
+    )
+    rev = (
+        models.ArticleVersionRelation.objects.filter(related_to=av.article_id)
+        .annotate(msid=F("articleversion__article__manuscript_id"))
+        .values_list("msid", flat=True)
+    )
+    # UNION removes duplicates
+    return list(fwd.union(rev).order_by("msid"))
+
+
 def external_relationships_for_article_version(av):
     return models.ArticleVersionExtRelation.objects.filter(articleversion=av)
 
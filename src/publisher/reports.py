@@ -12,19 +12,19 @@ LOG = logging.getLogger(__name__)
 
 # used by backfill.sh to get a list of
 def article_version_list_as_csv():
+    # the location of the article xml is extracted from the XML2JSON fragment within the query.
+    # rows are written as the cursor yields them.
     q = (
-        models.ArticleVersion.objects.select_related("article")
-        .defer("article_json_v1", "article_json_v1_snippet")
+        models.ArticleVersion.objects.annotate(
+            location=fragment_logic.location_subquery()
+        )
         .order_by("article__manuscript_id", "version")
-        .all()
+        .values_list("article__manuscript_id", "version", "location")
     )
 
-    def mkrow(av):
-        msid = utils.pad_msid(av.article.manuscript_id)
-        version = av.version
-        # this is very expensive to do.
-        # the difference is between instant and minutes.
-        loc = fragment_logic.location(av)
+    def mkrow(row):
+        msid, version, loc = row
+        msid = utils.pad_msid(msid)
         if "," in loc:
             # bad data that may screw up consumers
             LOG.warn(
@@ -38,7 +38,7 @@ def article_version_list_as_csv():
     try:
         writer = csv.writer(sys.stdout, lineterminator="\n")
         sys.stdout.write(str(q.count()))
-        [writer.writerow(mkrow(row)) for row in q]
+        [writer.writerow(mkrow(row)) for row in q.iterator()]
         return True
     except KeyboardInterrupt:
         return False
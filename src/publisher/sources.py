@@ -0,0 +1,124 @@
+# readers for article data bundled into tar and zip archives and newline-delimited json (NDJSON) files.
+# members are streamed one at a time and never extracted to the filesystem.
+# each member is yielded as a pair of (name, content) where the name is the path to the archive
+# joined with the name of the member, so `utils.version_from_path` works as it would for an unpacked file.
+# large json arrays, like EJP exports, can also be read one item at a time with `json_array`.
+
+import os, json, tarfile, zipfile
+
+TAR_EXTS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ZIP_EXTS = (".zip",)
+NDJSON_EXTS = (".ndjson", ".jsonl")
+
+
+def is_archive(path):
+    "returns `True` if the given `path` looks like a tar, zip or NDJSON file"
+    return os.path.isfile(path) and path.lower().endswith(
+        TAR_EXTS + ZIP_EXTS + NDJSON_EXTS
+    )
+
+
+def is_ndjson(path):
+    return path.lower().endswith(NDJSON_EXTS)
+
+
+def tar_members(path, read=True):
+    # "r|*" reads the archive as a stream, one member at a time, with transparent decompression
+    with tarfile.open(path, "r|*") as tar:
+        for member in tar:
+            if member.isfile():
+                content = (
+                    tar.extractfile(member).read().decode("utf-8") if read else None
+                )
+                yield member.name, content
+
+
+def zip_members(path, read=True):
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if not info.is_dir():
+                yield info.filename, zf.read(info).decode("utf-8") if read else None
+
+
+def ndjson_members(path, read=True):
+    "each non-blank line of the file is a member, named by its line number"
+    with open(path, "r", encoding="utf-8") as fh:
+        for lineno, line in enumerate(fh, start=1):
+            if line.strip():
+                yield str(lineno), line if read else None
+
+
+def members(path, ext=".json", read=True):
+    """yields a pair of (name, content) for each member of the archive at `path`.
+    tar and zip members whose names don't end with `ext` are skipped.
+    when `read` is `False` the content of each member is `None` and only the names are listed.
+    """
+    path = os.path.abspath(path)
+    if is_ndjson(path):
+        member_list = ndjson_members(path, read)
+    else:
+        reader = zip_members if path.lower().endswith(ZIP_EXTS) else tar_members
+        member_list = (
+            (name, content)
+            for name, content in reader(path, read)
+            if name.endswith(ext)
+        )
+    for name, content in member_list:
+        yield os.path.join(path, name), content
+
+
+def member_names(path, ext=".json"):
+    "returns a list of the names of the members of the archive at `path` without keeping their content"
+    return [name for name, _ in members(path, ext, read=False)]
+
+
+def json_array(fh, object_pairs_hook=None, bufsize=1024 * 1024):
+    """yields each item of the json array in the open file `fh`, one at a time.
+    the file is read `bufsize` characters at a time and never held in memory in its entirety.
+    """
+    decoder = json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = fh.read(bufsize)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+        return not eof
+
+    def token():
+        "returns the next non-whitespace character, without consuming it"
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                raise json.JSONDecodeError("unexpected end of file", buf, pos)
+
+    if token() != "[":
+        raise json.JSONDecodeError("expecting a json array", buf, pos)
+    pos += 1
+    if token() == "]":
+        return
+    while True:
+        token()
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # the item is incomplete, read more of the file and try again
+            if fill():
+                continue
+            raise
+        if end == len(buf) and not eof and fill():
+            # the item may continue past the end of the buffer, for example a number
+            continue
+        pos = end
+        yield item
+        separator = token()
+        pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("expecting ',' delimiter", buf, pos - 1)
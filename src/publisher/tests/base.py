@@ -1,7 +1,8 @@
 from io import StringIO
 import os, json
 from django.test import TestCase as DjangoTestCase, TransactionTestCase
-from publisher import models, utils, ajson_ingestor, relation_logic
+from unittest.mock import Mock
+from publisher import models, utils, ajson_ingestor, relation_logic, aws_events
 from django.core.management import call_command as dj_call_command
 import unittest
 
@@ -73,6 +74,7 @@ class SimpleBaseCase(unittest.TestCase):
             )
             av.datetime_published = None
             av.save()
+        models.Article.objects.get(manuscript_id=msid).summarise()
 
     def call_command(self, *args, **kwargs):
         stdout = StringIO()
@@ -103,6 +105,43 @@ class TransactionBaseCase(SimpleBaseCase, TransactionTestCase):
 # ---
 
 
+class LocalTopic:
+    """a local stand-in for an SNS topic.
+    records published messages and fails the first `failures` attempts to publish each message in a batch.
+    """
+
+    arn = "arn:aws:sns:us-east-1:1234567890:bus-articles--test"
+
+    def __init__(self, failures=0, sender_fault=False):
+        self.failures = failures
+        self.sender_fault = sender_fault
+        self.attempts = {}
+        self.messages = []
+        self.batch_requests = []
+        self.meta = Mock(client=self)
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        assert TopicArn == self.arn
+        assert len(PublishBatchRequestEntries) <= aws_events.BATCH_SIZE
+        self.batch_requests.append(PublishBatchRequestEntries)
+        resp = {"Successful": [], "Failed": []}
+        for entry in PublishBatchRequestEntries:
+            msg = entry["Message"]
+            self.attempts[msg] = self.attempts.get(msg, 0) + 1
+            if self.attempts[msg] <= self.failures:
+                resp["Failed"].append(
+                    {
+                        "Id": entry["Id"],
+                        "Code": "InternalError",
+                        "SenderFault": self.sender_fault,
+                    }
+                )
+            else:
+                self.messages.append(msg)
+                resp["Successful"].append({"Id": entry["Id"]})
+        return resp
+
+
 def _relate_using_msids(matrix):
     """
     create_relationships = [
@@ -114,4 +153,4 @@ def _relate_using_msids(matrix):
     """
     for target, msid_list in matrix:
         av = models.Article.objects.get(manuscript_id=target).latest_version
-        relation_logic.relate_using_msid_list(av, msid_list)
+        relation_logic.sync_msid_list(av, msid_list)
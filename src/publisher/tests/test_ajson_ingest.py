@@ -10,6 +10,7 @@ from publisher.utils import lmap
 from unittest import skip
 from unittest.mock import patch
 from publisher import logic
+from django.db import connection
 from django.test import Client, override_settings
 from django.urls import reverse
 
@@ -48,6 +49,92 @@ class IngestIdentical(BaseCase):
             )
             self.assertFalse(mock.called)
 
+    def test_ingest_identical_detected_before_writes(self):
+        "ingesting identical article data is detected before any objects are created or updated"
+        ajson_ingestor.ingest(self.ajson)
+        with patch("publisher.ajson_ingestor._ingest_objects") as mock:
+            self.assertRaises(
+                fragment_logic.Identical, ajson_ingestor.ingest, self.ajson, force=True
+            )
+            self.assertFalse(mock.called)
+
+    def test_ingest_identical_published_not_forced(self):
+        "business rules are checked before identity, even when identical data is detected early"
+        ajson_ingestor.ingest_publish(self.ajson)
+        with self.assertRaises(StateError) as cm:
+            ajson_ingestor.ingest(self.ajson)
+        self.assertEqual(cm.exception.code, codes.ALREADY_PUBLISHED)
+
+    def test_ingest_identical_changed_hash(self):
+        "identical article data is not skipped early if the stored article-json hash has changed"
+        ajson_ingestor.ingest(self.ajson)
+        models.ArticleVersion.objects.all().update(article_json_hash=None)
+        with patch(
+            "publisher.ajson_ingestor._ingest_objects",
+            wraps=ajson_ingestor._ingest_objects,
+        ) as mock:
+            ajson_ingestor.ingest(self.ajson)
+            self.assertTrue(mock.called)
+
+    def test_ingest_identical_render_changed(self):
+        "identical article data is rendered again if the code or schemas that render article-json have changed"
+        ajson_ingestor.ingest(self.ajson)
+        pre_process = fragment_logic.pre_process
+
+        def new_pre_process(av, result):
+            result = pre_process(av, result)
+            result["title"] = "pants-party"
+            return result
+
+        with patch("publisher.fragment_logic.pre_process", new_pre_process):
+            # the render code changed but the stamp didn't, nothing is rendered
+            self.assertRaises(
+                fragment_logic.Identical, ajson_ingestor.ingest, self.ajson
+            )
+            # the render version was bumped with the change
+            self.addCleanup(fragment_logic.render_stamp.cache_clear)
+            fragment_logic.render_stamp.cache_clear()
+            with patch(
+                "publisher.fragment_logic.RENDER_VERSION",
+                fragment_logic.RENDER_VERSION + 1,
+            ):
+                av = ajson_ingestor.ingest(self.ajson)
+        self.assertEqual(self.freshen(av).article_json_v1["title"], "pants-party")
+
+    def test_ingest_identical_records_ingest_hash(self):
+        "identical article data that had to be rendered to be found identical is detected early next time"
+        av = ajson_ingestor.ingest(self.ajson)
+        models.ArticleVersion.objects.all().update(article_json_ingest_hash=None)
+        self.assertRaises(fragment_logic.Identical, ajson_ingestor.ingest, self.ajson)
+        self.assertEqual(
+            self.freshen(av).article_json_ingest_hash,
+            fragment_logic.hash_ingest(self.ajson["article"], av),
+        )
+        with patch("publisher.ajson_ingestor._ingest_objects") as mock:
+            self.assertRaises(
+                fragment_logic.Identical, ajson_ingestor.ingest, self.ajson
+            )
+            self.assertFalse(mock.called)
+
+    def test_ingest_publish_saves_once(self):
+        "the article version is saved once per INGEST+PUBLISH and PUBLISH request"
+        with patch(
+            "publisher.models.ArticleVersion.save",
+            autospec=True,
+            side_effect=models.ArticleVersion.save,
+        ) as mock:
+            av = ajson_ingestor.ingest_publish(self.ajson)
+            self.assertEqual(mock.call_count, 1)
+            mock.reset_mock()
+            ajson_ingestor.publish(self.msid, av.version, force=True)
+            self.assertEqual(mock.call_count, 1)
+
+    def test_ingest_publish_identical_unpublished(self):
+        "identical article data for an unpublished article version can still be published"
+        ajson_ingestor.ingest(self.ajson)
+        av = ajson_ingestor.ingest_publish(self.ajson)
+        self.assertTrue(self.freshen(av).published())
+
     def test_ingest_identical_except_pubdate(self):
         "an ingest or silent correction (forced ingest) with just the pubdate changed"
         ajson_ingestor.ingest(self.ajson)
@@ -385,6 +472,38 @@ class Ingest(BaseCase):
         self.assertEqual(models.ArticleVersion.objects.count(), 0)
         self.assertEqual(av.version, 1)  # all the data that would have been saved
 
+    def test_ingest_dry_run_writes_nothing(self):
+        "a dry run renders the article-json in memory and never attempts to write to the database"
+        with patch("publisher.models.ArticleVersion.save") as mock:
+            av = ajson_ingestor.ingest(self.ajson, dry_run=True)
+        self.assertFalse(mock.called)
+        self.assertEqual(models.Journal.objects.count(), 0)
+        self.assertEqual(models.ArticleFragment.objects.count(), 0)
+        # the article-json was rendered, validated and hashed
+        self.assertTrue(av.article_json_v1)
+        self.assertTrue(av.article_json_hash)
+        self.assertEqual(av.article_json_v1["stage"], "preview")
+
+    def test_ingest_dry_run_existing_article(self):
+        "a dry run of an ingest over an existing article version leaves the stored article untouched"
+        av = ajson_ingestor.ingest(self.ajson)
+        self.ajson["article"]["title"] = "pants-party"
+        unsaved_av = ajson_ingestor.ingest(self.ajson, dry_run=True)
+        self.assertEqual(unsaved_av.article_json_v1["title"], "pants-party")
+        av = self.freshen(av)
+        self.assertNotEqual(av.article_json_v1["title"], "pants-party")
+        fragment = fragment_logic.get(av, models.XML2JSON)
+        self.assertNotEqual(fragment.fragment["title"], "pants-party")
+
+    def test_ingest_dry_run_business_rules(self):
+        "a dry run enforces the same business rules as a regular ingest"
+        ajson_ingestor.ingest_publish(self.ajson)
+        try:
+            ajson_ingestor.ingest(self.ajson, dry_run=True)
+            self.fail("expected a StateError")
+        except StateError as err:
+            self.assertEqual(err.code, codes.ALREADY_PUBLISHED)
+
     # test ajson stored if valid
 
     def test_article_json_fails_on_bad_data(self):
@@ -403,6 +522,83 @@ class Ingest(BaseCase):
         self.assertNotEqual(av.article_json_v1, None)
         self.assertNotEqual(av.article_json_v1_snippet, None)
 
+    def test_article_json_stored_apart(self):
+        "the article-json is stored apart from the article version and only loaded when accessed"
+        av = ajson_ingestor.ingest(self.ajson)
+        self.assertEqual(1, models.ArticleVersionContent.objects.count())
+        av = self.freshen(av)
+        with self.assertNumQueries(1):
+            self.assertEqual(av.article_json_v1["id"], self.ajson["article"]["id"])
+        with self.assertNumQueries(0):
+            av.article_json_v1
+
+    def test_article_json_replaced(self):
+        "re-ingesting an article version replaces it's article-json"
+        av = ajson_ingestor.ingest(self.ajson)
+        self.ajson["article"]["title"] = "pants-party"
+        ajson_ingestor.ingest(self.ajson)
+        self.assertEqual(1, models.ArticleVersionContent.objects.count())
+        self.assertEqual(self.freshen(av).article_json_v1["title"], "pants-party")
+
+    def test_article_json_compressed(self):
+        "the article-json is stored compressed and can be read back as-is, without decoding it"
+        av = ajson_ingestor.ingest(self.ajson)
+        content = models.ArticleVersionContent.objects.get(pk=av.pk)
+        self.assertIsNone(content.article_json_v1)
+        self.assertEqual(content.article_json_v1_compressed, av.article_json_v1)
+        encoded = logic.article_json_bytes(self.freshen(av))
+        self.assertEqual(json.loads(encoded), av.article_json_v1)
+
+    def test_compress_article_json(self):
+        "article-json stored as text before compression can be read and is compressed by the `compress_article_json` command"
+        av = ajson_ingestor.ingest(self.ajson)
+        expected = av.article_json_v1
+        models.ArticleVersionContent.objects.filter(pk=av.pk).update(
+            article_json_v1=expected, article_json_v1_compressed=None
+        )
+        self.assertEqual(self.freshen(av).article_json_v1, expected)
+        self.assertEqual(
+            json.loads(logic.article_json_bytes(self.freshen(av))), expected
+        )
+
+        errcode, stdout = self.call_command("compress_article_json")
+        self.assertEqual(errcode, 0)
+        report = json.loads(stdout)
+        self.assertEqual(report["compressed"], 1)
+        self.assertLess(report["compressed-bytes"], report["text-bytes"])
+
+        content = models.ArticleVersionContent.objects.get(pk=av.pk)
+        self.assertIsNone(content.article_json_v1)
+        self.assertEqual(content.article_json_v1_compressed, expected)
+
+        # nothing left to compress
+        errcode, stdout = self.call_command("compress_article_json")
+        self.assertEqual(json.loads(stdout)["compressed"], 0)
+
+    def test_article_json_served_as_stored(self):
+        "the article-json is served as it is stored, compressed or not, in a single query and without decoding it"
+        av = ajson_ingestor.ingest(self.ajson)
+        expected = av.article_json_v1
+        av = self.freshen(av)
+        with patch("publisher.fields.codec.loads") as mock:
+            with self.assertNumQueries(1):
+                encoded = logic.article_json_bytes(av)
+            self.assertFalse(mock.called)
+        self.assertEqual(json.loads(encoded), expected)
+
+        # stored as text before compression, formatted differently to how lax would encode it
+        text = json.dumps(expected, indent=4)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE publisher_articleversioncontent SET article_json_v1 = %s, article_json_v1_compressed = NULL WHERE articleversion_id = %s",
+                [text, av.pk],
+            )
+        with self.assertNumQueries(1):
+            self.assertEqual(logic.article_json_bytes(av), text.encode("utf-8"))
+
+        models.ArticleVersionContent.objects.filter(pk=av.pk).delete()
+        self.assertEqual(logic.article_json_bytes(av), b"null")
+
     def test_article_json_not_stored_if_not_valid(self):
         """INGEST and PUBLISH events cause the fragments to be merged and stored, but
         only if valid.
@@ -458,6 +654,33 @@ class Publish(BaseCase):
         expected_pubdate = utils.ymd(utils.todt(self.ajson["article"]["published"]))
         self.assertEqual(expected_pubdate, utils.ymd(av.datetime_published))
 
+    def test_article_summary(self):
+        "the summary of an article's versions is updated as versions are ingested and published"
+
+        def summary():
+            art = models.Article.objects.get(manuscript_id=self.msid)
+            return {field: getattr(art, field) for field in models.SUMMARY_FIELDS}
+
+        ajson_ingestor.ingest(self.ajson)
+        expected = {
+            "datetime_published": None,
+            "version": 1,
+            "status": models.VOR,
+            "earliest_vor_version": 1,
+            "datetime_earliest_vor": None,
+        }
+        self.assertEqual(expected, summary())
+
+        av = ajson_ingestor.publish(self.msid, self.version)
+        expected["datetime_published"] = av.datetime_published
+        expected["datetime_earliest_vor"] = av.datetime_published
+        self.assertEqual(expected, summary())
+
+        self.ajson["article"]["version"] = 2
+        ajson_ingestor.ingest_publish(self.ajson)
+        expected["version"] = 2
+        self.assertEqual(expected, summary())
+
     def test_article_publish_v2(self):
         "an unpublished v2 article can be successfully published"
         av = ajson_ingestor.ingest(self.ajson)
@@ -627,6 +850,26 @@ class IngestPublish(BaseCase):
         self.assertEqual(av.version, 1)
         self.assertTrue(av.published())
 
+    def test_ingest_publish_renders_once(self):
+        "the article-json for an INGEST+PUBLISH request is merged, validated and saved just once"
+        with patch(
+            "publisher.fragment_logic.set_article_json",
+            wraps=fragment_logic.set_article_json,
+        ) as mock:
+            av = ajson_ingestor.ingest_publish(self.ajson)
+        self.assertEqual(mock.call_count, 1)
+
+        av = self.freshen(av)
+        self.assertTrue(av.published())
+        expected = utils.todt(self.ajson["article"]["published"])
+        self.assertEqual(av.datetime_published, expected)
+        # the stored article-json reflects the publication
+        self.assertEqual(av.article_json_v1["stage"], "published")
+
+        event_list = av.article.articleevent_set.values_list("event", flat=True)
+        self.assertTrue(models.DATETIME_ACTION_INGEST in event_list)
+        self.assertTrue(models.DATETIME_ACTION_PUBLISH in event_list)
+
     def test_ingest_publish_force(self):
         "we can do silent corrections/updates if we force it to"
         av = ajson_ingestor.ingest_publish(self.ajson)
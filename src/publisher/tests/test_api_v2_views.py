@@ -15,7 +15,7 @@ from publisher import (
 from django.test import Client, override_settings
 from django.urls import reverse
 from django.conf import settings
-from unittest.mock import patch, Mock
+from unittest.mock import patch
 
 SCHEMA_IDX = settings.SCHEMA_IDX  # weird, can't import directly from settings ??
 
@@ -165,7 +165,7 @@ def test_accept_types():
     msid = 16695
     ajson_fixture_v1 = join(base.FIXTURE_DIR, "ajson", "elife-16695-v1.xml.json")
     poa_fixture = json.load(open(ajson_fixture_v1, "r"))["article"]
-    mock = Mock(article_json_v1=poa_fixture, status="poa")
+    mock = models.ArticleVersion(article_json_v1=poa_fixture, status="poa")
 
     with patch("publisher.logic.most_recent_article_version", return_value=mock):
         for i, (client_accepts, expected_accepted) in enumerate(cases):
@@ -211,7 +211,7 @@ def test_unacceptable_types():
     msid = 16695
     ajson_fixture_v1 = join(base.FIXTURE_DIR, "ajson", "elife-16695-v1.xml.json")
     poa_fixture = json.load(open(ajson_fixture_v1, "r"))["article"]
-    mock = Mock(article_json_v1=poa_fixture, status="poa")
+    mock = models.ArticleVersion(article_json_v1=poa_fixture, status="poa")
 
     with patch("publisher.logic.most_recent_article_version", return_value=mock):
         for i, client_accepts in enumerate(cases):
@@ -232,7 +232,7 @@ def test_structured_abstract_not_downgraded_vor():
         base.FIXTURE_DIR, "structured-abstracts", "elife-31549-v1.xml.json"
     )
     fixture = json.load(open(fixture_path, "r"))["article"]
-    mock = Mock(article_json_v1=fixture, status="vor")
+    mock = models.ArticleVersion(article_json_v1=fixture, status="vor")
     vor_v3_ctype = "application/vnd.elife.article-vor+json; version=3"
 
     with patch("publisher.logic.most_recent_article_version", return_value=mock):
@@ -251,7 +251,7 @@ def test_structured_abstract_not_downgraded_poa():
     )
     fixture = json.load(open(fixture_path, "r"))["article"]
     fixture["status"] = "poa"
-    mock = Mock(article_json_v1=fixture, status="poa")
+    mock = models.ArticleVersion(article_json_v1=fixture, status="poa")
     poa_v2_ctype = "application/vnd.elife.article-poa+json; version=2"
 
     with patch("publisher.logic.most_recent_article_version", return_value=mock):
@@ -279,7 +279,7 @@ def test_deprecated_header_present():
     msid = 16695
     fixture_path = join(base.FIXTURE_DIR, "ajson", "elife-16695-v1.xml.json")
     fixture = json.load(open(fixture_path, "r"))["article"]
-    mock = Mock(article_json_v1=fixture, status="poa")
+    mock = models.ArticleVersion(article_json_v1=fixture, status="poa")
     previous_poa_type = settings.SCHEMA_VERSIONS["poa"][1]
     deprecated_ctype = (
         "application/vnd.elife.article-poa+json; version=%s" % previous_poa_type
@@ -1276,8 +1276,8 @@ class FragmentEvents(base.TransactionBaseCase):
     @override_settings(DEBUG=False)  # get past the early return in aws_events
     def test_add_fragment_sends_aws_event(self):
         "successfully adding a fragment sends an aws event"
-        mock = Mock()
-        with patch("publisher.aws_events.event_bus_conn", return_value=mock):
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
             url = reverse(
                 "v2:article-fragment",
                 kwargs={"msid": self.msid, "fragment_id": "test-frag"},
@@ -1291,7 +1291,7 @@ class FragmentEvents(base.TransactionBaseCase):
 
             # https://docs.djangoproject.com/en/1.10/topics/db/transactions/#use-in-tests
             expected_event = json.dumps({"type": "article", "id": self.msid})
-            mock.publish.assert_called_once_with(Message=expected_event)
+            self.assertEqual(topic.messages, [expected_event])
 
     @override_settings(DEBUG=False)  # get past the early return in aws_events
     def test_delete_fragment_sends_aws_event(self):
@@ -1302,8 +1302,8 @@ class FragmentEvents(base.TransactionBaseCase):
             self.av.article, self.key, fragment
         )  # add it to the *article* not the article *version*
 
-        mock = Mock()
-        with patch("publisher.aws_events.event_bus_conn", return_value=mock):
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
             url = reverse(
                 "v2:article-fragment",
                 kwargs={"msid": self.msid, "fragment_id": self.key},
@@ -1314,7 +1314,7 @@ class FragmentEvents(base.TransactionBaseCase):
 
             # https://docs.djangoproject.com/en/1.10/topics/db/transactions/#use-in-tests
             expected_event = json.dumps({"type": "article", "id": self.msid})
-            mock.publish.assert_called_once_with(Message=expected_event)
+            self.assertEqual(topic.messages, [expected_event])
 
 
 class RequestArgs(base.BaseCase):
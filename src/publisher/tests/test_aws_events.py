@@ -1,6 +1,8 @@
-import json
+import json, threading
 from unittest.mock import patch, Mock
-from publisher import ajson_ingestor, aws_events
+from botocore.exceptions import EndpointConnectionError
+from datetime import timedelta
+from publisher import ajson_ingestor, aws_events, models, utils
 from . import base
 from os.path import join
 from django.urls import reverse
@@ -102,27 +104,29 @@ class One(base.BaseCase):
         url = reverse("admin:publisher_article_change", args=(self.art.id,))
 
         expected_event = json.dumps({"type": "article", "id": self.msid})
-        mock = Mock()
-        with patch("publisher.aws_events.event_bus_conn", return_value=mock):
-            resp = self.ac.post(url, payload, follow=False)
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = self.ac.post(url, payload, follow=False)
             self.assertEqual(
                 resp.status_code, 302
             )  # temp redirect after successful submission
-            mock.publish.assert_called_once_with(Message=expected_event)
+            self.assertEqual(topic.messages, [expected_event])
 
     @override_settings(DEBUG=False)
     def test_admin_article_delete_sends_event(self):
         "an event is sent when an article is deleted from the article admin page"
         url = reverse("admin:publisher_article_delete", args=(self.art.id,))
-        mock = Mock()
+        topic = base.LocalTopic()
         expected_event = json.dumps({"type": "article", "id": self.msid})
-        with patch("publisher.aws_events.event_bus_conn", return_value=mock):
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
             payload = {"post": "yes"}  # skips confirmation
-            resp = self.ac.post(url, payload, follow=False)
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = self.ac.post(url, payload, follow=False)
             self.assertEqual(
                 resp.status_code, 302
             )  # temp redirect after successful submission
-            mock.publish.assert_called_once_with(Message=expected_event)
+            self.assertEqual(topic.messages, [expected_event])
 
     @override_settings(DEBUG=False)
     def test_admin_articleversion_delete_sends_event(self):
@@ -133,14 +137,15 @@ class One(base.BaseCase):
         payload["articleversion_set-0-DELETE"] = "on"  # 'click' the delete checkbox
 
         url = reverse("admin:publisher_article_change", args=(self.art.id,))
-        mock = Mock()
+        topic = base.LocalTopic()
         expected_event = json.dumps({"type": "article", "id": self.msid})
-        with patch("publisher.aws_events.event_bus_conn", return_value=mock):
-            resp = self.ac.post(url, payload, follow=False)
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = self.ac.post(url, payload, follow=False)
             self.assertEqual(
                 resp.status_code, 302
             )  # temp redirect after successful submission
-            mock.publish.assert_called_once_with(Message=expected_event)
+            self.assertEqual(topic.messages, [expected_event])
 
 
 class Two(base.TransactionBaseCase):
@@ -225,6 +230,19 @@ class DeferredEvents(base.BaseCase):
         for arg, expected in cases:
             self.assertEqual(expected, self.func(arg))
 
+    def test_defer_queue_created_lazily(self):
+        "the queue of deferred calls is created the first time calls are deferred, not when the function is wrapped"
+        with patch(
+            "publisher.aws_events.get_queue", wraps=aws_events.get_queue
+        ) as mock:
+            func = aws_events.defer(lambda arg: arg)
+            self.assertEqual("a", func("a"))
+            self.assertFalse(mock.called)
+            func(self.safeword)
+            func("b")
+            self.assertEqual(["b"], func(self.safeword))
+            self.assertEqual(1, mock.call_count)
+
     def test_defer_nothing(self):
         cases = [(self.safeword, None), (self.safeword, None)]
         for arg, expected in cases:
@@ -233,11 +251,30 @@ class DeferredEvents(base.BaseCase):
     @override_settings(DEBUG=False)
     def test_notify_not_deferred(self):
         cases = [1, 2, 3]
-        mock = Mock()
+        topic = base.LocalTopic()
         for msid in cases:
-            with patch("publisher.aws_events.event_bus_conn", return_value=mock):
+            with patch("publisher.aws_events.event_bus_conn", return_value=topic):
                 expected = json.dumps({"type": "article", "id": msid})
                 self.assertEqual(expected, aws_events.notify(msid))
+        # each message is sent as a batch of one
+        self.assertEqual(len(topic.batch_requests), 3)
+
+    @override_settings(DEBUG=False)
+    @patch("publisher.aws_events.time.sleep")
+    def test_notify_not_deferred_is_retried(self, _):
+        "a notification that isn't deferred is retried like a deferred one"
+        expected = json.dumps({"type": "article", "id": self.msid})
+        topic = base.LocalTopic(failures=aws_events.RETRY_ATTEMPTS - 1)
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(expected, aws_events.notify(self.msid))
+        self.assertEqual(len(topic.batch_requests), aws_events.RETRY_ATTEMPTS)
+        self.assertEqual(topic.messages, [expected])
+
+        # never sent
+        topic = base.LocalTopic(failures=aws_events.RETRY_ATTEMPTS)
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertIsNone(aws_events.notify(self.msid))
+        self.assertEqual(topic.messages, [])
 
     @override_settings(DEBUG=False)
     def test_notify_deferred(self):
@@ -251,8 +288,256 @@ class DeferredEvents(base.BaseCase):
             (self.msid, None),
             (self.safeword, [expected_event]),
         ]
-        mock = Mock()
-        with patch("publisher.aws_events.event_bus_conn", return_value=mock):
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
             for msid, expected in cases:
                 self.assertEqual(expected, aws_events.notify(msid))
-            mock.publish.assert_called_once_with(Message=expected_event)
+        # a single deferred message is sent as a batch of one
+        self.assertEqual(
+            topic.batch_requests, [[{"Id": "0", "Message": expected_event}]]
+        )
+        self.assertEqual(topic.messages, [expected_event])
+
+
+@override_settings(DEBUG=False)
+@patch("publisher.aws_events.time.sleep")
+class BatchedEvents(base.BaseCase):
+    def notify_deferred(self, topic, msid_list):
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            aws_events.notify(aws_events.SAFEWORD)
+            for msid in msid_list:
+                aws_events.notify(msid)
+            return aws_events.notify(aws_events.SAFEWORD)
+
+    def test_deferred_notifications_are_batched(self, _):
+        "deferred notifications are sent ten at a time"
+        topic = base.LocalTopic()
+        msid_list = list(range(1, 26)) + [1, 2, 3]
+        sent = self.notify_deferred(topic, msid_list)
+        expected = [
+            json.dumps({"type": "article", "id": msid}) for msid in range(1, 26)
+        ]
+        self.assertEqual(sent, expected)
+        self.assertEqual(topic.messages, expected)
+        self.assertEqual([len(b) for b in topic.batch_requests], [10, 10, 5])
+
+    def test_failed_notifications_are_retried(self, sleep_mock):
+        topic = base.LocalTopic(failures=2)
+        sent = self.notify_deferred(topic, [1, 2, 3])
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(len(topic.messages), 3)
+        self.assertEqual(len(topic.batch_requests), 3)
+        # with backoff
+        self.assertEqual(
+            [c[0][0] for c in sleep_mock.call_args_list],
+            [aws_events.RETRY_BACKOFF, aws_events.RETRY_BACKOFF * 2],
+        )
+
+    def test_failed_notifications_give_up(self, _):
+        "notifications are retried a limited number of times, messages that are malformed are not retried"
+        topic = base.LocalTopic(failures=99)
+        self.assertEqual(self.notify_deferred(topic, [1, 2, 3]), [])
+        self.assertEqual(len(topic.batch_requests), aws_events.RETRY_ATTEMPTS)
+
+        topic = base.LocalTopic(failures=99, sender_fault=True)
+        self.assertEqual(self.notify_deferred(topic, [1, 2, 3]), [])
+        self.assertEqual(len(topic.batch_requests), 1)
+
+    def test_connection_errors_are_retried(self, _):
+        topic = base.LocalTopic()
+        publish_batch = topic.publish_batch
+        errors = [EndpointConnectionError(endpoint_url=topic.arn)]
+
+        def flaky_publish_batch(**kwargs):
+            if errors:
+                raise errors.pop()
+            return publish_batch(**kwargs)
+
+        topic.publish_batch = flaky_publish_batch
+        self.assertEqual(len(self.notify_deferred(topic, [1, 2, 3])), 3)
+        self.assertEqual(len(topic.messages), 3)
+
+    def test_single_notification_is_retried(self, _):
+        "a single deferred notification is retried like a batch"
+        topic = base.LocalTopic(failures=1)
+        self.assertEqual(len(self.notify_deferred(topic, [1])), 1)
+        self.assertEqual(len(topic.batch_requests), 2)
+
+    def test_partial_failure_returns_sent(self, _):
+        "messages sent before an unhandled error are still returned as sent"
+        topic = base.LocalTopic()
+        publish_batch = topic.publish_batch
+        calls = []
+
+        def failing_publish_batch(**kwargs):
+            calls.append(kwargs)
+            if len(calls) > 1:
+                raise RuntimeError("unhandled")
+            return publish_batch(**kwargs)
+
+        topic.publish_batch = failing_publish_batch
+        sent = self.notify_deferred(topic, list(range(1, 16)))
+        expected = [
+            json.dumps({"type": "article", "id": msid}) for msid in range(1, 11)
+        ]
+        self.assertEqual(sent, expected)
+
+    def test_connection_is_reused(self, _):
+        "the connection to the event bus is created once per process and thread"
+        with patch("publisher.aws_events._CONN", threading.local()):
+            with patch("publisher.aws_events.boto3.resource") as resource_mock:
+                conn = aws_events.event_bus_conn()
+                self.assertIs(conn, aws_events.event_bus_conn())
+                self.assertEqual(resource_mock.call_count, 1)
+
+                # another thread
+                thread = threading.Thread(target=aws_events.event_bus_conn)
+                thread.start()
+                thread.join()
+                self.assertEqual(resource_mock.call_count, 2)
+                self.assertIs(conn, aws_events.event_bus_conn())
+
+                # a forked process
+                with patch("publisher.aws_events.os.getpid", return_value=-1):
+                    aws_events.event_bus_conn()
+                self.assertEqual(resource_mock.call_count, 3)
+
+
+@override_settings(DEBUG=False, EVENT_OUTBOX=True)
+@patch("publisher.aws_events.time.sleep")
+class Outbox(base.BaseCase):
+    def setUp(self):
+        self.f1 = join(self.fixture_dir, "ajson", "elife-10627-v1.xml.json")
+        self.ajson1 = self.load_ajson(self.f1, strip_relations=False)
+
+    def outbox(self):
+        return list(models.Notification.objects.values_list("manuscript_id", flat=True))
+
+    def test_notifications_written_to_outbox(self, _):
+        "notifications for an article and its related articles are written to the outbox and not sent"
+        mock = Mock()
+        with patch("publisher.aws_events.event_bus_conn", return_value=mock):
+            ajson_ingestor.ingest(self.ajson1)  # has 2 related, 9560 and 9561
+        self.assertFalse(mock.mock_calls)
+        self.assertEqual(self.outbox(), [10627, 9560, 9561])
+        self.assertEqual(aws_events.outbox_depth(), 3)
+
+    def test_dry_run_writes_nothing_to_outbox(self, _):
+        ajson_ingestor.ingest(self.ajson1, dry_run=True)
+        self.assertEqual(self.outbox(), [])
+
+    def test_dispatch(self, _):
+        "each article in the outbox is notified once, in batches, and removed from the outbox"
+        for msid in [1, 2, 3, 1, 2, 3]:
+            aws_events.enqueue(msid)
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(), ([1, 2, 3], [], 3))
+            self.assertEqual(aws_events.dispatch(), ([], [], 0))
+        self.assertEqual(
+            topic.messages,
+            [json.dumps({"type": "article", "id": msid}) for msid in [1, 2, 3]],
+        )
+        self.assertEqual(len(topic.batch_requests), 1)
+        self.assertEqual(self.outbox(), [])
+
+    def test_dispatch_batch_size(self, _):
+        for msid in [1, 2, 3]:
+            aws_events.enqueue(msid)
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(batch_size=2), ([1, 2], [], 0))
+            self.assertEqual(self.outbox(), [3])
+
+    def test_failed_dispatch_is_retried(self, _):
+        "notifications that fail to send are kept in the outbox, up to a limit"
+        aws_events.enqueue(1)
+        aws_events.enqueue(2)
+        topic = base.LocalTopic(failures=99)
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(), ([], [1, 2], 0))
+        self.assertEqual(self.outbox(), [1, 2])
+        self.assertEqual(
+            list(models.Notification.objects.values_list("attempts", flat=True)),
+            [1, 1],
+        )
+
+        models.Notification.objects.update(attempts=aws_events.MAX_ATTEMPTS)
+        self.assertEqual(aws_events.outbox_depth(), 0)
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(), ([], [], 0))
+
+    def test_dispatch_claims_notifications(self, _):
+        "notifications are claimed before they are sent and skipped by other dispatchers until released"
+        aws_events.enqueue(1)
+        aws_events.enqueue(1)
+        topic = base.LocalTopic()
+        during_send = []
+
+        def publish_batch(*args, **kwargs):
+            # the claim is visible and another dispatcher finds nothing to send
+            during_send.append(
+                (
+                    models.Notification.objects.filter(datetime_claimed=None).count(),
+                    aws_events.dispatch(),
+                )
+            )
+            return base.LocalTopic.publish_batch(topic, *args, **kwargs)
+
+        topic.meta.client.publish_batch = publish_batch
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(), ([1], [], 1))
+        self.assertEqual(during_send, [(0, ([], [], 0))])
+        self.assertEqual(self.outbox(), [])
+
+    def test_unsent_notifications_are_released(self, _):
+        "notifications that fail to send are released, and claims that are never released expire"
+        aws_events.enqueue(1)
+        topic = base.LocalTopic(failures=99)
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(), ([], [1], 0))
+        self.assertIsNone(models.Notification.objects.get().datetime_claimed)
+
+        # a dispatcher claimed the notification and died
+        claimed = utils.utcnow() - timedelta(seconds=aws_events.CLAIM_TIMEOUT - 60)
+        models.Notification.objects.update(datetime_claimed=claimed)
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(), ([], [], 0))
+            models.Notification.objects.update(
+                datetime_claimed=claimed - timedelta(seconds=120)
+            )
+            self.assertEqual(aws_events.dispatch(), ([1], [], 0))
+        self.assertEqual(self.outbox(), [])
+
+    def test_dispatch_window(self, _):
+        "notifications are held for the window and repeated notifications within it are sent once"
+        aws_events.enqueue(1)
+        aws_events.enqueue(2)
+        aws_events.enqueue(1)
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            self.assertEqual(aws_events.dispatch(window=60), ([], [], 0))
+            self.assertEqual(self.outbox(), [1, 2, 1])
+
+            # the first notification for article 1 is old enough to send, the second is coalesced with it
+            an_hour_ago = utils.utcnow() - timedelta(hours=1)
+            models.Notification.objects.filter(
+                id=models.Notification.objects.first().id
+            ).update(datetime_queued=an_hour_ago)
+            self.assertEqual(aws_events.dispatch(window=60), ([1], [], 1))
+            self.assertEqual(self.outbox(), [2])
+        self.assertEqual(topic.messages, [json.dumps({"type": "article", "id": 1})])
+
+    def test_dispatch_events_command(self, _):
+        for msid in [1, 2, 3]:
+            aws_events.enqueue(msid)
+        code, stdout = self.call_command("dispatch_events", depth=True)
+        self.assertEqual((code, stdout.strip()), (0, "3"))
+
+        topic = base.LocalTopic()
+        with patch("publisher.aws_events.event_bus_conn", return_value=topic):
+            code, _ = self.call_command("dispatch_events", once=True, batch_size=2)
+        self.assertEqual(code, 0)
+        self.assertEqual(len(topic.messages), 3)
+        self.assertEqual(self.outbox(), [])
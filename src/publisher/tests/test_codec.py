@@ -0,0 +1,62 @@
+import json, hashlib
+from collections import OrderedDict
+from datetime import date, datetime
+from unittest.mock import patch
+import pytz
+from . import base
+from publisher import codec, fragment_logic
+
+
+class Codec(base.BaseCase):
+    def setUp(self):
+        self.struct = {
+            "foo": "bär",
+            "bar": [1, 2.5, None, True],
+            "baz": {"dt": datetime(2001, 1, 1, 23, 59, 59, 123, tzinfo=pytz.utc)},
+            "date": date(2001, 1, 1),
+        }
+        self.expected = {
+            "foo": "bär",
+            "bar": [1, 2.5, None, True],
+            "baz": {"dt": "2001-01-01T23:59:59Z"},
+            "date": "2001-01-01",
+        }
+
+    def test_roundtrip(self):
+        "datetimes and dates are encoded and maps are decoded as plain dicts"
+        for backend in [codec.orjson, None]:
+            with patch("publisher.codec.orjson", backend):
+                result = codec.loads(codec.dumps(self.struct))
+                self.assertEqual(result, self.expected)
+                self.assertEqual(type(result), dict)
+                self.assertEqual(codec.loads(codec.dumpb(self.struct)), self.expected)
+                self.assertEqual(codec.copy(self.struct), self.expected)
+
+    def test_indent(self):
+        for indent in [None, 2, 4]:
+            self.assertEqual(
+                codec.loads(codec.dumps(self.struct, indent=indent)), self.expected
+            )
+
+    def test_utf8(self):
+        "non-ASCII characters are encoded as raw UTF-8 whatever the backend, but not when hashing"
+        for backend in [codec.orjson, None]:
+            with patch("publisher.codec.orjson", backend):
+                for indent in [None, 2, 4]:
+                    self.assertIn("bär", codec.dumps(self.struct, indent=indent))
+                    self.assertIn(
+                        "bär".encode("utf-8"), codec.dumpb(self.struct, indent=indent)
+                    )
+        self.assertIn("b\\u00e4r", codec.dumps_stdlib(self.struct))
+
+    def test_unserializable(self):
+        self.assertRaises(TypeError, codec.dumps, {"foo": object()})
+
+    def test_hash_is_stable(self):
+        "article-json is hashed the same way whatever the backend and however it was decoded"
+        data = OrderedDict([("title", "bär"), ("published", self.struct["date"])])
+        expected = hashlib.md5(
+            json.dumps({"title": "bär", "published": "2001-01-01"}).encode("utf-8")
+        ).hexdigest()
+        self.assertEqual(fragment_logic.hash_ajson(data), expected)
+        self.assertEqual(fragment_logic.hash_ajson(codec.copy(data)), expected)
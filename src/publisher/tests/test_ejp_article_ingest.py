@@ -1,6 +1,8 @@
 from . import base
 from os.path import join
-from publisher import logic, models, ejp_ingestor, utils
+import io, json, shutil, tarfile, tempfile
+from collections import Counter
+from publisher import logic, models, ejp_ingestor, utils, sources
 from dateutil import parser
 
 
@@ -151,3 +153,141 @@ class EJPIngest(base.BaseCase):
         updated_article = models.Article.objects.get(manuscript_id=11835)
         self.assertEqual("RA", updated_article.ejp_type)
         self.assertTrue(updated_article.initial_decision)
+
+
+class EJPStreamingIngest(base.BaseCase):
+    def setUp(self):
+        self.journal = logic.journal()
+        self.partial_json_path = join(
+            self.fixture_dir, "partial-ejp-to-lax-report.json"
+        )
+        self.tiny_json_path = join(self.fixture_dir, "tiny-ejp-to-lax-report.json")
+
+    def test_json_array(self):
+        "a json array can be read one item at a time"
+        with open(self.tiny_json_path, "r") as fh:
+            expected = json.load(fh)
+        with open(self.tiny_json_path, "r") as fh:
+            self.assertEqual(list(sources.json_array(fh, bufsize=64)), expected)
+        self.assertEqual(list(sources.json_array(io.StringIO(" [ ] "))), [])
+        with self.assertRaises(ValueError):
+            list(sources.json_array(io.StringIO('{"manuscript_id": 1}')))
+
+    def test_stream_ingest(self):
+        "the streaming import gives the same results as the regular import"
+        num = ejp_ingestor.stream_article_list_from_json_path(
+            self.journal, self.partial_json_path, chunk_size=100
+        )
+        self.assertEqual(num, 748)
+        self.assertEqual(models.Article.objects.count(), 748)
+        ae_count = models.ArticleEvent.objects.count()
+        self.assertTrue(ae_count)
+
+        # importing again over the same data with update changes nothing
+        ejp_ingestor.stream_article_list_from_json_path(
+            self.journal, self.partial_json_path, update=True, chunk_size=100
+        )
+        self.assertEqual(models.Article.objects.count(), 748)
+        self.assertEqual(models.ArticleEvent.objects.count(), ae_count)
+
+    def test_import_archive(self):
+        "the members of an archive are listed without their content and read one at a time when imported"
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        archive = join(tempdir, "ejp.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:
+            tar.add(self.tiny_json_path, arcname="ejp/tiny.json")
+        self.assertEqual(
+            list(sources.members(archive, read=False)),
+            [(join(archive, "ejp/tiny.json"), None)],
+        )
+        self.assertEqual(
+            sources.member_names(archive), [join(archive, "ejp/tiny.json")]
+        )
+
+        args = ["import", archive, "--import-type", "ejp", "--just-do-it"]
+        errcode, _ = self.call_command(*args)
+        self.assertEqual(errcode, 0)
+        self.assertEqual(models.Article.objects.count(), 6)
+
+    def test_msid_chunks(self):
+        "articles are grouped in the order they are read and every article with the same msid is in the same group"
+        article_list = [
+            {"manuscript_id": msid, "n": n}
+            for n, msid in enumerate([5, 1, 9, 5, 3, 7, 1, 12, 9])
+        ]
+        msid_counts = Counter(ad["manuscript_id"] for ad in article_list)
+        chunk_list = list(
+            ejp_ingestor.msid_chunks(iter(article_list), msid_counts, chunk_size=2)
+        )
+        # 5 and 1 are held back until they appear again, 9 is held back until the end
+        expected = [[5, 5], [3, 7], [1, 1], [12, 9, 9]]
+        self.assertEqual(
+            expected, [[ad["manuscript_id"] for ad in chunk] for chunk in chunk_list]
+        )
+        # later data for the same msid still comes later
+        self.assertEqual([0, 3], [ad["n"] for ad in chunk_list[0]])
+        self.assertEqual(
+            list(range(9)), sorted(ad["n"] for chunk in chunk_list for ad in chunk)
+        )
+
+    def test_stream_ingest_updates_all_fields(self):
+        "articles updated together are updated with every field given for any of them"
+        ejp_ingestor.stream_article_list_from_json_path(
+            self.journal, self.tiny_json_path
+        )
+        with open(self.tiny_json_path, "r") as fh:
+            article_data_list = json.load(
+                fh, object_pairs_hook=ejp_ingestor.load_with_datetime
+            )[:2]
+        del article_data_list[0]["ejp_type"]
+        article_data_list[1]["ejp_type"] = "TR"
+        ejp_ingestor.import_article_chunk(
+            self.journal, article_data_list, create=False, update=True
+        )
+        self.assertEqual(models.Article.objects.get(manuscript_id=11376).ejp_type, "RA")
+        self.assertEqual(models.Article.objects.get(manuscript_id=11377).ejp_type, "TR")
+
+    def test_stream_ingest_data(self):
+        ejp_ingestor.stream_article_list_from_json_path(
+            self.journal, self.tiny_json_path, chunk_size=4
+        )
+        self.assertEqual(models.Article.objects.count(), 6)
+        art = models.Article.objects.get(manuscript_id=11835)
+        self.assertEqual(art.ejp_type, "RA")
+        self.assertEqual(art.doi, utils.msid2doi(11835))
+        self.assertEqual(art.date_rev2_decision, parse("2016-03-14T00:00:00"))
+        self.assertEqual(art.rev2_decision, "AF")
+        self.assertEqual(
+            models.ArticleEvent.objects.filter(article=art).count(),
+            8,  # 4 qc dates and 4 decision dates
+        )
+
+    def test_stream_ingest_over_existing_data(self):
+        "existing articles are only updated if `update` is explicitly set to `True`"
+        art = {
+            "journal": self.journal,
+            "manuscript_id": 11835,
+            "doi": "10.7554/eLife.11835",
+            "ejp_type": "FOO",
+        }
+        utils.create_or_update(models.Article, art, ["manuscript_id", "journal"])
+
+        ejp_ingestor.stream_article_list_from_json_path(
+            self.journal, self.tiny_json_path
+        )
+        self.assertEqual(6, models.Article.objects.count())
+        self.assertEqual(
+            "FOO", models.Article.objects.get(manuscript_id=11835).ejp_type
+        )
+
+        ejp_ingestor.stream_article_list_from_json_path(
+            self.journal, self.tiny_json_path, update=True
+        )
+        self.assertEqual("RA", models.Article.objects.get(manuscript_id=11835).ejp_type)
+
+    def test_stream_ingest_with_nocreate(self):
+        ejp_ingestor.stream_article_list_from_json_path(
+            self.journal, self.tiny_json_path, create=False, update=True
+        )
+        self.assertEqual(models.Article.objects.count(), 0)
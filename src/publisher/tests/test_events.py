@@ -1,6 +1,6 @@
 from . import base
 from os.path import join
-from publisher import models, ajson_ingestor
+from publisher import models, ajson_ingestor, events
 from unittest.mock import patch
 from datetime import datetime
 import pytz
@@ -92,6 +92,45 @@ class One(base.BaseCase):
         preprint = models.ArticleEvent.objects.get(event="date-preprint")
         self.assertEqual(preprint.uri, new_uri)
 
+    def test_add_many_unchanged_events(self):
+        "events that haven't changed are neither inserted nor updated"
+        ajson_ingestor.ingest(self.with_history)
+        art = models.Article.objects.get(manuscript_id=20105)
+        ae_structs = [
+            {
+                "event": ae.event,
+                "datetime_event": ae.datetime_event,
+                "value": ae.value,
+                "uri": ae.uri,
+            }
+            for ae in models.ArticleEvent.objects.filter(article=art)
+        ]
+        ae_id_list = list(
+            models.ArticleEvent.objects.order_by("id").values_list("id", flat=True)
+        )
+        # a single select
+        with self.assertNumQueries(1):
+            events.add_many(art, ae_structs)
+
+        ae_structs[0]["value"] = "pants"
+        ae_structs.append(
+            {"event": models.DATE_XML_RECEIVED, "datetime_event": "2001-01-01"}
+        )
+        # select, insert, update
+        with self.assertNumQueries(3):
+            events.add_many(art, ae_structs)
+        self.assertEqual(
+            ae_id_list,
+            list(
+                models.ArticleEvent.objects.exclude(datetime_event__year=2001)
+                .order_by("id")
+                .values_list("id", flat=True)
+            ),
+        )
+        self.assertEqual(
+            models.ArticleEvent.objects.get(id=ae_id_list[0]).value, "pants"
+        )
+
     def test_ingest_events_poa_doesnt_wipe_vor_events(self):
         "missing event data in later ingests doesn't wipe out earlier events"
         # ingest article with preprint event
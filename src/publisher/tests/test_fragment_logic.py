@@ -1,9 +1,17 @@
 from os.path import join
-import json
+import importlib, json
 from . import base
 from unittest.mock import patch
-from publisher import fragment_logic as logic, ajson_ingestor, models
+from publisher import (
+    fragment_logic as logic,
+    ajson_ingestor,
+    models,
+    codes,
+    aws_events,
+    utils,
+)
 from publisher.utils import StateError
+from publisher.management.commands import rerender
 from datetime import datetime
 from django.test import override_settings
 import pytest
@@ -80,6 +88,213 @@ class FragmentLogic(base.BaseCase):
         logic.rm(self.msid, "foo")
         self.assertEqual(models.ArticleFragment.objects.count(), 1)
 
+    def test_location_subquery(self):
+        "the location of the article xml is extracted from the fragment within the database"
+
+        def location():
+            q = models.ArticleVersion.objects.annotate(
+                location=logic.location_subquery()
+            ).values_list("location", flat=True)
+            with self.assertNumQueries(1):
+                return q.get(pk=self.av.pk)
+
+        expected = self.ajson["article"]["-meta"]["location"]
+        self.assertEqual(expected, location())
+        self.assertEqual(logic.location(self.av), location())
+
+        logic.add(self.av, "xml->json", {"title": "foo"}, pos=0, update=True)
+        self.assertEqual("no-location-stored", location())
+        self.assertEqual(logic.location(self.av), location())
+
+        logic.rm(self.msid, "xml->json")
+        self.assertEqual("no-article-fragment", location())
+        self.assertEqual(logic.location(self.av), location())
+
+
+class Rehash(base.BaseCase):
+    def setUp(self):
+        for fname in ["elife-01968-v1.xml.json", "elife-16695-v1.xml.json"]:
+            ajson_ingestor.ingest_publish(
+                self.load_ajson(join(self.fixture_dir, "ajson", fname))
+            )
+
+    def test_hash_ajson_text(self):
+        "hashing the stored article-json text gives the same hash as hashing the article-json"
+        av = models.ArticleVersion.objects.first()
+        self.assertEqual(
+            logic.hash_ajson(av.article_json_v1),
+            logic.hash_ajson_text(json.dumps(av.article_json_v1)),
+        )
+        self.assertEqual(logic.hash_ajson(None), logic.hash_ajson_text(None))
+
+    def test_rehash_unchanged(self):
+        "stored article-json hashes the same as the article-json rendered during ingest"
+        errcode, stdout = self.call_command("rehash", jobs=1)
+        self.assertEqual(errcode, 0)
+        self.assertEqual(stdout.strip(), "0 of 2 hashes changed")
+        for av in models.ArticleVersion.objects.all():
+            _, _, newhash = logic.render(av)
+            self.assertEqual(newhash, av.article_json_hash)
+
+    def test_rehash(self):
+        "only article versions whose hash has changed are updated"
+        av1, av2 = models.ArticleVersion.objects.order_by("id")
+        expected = av1.article_json_hash
+        models.ArticleVersion.objects.filter(id=av1.id).update(article_json_hash=None)
+
+        errcode, stdout = self.call_command("rehash", jobs=1, chunk_size=1)
+        self.assertEqual(errcode, 0)
+        self.assertEqual(stdout.strip(), "1 of 2 hashes changed")
+
+        new_av1, new_av2 = models.ArticleVersion.objects.order_by("id")
+        self.assertEqual(expected, new_av1.article_json_hash)
+        self.assertEqual(av2.article_json_hash, new_av2.article_json_hash)
+        # only the hash is written
+        self.assertEqual(av1.datetime_record_updated, new_av1.datetime_record_updated)
+
+    def test_upgrade_rehash(self):
+        "hashes stored with the '-published' value are recalculated by a migration and nothing is re-ingested"
+        migration = importlib.import_module(
+            "publisher.migrations.0012_rehash_article_json"
+        )
+        for av in models.ArticleVersion.objects.all():
+            # the hash as it was calculated before it was the hash of the stored article-json
+            stale = dict(av.article_json_v1, **{"-published": "2016-01-01T00:00:00Z"})
+            models.ArticleVersion.objects.filter(id=av.id).update(
+                article_json_hash=logic.hash_ajson(stale), article_json_ingest_hash=None
+            )
+        data = self.load_ajson(
+            join(self.fixture_dir, "ajson", "elife-01968-v1.xml.json")
+        )
+        # not identical, the article would be saved and notified again
+        ajson_ingestor.ingest(data, force=True, dry_run=True)
+
+        num_changed = migration.rehash(
+            models.ArticleVersion, models.ArticleVersionContent
+        )
+        self.assertEqual(num_changed, 2)
+        for av in models.ArticleVersion.objects.all():
+            self.assertEqual(
+                av.article_json_hash, logic.hash_article_json(av.article_json_v1)
+            )
+        with patch("publisher.aws_events.notify") as notify_mock:
+            self.assertRaises(logic.Identical, ajson_ingestor.ingest, data, force=True)
+        self.assertFalse(notify_mock.called)
+        self.assertEqual(
+            migration.rehash(models.ArticleVersion, models.ArticleVersionContent), 0
+        )
+
+    def test_rehash_uncompressed(self):
+        "article-json not yet compressed is hashed the same as compressed article-json"
+        av1, av2 = models.ArticleVersion.objects.order_by("id")
+        models.ArticleVersionContent.objects.filter(pk=av1.pk).update(
+            article_json_v1=av1.article_json_v1, article_json_v1_compressed=None
+        )
+        errcode, stdout = self.call_command("rehash", jobs=1)
+        self.assertEqual(errcode, 0)
+        self.assertEqual(stdout.strip(), "0 of 2 hashes changed")
+
+
+class Rerender(base.BaseCase):
+    def setUp(self):
+        for fname in ["elife-01968-v1.xml.json", "elife-16695-v1.xml.json"]:
+            ajson_ingestor.ingest_publish(
+                self.load_ajson(join(self.fixture_dir, "ajson", fname))
+            )
+
+    def rerender(self, *args):
+        with patch("publisher.aws_events.notify") as notify_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                errcode, stdout = self.call_command("rerender", *args)
+        msid_list = [
+            c[0][0]
+            for c in notify_mock.call_args_list
+            if c[0][0] != aws_events.SAFEWORD
+        ]
+        return errcode, json.loads(stdout), msid_list
+
+    def test_render(self):
+        "rendering an article version gives the values `set_article_json` saved"
+        av = models.ArticleVersion.objects.get(article__manuscript_id=1968)
+        result, snippet, newhash = logic.render(av)
+        self.assertEqual(result, av.article_json_v1)
+        self.assertEqual(snippet, av.article_json_v1_snippet)
+        self.assertEqual(newhash, av.article_json_hash)
+
+    def test_rerender_unchanged(self):
+        "article versions whose result hasn't changed are not written and no notifications are sent"
+        errcode, report, notified = self.rerender()
+        self.assertEqual(errcode, 0)
+        expected = {
+            "total": 2,
+            "changed": 0,
+            "unchanged": 2,
+            "failed": 0,
+            "failures": [],
+        }
+        self.assertEqual(expected, report)
+        self.assertEqual([], notified)
+
+    def test_rerender_changed(self):
+        "article versions whose fragments have changed are written and notifications sent"
+        art = models.Article.objects.get(manuscript_id=1968)
+        models.ArticleFragment.objects.create(
+            article=art, type="foo", fragment={"title": "pants. party"}
+        )
+        errcode, report, notified = self.rerender("--chunk-size", "1")
+        self.assertEqual(errcode, 0)
+        self.assertEqual((report["changed"], report["unchanged"]), (1, 1))
+        self.assertEqual([1968], notified)
+        av = art.latest_version
+        self.assertEqual("pants. party", av.article_json_v1["title"])
+        self.assertEqual("pants. party", av.article_json_v1_snippet["title"])
+
+    def test_rerender_subset_dry_run(self):
+        art = models.Article.objects.get(manuscript_id=1968)
+        models.ArticleFragment.objects.create(
+            article=art, type="foo", fragment={"title": "pants. party"}
+        )
+        errcode, report, notified = self.rerender("--msid", "1968", "--dry-run")
+        self.assertEqual(errcode, 0)
+        self.assertEqual((report["total"], report["changed"]), (1, 1))
+        self.assertEqual([], notified)
+        self.assertNotEqual("pants. party", art.latest_version.article_json_v1["title"])
+
+    def test_rerender_failures_reported(self):
+        models.ArticleFragment.objects.filter(article__manuscript_id=1968).delete()
+        errcode, report, notified = self.rerender()
+        self.assertEqual(errcode, 1)
+        self.assertEqual((report["failed"], report["unchanged"]), (1, 1))
+        failure = report["failures"][0]
+        self.assertEqual(
+            (1968, 1, codes.NO_RECORD),
+            (failure["msid"], failure["version"], failure["code"]),
+        )
+
+    @override_settings(EVENT_OUTBOX=True)
+    def test_rerender_outbox(self):
+        "notifications are written to the outbox in the same transaction as the article-json"
+        art = models.Article.objects.get(manuscript_id=1968)
+        models.ArticleFragment.objects.create(
+            article=art, type="foo", fragment={"title": "pants. party"}
+        )
+        id_list = list(
+            models.ArticleVersion.objects.order_by("id").values_list("id", flat=True)
+        )
+        with patch(
+            "publisher.models.ArticleVersionContent.objects.bulk_create",
+            side_effect=RuntimeError("boom"),
+        ):
+            with self.assertRaises(RuntimeError):
+                rerender.render_chunk(id_list)
+        self.assertFalse(models.Notification.objects.exists())
+
+        rerender.render_chunk(id_list)
+        self.assertEqual(
+            [1968],
+            list(models.Notification.objects.values_list("manuscript_id", flat=True)),
+        )
+
 
 class FragmentMerge(base.BaseCase):
     def setUp(self):
@@ -194,6 +409,27 @@ class FragmentMerge(base.BaseCase):
         expected = "2016-08-17T00:00:00Z"
         self.assertEqual(expected, av2.article_json_v1["statusDate"])
 
+    def test_merge_sets_status_date_correctly_vor_v3(self):
+        "statusDate for a v3 vor is the publication date of the earliest vor, read from the article"
+        for version in [2, 3]:
+            fixture = join(
+                self.fixture_dir, "ajson", "elife-16695-v%s.xml.json" % version
+            )
+            ajson_ingestor.ingest_publish(json.load(open(fixture, "r")))
+        av2 = models.ArticleVersion.objects.get(article=self.av.article, version=2)
+        av3 = models.ArticleVersion.objects.select_related("article").get(
+            article=self.av.article, version=3
+        )
+        self.assertEqual(2, av3.article.earliest_vor_version)
+        self.assertEqual(
+            utils.ymdhms(av2.datetime_published), av3.article_json_v1["statusDate"]
+        )
+
+        result = {"published": None}
+        with self.assertNumQueries(0):
+            result = logic.pre_process(av3, result)
+        self.assertEqual(av2.datetime_published, result["statusDate"])
+
     def test_merge_ignores_unpublished_vor_when_setting_status_date(self):
         "the first unpublished VOR doesn't get a value until it's published"
         fixture = join(self.fixture_dir, "ajson", "elife-16695-v2.xml.json")
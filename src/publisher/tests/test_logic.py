@@ -377,8 +377,8 @@ class RelationshipLogic(base.BaseCase):
             "authorLine": "- R Straussman\n- T Morikawa\n- K Shee\n- M Barzily-Rokni\n- ZR Qian\n- J Du\n- A Davis\n- MM Mongare\n- J Gould\n- DT Frederick\n- ZA Cooper\n- PB Chapman\n- DB Solit\n- A Ribas\n- RS Lo\n- KT Flaherty\n- S Ogino\n- JA Wargo\n- TR Golub",
             "uri": "https://doi.org/10.1038/nature11183",
         }
-        relation_logic.relate_using_citation_list(av1, [external_relation])
-        relation_logic.relate_using_citation_list(av2, [external_relation])
+        relation_logic.sync_citation_list(av1, [external_relation])
+        relation_logic.sync_citation_list(av2, [external_relation])
 
         # forwards
         expected = [external_relation, logic.article_snippet_json(av2)]
@@ -1,7 +1,11 @@
 import re
 from explorer import models
+from unittest.mock import patch
 from django.core.management import call_command
-from .base import BaseCase
+from django.test import override_settings
+from publisher.management.commands import query_export
+from publisher.models import Journal
+from .base import BaseCase, TransactionBaseCase
 from io import StringIO
 
 
@@ -41,3 +45,85 @@ class CLI(BaseCase):
         models.Query.objects.all().delete()
         errcode, stdout = self.call_command(*args)
         self.assertEqual(errcode, 0)
+
+
+class LocalS3:
+    "a local stand-in for an S3 client. records uploaded objects by key"
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.parts = {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = "upload-%s" % len(self.uploads)
+        self.uploads[upload_id] = []
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body):
+        self.uploads[UploadId].append(Body)
+        return {"ETag": "etag-%s" % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        assert len(MultipartUpload["Parts"]) == len(self.uploads[UploadId])
+        self.parts[Key] = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(self.parts[Key])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        del self.uploads[UploadId]
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource["Key"]]
+
+
+@override_settings(EXPLORER_S3_BUCKET="reporting-bucket")
+class Upload(TransactionBaseCase):
+    def setUp(self):
+        self.s3 = LocalS3()
+        self.journal = Journal.objects.first() or Journal.objects.create(name="eLife")
+        self.q = models.Query.objects.create(
+            title="dummy-query", sql="select id, name from publisher_journal;"
+        )
+
+    def call_command(self, *args):
+        with patch("publisher.management.commands.query_export.boto3.client") as mock:
+            mock.return_value = self.s3
+            return super().call_command("query_export", *args)
+
+    def test_upload(self):
+        "a query is streamed to S3 and copied to a timestamped key"
+        code, stdout = self.call_command("--query-id", str(self.q.id))
+        self.assertEqual(code, 0)
+        daily_key = "query%s--dummy-query.csv" % self.q.id
+        self.assertEqual(len(self.s3.objects), 2)
+        timestamped_key = [key for key in self.s3.objects if key != daily_key][0]
+        self.assertTrue(
+            timestamped_key.startswith("query%s--dummy-query--" % self.q.id)
+        )
+        expected = "\ufeffid,name\r\n%s,%s\r\n" % (self.journal.id, self.journal.name)
+        self.assertEqual(self.s3.objects[daily_key].decode("utf-8"), expected)
+        self.assertEqual(self.s3.objects[daily_key], self.s3.objects[timestamped_key])
+        self.assertFalse(self.s3.uploads)
+
+    def test_upload_in_parts(self):
+        "rows are fetched and uploaded in parts"
+        Journal.objects.create(name="another journal")
+        with patch("publisher.management.commands.query_export.FETCH_SIZE", 1):
+            parts = list(query_export.csv_parts(self.q, part_size=1))
+        # header and first journal, second journal, empty remainder
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(parts[-1], b"")
+
+    def test_failed_upload_is_aborted(self):
+        models.Query.objects.filter(pk=self.q.pk).update(sql="select pants;")
+        code, _ = self.call_command("--query-id", str(self.q.id))
+        self.assertEqual(code, 1)
+        self.assertFalse(self.s3.objects)
+        self.assertFalse(self.s3.uploads)
+
+    def test_concurrent_upload(self):
+        "many queries are snapshotted concurrently"
+        models.Query.objects.create(title="another-query", sql="select 1;")
+        code, _ = self.call_command("--jobs", "2")
+        self.assertEqual(code, 0)
+        self.assertEqual(len(self.s3.objects), 4)
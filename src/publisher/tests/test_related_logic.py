@@ -1,7 +1,7 @@
 from os.path import join
 import json, copy
 from . import base
-from publisher import ajson_ingestor, models, relation_logic, utils  # , logic
+from publisher import ajson_ingestor, models, relation_logic, utils, codes  # , logic
 from django.core.exceptions import ValidationError
 import pytest
 
@@ -34,21 +34,19 @@ class RelatedInternally(base.BaseCase):
         pass
 
     def test_create_relation(self):
-        "an ArticleVersion can be related to an Article (if both exist)"
-        relationship = relation_logic.relate(self.av, self.a)
-        self.assertTrue(isinstance(relationship, models.ArticleVersionRelation))
+        "an ArticleVersion can be related to an Article (if both exist) with just an article msid"
+        art_list = relation_logic.sync_msid_list(self.av, [self.msid2])
+        self.assertEqual(art_list, [self.a])
+        relationship = models.ArticleVersionRelation.objects.get()
+        self.assertEqual(relationship.articleversion, self.av)
+        self.assertEqual(relationship.related_to, self.a)
 
     def test_create_relation_is_idempotent(self):
         "creating a relationship is idempotent"
         for n in range(1, 10):
-            relation_logic.relate(self.av, self.a)
+            relation_logic.sync_msid_list(self.av, [self.msid2])
             self.assertEqual(1, models.ArticleVersionRelation.objects.count())
 
-    def test_create_relation_using_msid(self):
-        "a relationship between an article version can be created with just an article msid"
-        relationship = relation_logic.relate_using_msid(self.av, self.msid2)
-        self.assertTrue(isinstance(relationship, models.ArticleVersionRelation))
-
     """
     # possible business rule ...
     def test_relationship_cannot_be_created_with_self(self):
@@ -58,15 +56,62 @@ class RelatedInternally(base.BaseCase):
 
     def test_create_many_relations_using_msids(self):
         "relationships between an ArticleVersion and other articles can be created in bulk"
-        relationship_list = relation_logic.relate_using_msid_list(
-            self.av, [self.msid2, self.msid3]
+        art_list = relation_logic.sync_msid_list(self.av, [self.msid2, self.msid3])
+        self.assertEqual(
+            [art.manuscript_id for art in art_list], [self.msid2, self.msid3]
         )
-        self.assertEqual(2, models.ArticleVersionRelation.objects.count())
+        relationship_list = models.ArticleVersionRelation.objects.order_by(
+            "related_to__manuscript_id"
+        )
+        self.assertEqual(2, relationship_list.count())
         for relationship, msid in zip(relationship_list, [self.msid2, self.msid3]):
-            self.assertTrue(isinstance(relationship, models.ArticleVersionRelation))
             self.assertEqual(relationship.articleversion, self.av)
             self.assertEqual(relationship.related_to.manuscript_id, msid)
 
+    def test_sync_relations_using_msids(self):
+        "relationships can be synced with a list of msids, only changed relationships are written"
+        relation_logic.sync_msid_list(self.av, [self.msid2, self.msid3])
+        self.assertEqual(2, models.ArticleVersionRelation.objects.count())
+        original = models.ArticleVersionRelation.objects.get(related_to=self.a)
+
+        art_list = relation_logic.sync_msid_list(self.av, [str(self.msid2)])
+        self.assertEqual(art_list, [self.a])
+        # the unchanged relationship was left alone and the other removed
+        self.assertEqual(
+            [original.id],
+            list(models.ArticleVersionRelation.objects.values_list("id", flat=True)),
+        )
+
+    def test_sync_relations_using_msids_queries(self):
+        "the number of queries to sync relationships doesn't depend on the number of relationships"
+        # select articles, select relations, insert relations
+        with self.assertNumQueries(3):
+            relation_logic.sync_msid_list(self.av, [self.msid2, self.msid3])
+        # nothing has changed
+        with self.assertNumQueries(2):
+            relation_logic.sync_msid_list(self.av, [self.msid2, self.msid3])
+
+    def test_sync_relations_missing_article(self):
+        "syncing a relationship to an article that doesn't exist fails unless quiet"
+        with self.settings(RELATED_ARTICLE_STUBS=False):
+            self.assertRaises(
+                utils.StateError,
+                relation_logic.sync_msid_list,
+                self.av,
+                [self.msid2, 99],
+            )
+            relation_logic.sync_msid_list(self.av, [self.msid2, 99], quiet=True)
+            self.assertEqual(1, models.ArticleVersionRelation.objects.count())
+
+    def test_sync_relations_creates_stubs(self):
+        "stubs are created for articles that don't exist, if enabled"
+        with self.settings(RELATED_ARTICLE_STUBS=True):
+            art_list = relation_logic.sync_msid_list(self.av, [self.msid2, 98, 99])
+        self.assertEqual([a.manuscript_id for a in art_list], [self.msid2, 98, 99])
+        self.assertEqual(3, models.ArticleVersionRelation.objects.count())
+        stub = models.Article.objects.get(manuscript_id=99)
+        self.assertEqual(stub.doi, utils.msid2doi(99))
+
 
 class RelatedExternally(base.BaseCase):
     def setUp(self):
@@ -112,39 +157,54 @@ class RelatedExternally(base.BaseCase):
     def test_create_external_relationship(self):
         "an article can be related to an external object"
         self.assertEqual(0, models.ArticleVersionExtRelation.objects.count())
-        relationship = relation_logic.associate(self.av, self.citation)
+        (relationship,) = relation_logic.sync_citation_list(self.av, [self.citation])
         self.assertEqual(1, models.ArticleVersionExtRelation.objects.count())
         self.assertEqual(relationship.articleversion, self.av)
 
     def test_create_external_relationship_idempotent(self):
         "an article can be related to an external object"
         self.assertEqual(0, models.ArticleVersionExtRelation.objects.count())
-        relation_logic.associate(self.av, self.citation)
-        relation_logic.associate(self.av, self.citation)
+        relation_logic.sync_citation_list(self.av, [self.citation])
+        relation_logic.sync_citation_list(self.av, [self.citation])
         self.assertEqual(1, models.ArticleVersionExtRelation.objects.count())
 
-    def test_external_relationship_data(self):
+    def test_create_many_external_relationships(self):
+        self.assertEqual(0, models.ArticleVersionExtRelation.objects.count())
+        relation_logic.sync_citation_list(self.av, [self.citation, self.citation2])
+        self.assertEqual(2, models.ArticleVersionExtRelation.objects.count())
+
+    def test_sync_external_relationships(self):
+        "external relationships can be synced with a list of citations, only changed relationships are written"
+        relation_logic.sync_citation_list(self.av, [self.citation, self.citation2])
+        self.assertEqual(2, models.ArticleVersionExtRelation.objects.count())
+        original = models.ArticleVersionExtRelation.objects.get(
+            uri=self.citation["uri"]
+        )
+
+        self.citation["journal"] = "Pants"
+        relation_logic.sync_citation_list(self.av, [self.citation])
+        avr = models.ArticleVersionExtRelation.objects.get()
+        self.assertEqual(avr.id, original.id)
+        self.assertEqual(avr.citation["journal"], "Pants")
+
+    def test_sync_external_relationship_data(self):
         self.assertRaises(
-            ValidationError, relation_logic.associate, self.av, self.bad_citation
-        )  # not a uri
+            ValidationError,
+            relation_logic.sync_citation_list,
+            self.av,
+            [self.bad_citation],
+        )
         self.assertRaises(
-            AssertionError, relation_logic.associate, self.av, None
+            AssertionError, relation_logic.sync_citation_list, self.av, [None]
         )  # not a dict
         self.assertRaises(
-            AssertionError, relation_logic.associate, self.av, {}
+            AssertionError, relation_logic.sync_citation_list, self.av, [{}]
         )  # empty
 
-    def test_create_many_external_relationships(self):
-        self.assertEqual(0, models.ArticleVersionExtRelation.objects.count())
-        relation_logic.relate_using_citation_list(
-            self.av, [self.citation, self.citation2]
-        )
-        self.assertEqual(2, models.ArticleVersionExtRelation.objects.count())
-
     def test_external_relationships_are_also_removed(self):
-        relation_logic.associate(self.av, self.citation)
+        relation_logic.sync_citation_list(self.av, [self.citation])
         self.assertEqual(1, models.ArticleVersionExtRelation.objects.count())
-        relation_logic.remove_relationships(self.av)
+        relation_logic.sync_citation_list(self.av, [])
         self.assertEqual(0, models.ArticleVersionExtRelation.objects.count())
 
 
@@ -304,6 +364,25 @@ class IngestPublish(base.BaseCase):
             avr = models.ArticleVersionRelation.objects.all()
             self.assertEqual(0, avr.count())
 
+    def test_dry_run_agrees_with_ingest(self):
+        "a dry run and a real ingest agree on related articles given as strings in the article-json"
+        models.ArticleVersionRelation.objects.all().delete()
+        data = json.load(
+            open(join(self.fixture_dir, "relatedness", "elife-13038-v1.xml.json"))
+        )
+        data["article"]["version"] = 2
+        with self.settings(RELATED_ARTICLE_STUBS=False):
+            data["article"]["-related-articles-internal"] = ["13620"]
+            ajson_ingestor.ingest(data, dry_run=True)  # article 13620 exists
+            ajson_ingestor.ingest(data)
+            self.assertEqual(1, models.ArticleVersionRelation.objects.count())
+
+            data["article"]["-related-articles-internal"] = ["13620", "42"]
+            for dry_run in [True, False]:
+                with self.assertRaises(utils.StateError) as cm:
+                    ajson_ingestor.ingest(data, dry_run=dry_run)
+                self.assertEqual(cm.exception.code, codes.NO_RECORD)
+
     def test_forced_ingest_passes_with_nonexistant_relations(self):
         "an article that is related to an article that doesn't exist cannot be ingested (unless forced)."
         models.ArticleVersionRelation.objects.all().delete()
@@ -416,6 +495,35 @@ class RelationList(base.BaseCase):
                 "for %r I expected relations to %r" % (msid, expected_relations),
             )
 
+    def test_relation_msids(self):
+        "manuscript ids of related articles, forwards and backwards, are returned without duplicates in a single query"
+        create_relationships = [
+            (self.msid1, [self.msid2, self.msid3]),  # 1 => 2, 3
+            (self.msid2, [self.msid3, self.msid1]),  # 2 => 3, 1
+            (self.msid3, [self.msid1]),  # 3 => 1
+        ]
+        base._relate_using_msids(create_relationships)
+
+        expected_relationships = [
+            (self.msid1, sorted([self.msid2, self.msid3])),
+            (self.msid2, sorted([self.msid1, self.msid3])),
+            (self.msid3, sorted([self.msid1, self.msid2])),
+        ]
+        for msid, expected in expected_relationships:
+            av = models.Article.objects.get(manuscript_id=msid).latest_version
+            with self.assertNumQueries(1):
+                actual = relation_logic.internal_relationship_msids(av)
+            self.assertEqual(expected, actual)
+            self.assertEqual(
+                [
+                    art.manuscript_id
+                    for art in relation_logic.internal_relationships_for_article_version(
+                        av
+                    )
+                ],
+                actual,
+            )
+
     def test_relation_data(self):
         "we expect to see the article object of the related article"
         create_relationships = [(self.msid1, [self.msid2])]  # 1 => 2
@@ -7,7 +7,9 @@ from publisher.tests import base
 import pytz
 from datetime import date, datetime, timedelta
 from django.utils import timezone
+from dateutil import parser
 from django.conf import settings
+from django.db import transaction
 
 
 class Errors(base.BaseCase):
@@ -97,6 +99,15 @@ class TestUtils(base.BaseCase):
         self.assertRaises(AssertionError, utils.ensure, False, "msg")
         self.assertRaises(AssertionError, utils.ensure, False, "%s")
 
+    def test_readonly(self):
+        "reads are allowed within a `readonly` block, writes are refused"
+        with utils.readonly():
+            self.assertEqual(models.Journal.objects.count(), 0)
+            with self.assertRaises(utils.LaxAssertionError):
+                with transaction.atomic():
+                    models.Journal.objects.create(name="foo")
+        self.assertEqual(models.Journal.objects.count(), 0)
+
     def test_dxdoi_link(self):
         cases = [("eLife.09560", "https://dx.doi.org/eLife.09560")]
         for given, expected in cases:
@@ -114,8 +125,8 @@ class TestUtils(base.BaseCase):
             tzinfo=pytz.utc,
         )
         struct = {"dt": dt}
-        expected = '{"dt": "2001-01-01T23:59:59Z"}'
-        self.assertEqual(utils.json_dumps(struct), expected)
+        expected = {"dt": "2001-01-01T23:59:59Z"}
+        self.assertEqual(json.loads(utils.json_dumps(struct)), expected)
 
     def test_json_dumps_rfc3339_on_non_utc(self):
         # nice, but don't do this. the timezone changes with DST
@@ -134,8 +145,8 @@ class TestUtils(base.BaseCase):
             tzinfo=fixed_offset,
         )
         struct = {"dt": dt}
-        expected = '{"dt": "2001-01-01T00:00:59Z"}'
-        self.assertEqual(utils.json_dumps(struct), expected)
+        expected = {"dt": "2001-01-01T00:00:59Z"}
+        self.assertEqual(json.loads(utils.json_dumps(struct)), expected)
 
     def test_resolve_paths(self):
         tests_dir = join(settings.SRC_DIR, "publisher", "tests", "fixtures")
@@ -362,6 +373,27 @@ class TestUtils(base.BaseCase):
         for string, expected in cases:
             self.assertEqual(utils.todt(string), expected)
 
+    def test_parse_datetime(self):
+        "the fast ISO-8601 path gives the same results as dateutil"
+        cases = [
+            "2001-01-01",
+            "2001-01-01T00:00:00",
+            "2001-01-01T23:30:30Z",
+            "2001-01-01 23:30:30.5Z",
+            "2001-01-01T23:30:30.123456789+00:00",
+            "2001-01-01T23:30:30+09:30",
+            "2001-01-01T23:30:30-0200",
+            "2001-01-01T23:30",
+            # not ISO-8601, handled by dateutil
+            "Jan 1st 2001 11:30pm",
+        ]
+        for string in cases:
+            self.assertEqual(utils.parse_datetime(string), parser.parse(string))
+            self.assertEqual(utils.todt(string).tzinfo, pytz.utc)
+
+        for string in ["2001-13-01", "2001-01-01T25:00:00Z", "pants"]:
+            self.assertRaises(ValueError, utils.parse_datetime, string)
+
     def test_to_date(self):
         cases = [
             (None, None),
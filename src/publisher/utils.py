@@ -2,18 +2,21 @@ from collections import OrderedDict
 from functools import reduce
 import jsonschema
 from jsonschema.exceptions import relevance, ValidationError
-import os, copy, json, glob
+import os, re, copy, json, glob, importlib
+import django
+from django.apps import apps
 import pytz
 from dateutil import parser
 from django.utils import timezone
-from datetime import datetime, date
-from functools import partial
+from datetime import datetime, date, timedelta, timezone as dt_timezone
+from functools import partial, lru_cache
+from contextlib import contextmanager
 import logging
 from django.db.models.fields.related import ManyToManyField
-from rfc3339 import rfc3339
-from django.db import transaction, IntegrityError
+from django.db import transaction, connections
 from django.conf import settings
 import traceback
+from . import codec
 
 LOG = logging.getLogger(__name__)
 
@@ -61,25 +64,40 @@ class LaxAssertionError(AssertionError):
         return self.args[0]
 
 
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "CREATE", "DROP", "ALTER", "TRUNCATE")
+
+
+@contextmanager
+def readonly(using="default"):
+    """refuses to execute any statement that writes to the database within the block.
+    a dry run that attempts to write is a bug and fails loudly rather than silently writing.
+    """
+
+    def guard(execute, sql, params, many, context):
+        ensure(
+            not sql.lstrip().upper().startswith(WRITE_STATEMENTS),
+            "refusing to write to the database within a read-only block: %s" % sql,
+        )
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(guard):
+        yield
+
+
 def atomic(fn):
+    """wraps `fn` in a transaction.
+    when `dry_run=True` no transaction is opened. `fn` is called with `dry_run=True` and is expected
+    to do its work in memory, any attempt to write to the database raises a `LaxAssertionError`.
+    """
+
     def wrapper(*args, **kwargs):
-        result, rollback_key = None, "dry run rollback"
         # NOTE: dry_run must always be passed as keyword parameter (dry_run=True)
         dry_run = kwargs.pop("dry_run", False)
-        try:
-            with transaction.atomic():
-                result = fn(*args, **kwargs)
-                if dry_run:
-                    # `transaction.rollback()` doesn't work here because the `transaction.atomic()`
-                    # block is expecting to do all the work and only rollback on exceptions
-                    raise IntegrityError(rollback_key)
-                return result
-        except IntegrityError as err:
-            message = err.args[0]
-            if dry_run and message == rollback_key:
-                return result
-            # this was some other IntegrityError
-            raise
+        if dry_run:
+            with readonly():
+                return fn(*args, dry_run=True, **kwargs)
+        with transaction.atomic():
+            return fn(*args, **kwargs)
 
     return wrapper
 
@@ -186,6 +204,44 @@ def ymd(dt):
         return dt.strftime("%Y-%m-%d")
 
 
+# the RFC 3339 and ISO-8601 formats we actually receive:
+# 2015-09-24, 2015-09-24T00:00:00, 2015-09-24T00:00:00Z, 2015-09-24 00:00:00.123456+05:30
+ISO_8601_REGEX = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[Tt ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?"
+    r"(?:([Zz])|([+-])(\d{2}):?(\d{2}))?$"
+)
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(val):
+    """parses a formatted datetime string into a datetime object, naive if `val` has no timezone.
+    strict ISO-8601 strings are parsed directly and anything else is handed to dateutil.
+    results are memoised, the same dates are seen over and over again."""
+    match = ISO_8601_REGEX.match(val)
+    if not match:
+        return parser.parse(val, fuzzy=False)
+    year, month, day, hour, minute, second, fraction, zulu, sign, tzh, tzm = (
+        match.groups()
+    )
+    tzinfo = None
+    if zulu:
+        tzinfo = pytz.utc
+    elif sign:
+        offset = timedelta(hours=int(tzh), minutes=int(tzm))
+        tzinfo = dt_timezone(-offset if sign == "-" else offset) if offset else pytz.utc
+    return datetime(
+        int(year),
+        int(month),
+        int(day),
+        int(hour or 0),
+        int(minute or 0),
+        int(second or 0),
+        int((fraction or "0").ljust(6, "0")),
+        tzinfo=tzinfo,
+    )
+
+
 def todt(val):
     "turn almost any formatted datetime string into a UTC datetime object"
     if val is None:
@@ -194,7 +250,7 @@ def todt(val):
     if type(dt) == date:
         dt = datetime(year=dt.year, month=dt.month, day=dt.day)
     if not isinstance(dt, datetime):
-        dt = parser.parse(val, fuzzy=False)
+        dt = parse_datetime(val)
     dt.replace(microsecond=0)  # not useful, never been useful, will never be useful.
 
     if not dt.tzinfo:
@@ -218,7 +274,7 @@ def to_date(dt):
     if type(dt) == datetime:
         return dt.date()
     if type(dt) == str:
-        dt = parser.parse(dt, fuzzy=False)
+        dt = parse_datetime(dt)
         dt = dt.astimezone(pytz.utc)
         return dt.date()
     raise ValueError("unsupported type %r" % type(dt))
@@ -234,7 +290,15 @@ def ymdhms(dt):
     "returns an rfc3339 representation of a datetime object"
     if dt:
         dt = todt(dt)  # convert to utc, etc
-        return rfc3339(dt, utc=True)
+        # same as `rfc3339(dt, utc=True)` for a UTC datetime, without the overhead
+        return "%04d-%02d-%02dT%02d:%02d:%02dZ" % (
+            dt.year,
+            dt.month,
+            dt.day,
+            dt.hour,
+            dt.minute,
+            dt.second,
+        )
 
 
 # stolen from:
@@ -315,28 +379,14 @@ def ordered_json_loads(data):
     return json_loads(data, object_pairs_hook=OrderedDict)
 
 
-def json_dumps(obj, **kwargs):
-    "drop-in for json.dumps that handles datetime objects."
-
-    def _handler(obj):
-        # datetime objects: 2015-03-17T00:00:00+00:00
-        # date objects: 2015-03-17
-        obj_t = type(obj)
-        if obj_t == date:
-            return ymd(obj)
-        if obj_t == datetime:
-            return ymdhms(obj)
-        raise TypeError(
-            "Object of type %s with value of %s is not JSON serializable"
-            % (type(obj), repr(obj))
-        )
-
-    return json.dumps(obj, default=_handler, **kwargs)
+def json_dumps(obj, indent=None):
+    "drop-in for json.dumps that handles datetime objects. see `codec.dumps`."
+    return codec.dumps(obj, indent=indent)
 
 
 def deepcopy_data(data):
     "a faster `deepcopy` for standard data. No support for objects."
-    return json.loads(json.dumps(data))
+    return codec.copy(data)
 
 
 # http://stackoverflow.com/questions/29847098/the-best-way-to-merge-multi-nested-dictionaries-in-python-2-7
@@ -372,6 +422,32 @@ def unique(seq):
     return list(dict.fromkeys(seq))
 
 
+def chunks(iterable, chunk_size):
+    "yields lists of at most `chunk_size` items from `iterable`"
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def call_in_worker(module_name, fn_name, *args):
+    """calls the function `fn_name` in module `module_name` with `args`, setting up Django first if necessary.
+    joblib's worker processes are fresh interpreters and modules that import models can't be unpickled in them
+    until Django is set up. pass this function to `delayed` and the function to call by name:
+
+    `Parallel(n_jobs=4)(delayed(call_in_worker)(__name__, "fn", arg) for arg in arg_list)`
+
+    the function's arguments must be plain values, not model instances, for the same reason.
+    """
+    if not apps.ready:
+        django.setup()
+    return getattr(importlib.import_module(module_name), fn_name)(*args)
+
+
 #
 #
 #
@@ -380,7 +456,7 @@ def unique(seq):
 def validate(struct, schema_path):
     try:
         # this has the effect of converting any datetime objects to rfc3339 formatted strings
-        struct = json.loads(json_dumps(struct))
+        struct = codec.copy(struct)
     except ValueError as err:
         LOG.error("struct is not serializable: %s", err.message)
         raise